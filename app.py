@@ -1,14 +1,19 @@
 import streamlit as st
 import os
-from src.config import init_settings, DATA_DIR
-from src.loader import DocumentLoader
-from src.indexer import DocumentIndexer
+from datetime import datetime, time, timedelta
+from src.config import init_settings, embedding_cache_stats, warm_up, DATA_DIR, WARMUP_ON_START
+from src.index_builder import IndexBuilder
 from src.storage import IndexStorage
 from src.query_engine import RAGQueryEngine
+from src.metadata_index import QueryFilter
 from src.evaluator import RAGEvaluator
 from src.history_manager import HistoryManager
+from src.tracing import trace, traced_stream
+from src.context_budget import record_savings
 import uuid
 
+ARCHIVE_PAGE_SIZE = 20
+
 # Page Configuration
 st.set_page_config(page_title="Modular RAG Pro", page_icon="🏗️", layout="wide")
 
@@ -106,40 +111,181 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def render_eval_badges(e):
+    """Faithfulness/relevancy badges for an evaluated answer."""
+    f_class = "badge-pass" if e["faithfulness"] else "badge-fail"
+    r_class = "badge-pass" if e["relevancy"] else "badge-fail"
+    st.markdown(f"""
+        <div style="display: flex; margin-top: 10px; gap: 8px;">
+            <span class="badge {f_class}"><i data-lucide="shield-check" class="li-icon"></i>Faithful: {e['faithfulness']}</span>
+            <span class="badge {r_class}"><i data-lucide="target" class="li-icon"></i>Relevant: {e['relevancy']}</span>
+        </div>
+    """, unsafe_allow_html=True)
+
+def render_eval_status(msg):
+    """Badges once evaluation is done, a placeholder while it runs in the background."""
+    if msg.get("eval"):
+        render_eval_badges(msg["eval"])
+    elif msg.get("eval_status") == "pending":
+        st.caption("⏳ Evaluating faithfulness & relevancy...")
+    elif msg.get("eval_status") == "failed":
+        st.caption("⚠️ Evaluation unavailable.")
+
+def render_timings(msg):
+    """Optional per-stage latency breakdown of an answer (and of its evaluation once done)."""
+    if not st.session_state.get("show_timings"):
+        return
+    timing = msg.get("trace")
+    eval_timings = (msg.get("eval") or {}).get("timings_ms")
+    if not timing and not eval_timings:
+        return
+    label = f"⏱️ {timing['total_ms']:.0f} ms" if timing else "⏱️ Timings"
+    with st.expander(label, expanded=False):
+        rows = [{"stage": k, "ms": v} for k, v in (timing or {}).get("stages", {}).items()]
+        rows += [{"stage": k, "ms": v} for k, v in (eval_timings or {}).items()]
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        counters = (timing or {}).get("counters")
+        if counters and "tokens.prompt" in counters:
+            st.caption(
+                f"📉 {counters['tokens.prompt']:g} prompt tokens sent, "
+                f"{counters.get('context.tokens_saved', 0) + counters.get('memory.tokens_saved', 0):g} saved"
+                + (f" (~{counters['latency.saved_ms_est']:.0f} ms)" if "latency.saved_ms_est" in counters else "")
+            )
+        if counters:
+            st.caption(" · ".join(f"{k}: {v:g}" for k, v in counters.items()))
+
+def render_scope_filters(engine):
+    """Sidebar controls restricting retrieval to selected sources; returns a QueryFilter or None."""
+    metadata = engine.metadata
+    files = st.multiselect("Files", metadata.values("file_name"), key="filter_files")
+    extensions = st.multiselect("File types", metadata.values("extension"), key="filter_exts")
+    dates = ()
+    ingested = metadata.ingestion_range()
+    if ingested:
+        first, last = (datetime.fromtimestamp(t).date() for t in ingested)
+        dates = st.date_input("Ingested between", value=(first, last), key="filter_dates")
+    col1, col2 = st.columns(2)
+    page_min = col1.number_input("From page", min_value=0, value=0, step=1, key="filter_page_min")
+    page_max = col2.number_input("To page", min_value=0, value=0, step=1, key="filter_page_max")
+
+    query_filter = QueryFilter(
+        files=files or None,
+        extensions=extensions or None,
+        ingested_after=datetime.combine(dates[0], time.min).timestamp() if len(dates) == 2 and dates[0] > first else None,
+        ingested_before=(
+            datetime.combine(dates[1] + timedelta(days=1), time.min).timestamp()
+            if len(dates) == 2 and dates[1] < last else None
+        ),
+        page_min=int(page_min) or None,
+        page_max=int(page_max) or None,
+    )
+    if query_filter.is_empty:
+        return None
+    st.caption(f"🔎 {len(metadata.match(query_filter))} chunks in scope")
+    return query_filter
+
+def schedule_evaluation(prompt, response, msg, session_id, position, answer_cache=None, cache_key=None):
+    """Evaluate in the background; fill in the badges and update the stored message when done."""
+    def on_done(result, error):
+        if error is None:
+            msg["eval"] = result
+            msg["eval_status"] = "done"
+            if answer_cache is not None and cache_key:
+                answer_cache.attach_eval(cache_key, result)
+        else:
+            msg["eval_status"] = "failed"
+        HistoryManager.update_message(session_id, position, msg)
+
+    msg["eval_status"] = "pending"
+    return RAGEvaluator.submit(prompt, response, callback=on_done)
+
+def render_build_result(job):
+    """Outcome of the last background index build."""
+    if job.state == "failed":
+        st.error(f"Index build failed: {job.error}")
+        return
+    if job.diff is None:
+        return
+    if job.index is None:
+        # Nothing was published: either no documents or no changes
+        (st.warning if job.phase == "No documents found" else st.info)(f"{job.phase}.")
+    else:
+        c = job.diff.summary()
+        st.success(
+            f"Index stored! {c['added']} added, {c['changed']} changed, "
+            f"{c['removed']} removed, {c['unchanged']} unchanged "
+            f"({job.status()['elapsed_s']:.0f}s)."
+        )
+        if c["duplicates"]:
+            st.caption(
+                f"♻️ {c['duplicates']} of {c['chunks']} chunks were duplicates "
+                f"({c['dedup_ratio']:.0%}) and are stored once."
+            )
+    for path, error in job.diff.failed.items():
+        st.warning(f"⚠️ Could not parse `{os.path.basename(path)}`: {error}")
+
 # Initialize Session State
-@st.cache_resource(show_spinner="Warming up logic engine...")
-def load_rag_assets():
-    """Cached initialization of index and query engine."""
-    index = IndexStorage.load_index()
-    engine = RAGQueryEngine(index) if index else None
+@st.cache_resource(show_spinner="Warming up logic engine...", max_entries=2)
+def load_rag_assets(version):
+    """
+    Cached initialization of index and query engine for one published index
+    version (shared by all browser sessions; conversation memory is per session,
+    keyed by current_session_id). A version built by this process is reused as is.
+    """
+    index = IndexBuilder.built_index(version) or IndexStorage.load_index(IndexStorage.version_dir(version))
+    engine = RAGQueryEngine(index, history_loader=HistoryManager.load_session) if index else None
+    if engine and engine.answer_cache:
+        # Answers cached against the previous version must not be served
+        engine.answer_cache.invalidate()
     return index, engine
 
+def sync_index_version():
+    """Switch this browser session to the published index version if a build replaced it."""
+    version = IndexStorage.current_version()
+    if "index_version" not in st.session_state or st.session_state.index_version != version:
+        st.session_state.index, st.session_state.query_engine = load_rag_assets(version)
+        st.session_state.index_version = version
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """Load the models in a background thread once per process, while the UI renders."""
+    return warm_up(background=True) if WARMUP_ON_START else None
+
 if "initialized" not in st.session_state:
     if init_settings():
+        start_warmup()
         st.session_state.initialized = True
-        st.session_state.index, st.session_state.query_engine = load_rag_assets()
         st.session_state.current_session_id = str(uuid.uuid4())
     else:
         st.error("GROQ_API_KEY not found. Please check your .env file.")
         st.stop()
 
+# Queries keep using the loaded version until a finished build is published
+sync_index_version()
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if "eval_futures" not in st.session_state:
+    st.session_state.eval_futures = []
+
+if "archive_limit" not in st.session_state:
+    st.session_state.archive_limit = ARCHIVE_PAGE_SIZE
+
 # Sidebar: Parsing, Loading, Storing, and ARCHIVE
 with st.sidebar:
     st.markdown('### <i data-lucide="folder-open" class="li-icon"></i> Workspace', unsafe_allow_html=True)
     
     # 1. ARCHIVE OF CHATS
     st.markdown('#### <i data-lucide="history" class="li-icon"></i> Chat Archive', unsafe_allow_html=True)
-    sessions = HistoryManager.list_sessions()
+    sessions = HistoryManager.list_sessions(limit=st.session_state.archive_limit)
     
     # "New Chat" button
     if st.button("➕ New Chat", use_container_width=True, type="primary"):
+        if st.session_state.query_engine:
+            st.session_state.query_engine.reset_session(st.session_state.current_session_id)
         st.session_state.current_session_id = str(uuid.uuid4())
         st.session_state.messages = []
-        if st.session_state.query_engine:
-            st.session_state.query_engine.memory.reset()
         st.rerun()
 
     for s in sessions:
@@ -155,19 +301,26 @@ with st.sidebar:
             ):
                 st.session_state.current_session_id = s["id"]
                 st.session_state.messages = HistoryManager.load_session(s["id"])
-                # Also reset query engine memory to this history if needed (simplified here)
+                # Rebuild this session's conversation memory from the archive
                 if st.session_state.query_engine:
-                    st.session_state.query_engine.memory.reset()
+                    st.session_state.query_engine.restore_session(s["id"], st.session_state.messages)
                 st.rerun()
         
         with col2:
             if st.button("🗑️", key=f"del_{s['id']}", use_container_width=True):
                 HistoryManager.delete_session(s["id"])
+                if st.session_state.query_engine:
+                    st.session_state.query_engine.reset_session(s["id"])
                 if is_active:
                     st.session_state.current_session_id = str(uuid.uuid4())
                     st.session_state.messages = []
                 st.rerun()
 
+    if len(sessions) == st.session_state.archive_limit and HistoryManager.count_sessions() > len(sessions):
+        if st.button("Show older chats", use_container_width=True):
+            st.session_state.archive_limit += ARCHIVE_PAGE_SIZE
+            st.rerun()
+
     st.divider()
 
     with st.expander("🛠️ Data Pipeline", expanded=False):
@@ -195,16 +348,45 @@ with st.sidebar:
             help="Specify which file extensions to parse from the data directory."
         )
 
-        if st.button("🏗️ Build/Update Index", use_container_width=True):
-            with st.spinner("Indexing documents..."):
-                docs = DocumentLoader.load_from_data_dir(required_exts=allowed_exts)
-                if docs:
-                    st.session_state.index = DocumentIndexer.create_index(docs)
-                    IndexStorage.persist_index(st.session_state.index)
-                    st.session_state.query_engine = RAGQueryEngine(st.session_state.index)
-                    st.success("Index stored!")
+        build_job = IndexBuilder.job()
+        building = build_job is not None and build_job.running
+        if st.button("🏗️ Build/Update Index", use_container_width=True, disabled=building):
+            # Runs in the background; chat keeps answering from the current index meanwhile
+            IndexBuilder.start(required_exts=allowed_exts)
+            st.rerun()
+
+        if building:
+            @st.fragment(run_every=1.0)
+            def watch_build():
+                job = IndexBuilder.job()
+                if job.running:
+                    st.progress(job.progress, text=job.phase)
                 else:
-                    st.warning("No documents foundation.")
+                    st.rerun()
+
+            watch_build()
+        elif build_job is not None:
+            render_build_result(build_job)
+
+        cache_stats = embedding_cache_stats()
+        if cache_stats:
+            st.caption(
+                f"Embedding cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} vectors"
+            )
+        if st.session_state.query_engine and st.session_state.query_engine.answer_cache:
+            answer_stats = st.session_state.query_engine.answer_cache.stats()
+            st.caption(
+                f"Answer cache: {answer_stats['hits']} hits / {answer_stats['misses']} misses "
+                f"({answer_stats['hit_rate']:.0%}), {answer_stats['entries']} answers"
+            )
+
+    st.session_state.query_filter = None
+    if st.session_state.query_engine:
+        with st.expander("🔎 Search Scope", expanded=False):
+            st.session_state.query_filter = render_scope_filters(st.session_state.query_engine)
+
+    st.toggle("⏱️ Show timing breakdown", key="show_timings")
 
 # Main Chat: Querying & Evaluation
 st.markdown('# <i data-lucide="bot" class="li-icon" style="width: 40px; height: 40px;"></i> RAG Archive Analyst', unsafe_allow_html=True)
@@ -214,58 +396,93 @@ st.caption(f"🛡️ Secure Session: {st.session_state.current_session_id}")
 for msg in st.session_state.messages:
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
-        if msg["role"] == "assistant" and "eval" in msg:
-            e = msg["eval"]
-            f_class = "badge-pass" if e["faithfulness"] else "badge-fail"
-            r_class = "badge-pass" if e["relevancy"] else "badge-fail"
-            st.markdown(f"""
-                <div style="display: flex; margin-top: 10px; gap: 8px;">
-                    <span class="badge {f_class}"><i data-lucide="shield-check" class="li-icon"></i>Faithful: {e['faithfulness']}</span>
-                    <span class="badge {r_class}"><i data-lucide="target" class="li-icon"></i>Relevant: {e['relevancy']}</span>
-                </div>
-            """, unsafe_allow_html=True)
+        if msg["role"] == "assistant":
+            render_eval_status(msg)
+            render_timings(msg)
 
 # Input
 if prompt := st.chat_input("Query your documents..."):
     if not st.session_state.query_engine:
         st.warning("Please build the index first using the sidebar!")
     else:
+        engine = st.session_state.query_engine
+        # Materialize the session (restoring evicted memory from the archive) before this turn is stored
+        engine.session(st.session_state.current_session_id)
+
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        user_msg = {"role": "user", "content": prompt}
+        st.session_state.messages.append(user_msg)
+        HistoryManager.append_message(st.session_state.current_session_id, user_msg)
         with st.chat_message("user"):
             st.markdown(prompt)
 
         # Get response
         with st.chat_message("assistant"):
-            with st.spinner("Retrieving & Analyzing..."):
-                # Use the new high-precision method
-                response = st.session_state.query_engine.query_with_precision(prompt)
-                
-                # Perform Evaluation
-                eval_results = RAGEvaluator.evaluate(prompt, response)
-                
-                content = str(response)
-                st.markdown(content)
-                
-                # Show evaluation markers
-                f_class = "badge-pass" if eval_results["faithfulness"] else "badge-fail"
-                r_class = "badge-pass" if eval_results["relevancy"] else "badge-fail"
-                st.markdown(f"""
-                    <div style="display: flex; margin-top: 10px; gap: 8px;">
-                        <span class="badge {f_class}"><i data-lucide="shield-check" class="li-icon"></i>Faithful: {eval_results['faithfulness']}</span>
-                        <span class="badge {r_class}"><i data-lucide="target" class="li-icon"></i>Relevant: {eval_results['relevancy']}</span>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                # Update history session state
-                st.session_state.messages.append({
+            with trace("chat", session_id=st.session_state.current_session_id) as turn:
+                with st.spinner("Retrieving..."):
+                    # Repeated / near-duplicate questions are answered from the semantic cache
+                    cached, ticket = engine.lookup_answer(
+                        prompt,
+                        session_id=st.session_state.current_session_id,
+                        filters=st.session_state.query_filter
+                    )
+
+                if not cached:
+                    with st.spinner("Retrieving..."):
+                        # Stream tokens as they arrive instead of waiting for the full completion
+                        # Reuses the retrieval the cache lookup already made
+                        response = engine.stream_with_precision(
+                            prompt,
+                            session_id=st.session_state.current_session_id,
+                            filters=st.session_state.query_filter,
+                            ticket=ticket
+                        )
+                    content = st.write_stream(traced_stream(response.response_gen))
+                    if not isinstance(content, str):
+                        content = "".join(map(str, content))
+                    record_savings(turn)
+            timing = turn.summary() if turn else None
+
+            if cached:
+                st.markdown(cached.response)
+                msg = {
                     "role": "assistant",
-                    "content": content,
-                    "eval": eval_results
-                })
-                
-                # PERSIST TO ARCHIVE
-                HistoryManager.save_session(
-                    st.session_state.current_session_id, 
-                    st.session_state.messages
-                )
+                    "content": cached.response,
+                    "eval": cached.eval,
+                    "cached": True,
+                    "trace": timing
+                }
+                st.session_state.messages.append(msg)
+                HistoryManager.append_message(st.session_state.current_session_id, msg)
+                st.caption(f"⚡ Served from answer cache (similarity {cached.similarity:.2f})")
+                render_eval_status(msg)
+            else:
+                cache_key = engine.remember_answer(ticket, response)
+
+                # Show the answer now; evaluation runs in the background and fills in the badges
+                msg = {"role": "assistant", "content": content, "eval": None, "eval_status": "pending", "trace": timing}
+                st.session_state.messages.append(msg)
+                # PERSIST TO ARCHIVE (single-row append; evaluation updates it later)
+                position = HistoryManager.append_message(st.session_state.current_session_id, msg)
+                st.session_state.eval_futures.append(schedule_evaluation(
+                    prompt,
+                    response,
+                    msg,
+                    st.session_state.current_session_id,
+                    position,
+                    answer_cache=engine.answer_cache,
+                    cache_key=cache_key
+                ))
+                render_eval_status(msg)
+            render_timings(msg)
+
+# Re-render once background evaluations complete
+if st.session_state.eval_futures:
+    @st.fragment(run_every=1.0)
+    def watch_evaluations():
+        pending = [f for f in st.session_state.eval_futures if not f.done()]
+        if len(pending) != len(st.session_state.eval_futures):
+            st.session_state.eval_futures = pending
+            st.rerun()
+
+    watch_evaluations()
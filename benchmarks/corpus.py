@@ -0,0 +1,99 @@
+"""Synthetic corpora and a deterministic embedding so benchmarks run offline and reproducibly."""
+import hashlib
+import os
+import random
+import re
+from typing import List, Tuple
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+
+_SYLLABLES = ["ka", "lo", "mi", "ren", "tu", "sa", "vor", "el", "qui", "na", "dor", "pe", "zan", "ix", "ul", "bra"]
+
+
+def make_vocabulary(size: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class SyntheticCorpus:
+    """
+    Zipf-distributed pseudo-text: a few very common words plus a long tail,
+    so BM25 and dense scores behave like they would on real documents.
+    Queries are sampled from document sentences, so each has a known source file.
+    """
+
+    def __init__(self, n_docs: int, words_per_doc: int = 800, vocab_size: int = 20000, seed: int = 0):
+        self.n_docs = n_docs
+        self.words_per_doc = words_per_doc
+        self.seed = seed
+        self.vocab = make_vocabulary(vocab_size, seed)
+        ranks = np.arange(1, vocab_size + 1, dtype=np.float64)
+        self._probs = (1.0 / ranks) / (1.0 / ranks).sum()
+
+    def _document(self, i: int) -> str:
+        rng = np.random.default_rng(self.seed * 1_000_003 + i)
+        words = rng.choice(len(self.vocab), size=self.words_per_doc, p=self._probs)
+        sentences, pos = [], 0
+        while pos < len(words):
+            n = int(rng.integers(8, 20))
+            sentence = " ".join(self.vocab[w] for w in words[pos:pos + n])
+            sentences.append(sentence.capitalize() + ".")
+            pos += n
+        paragraphs = [" ".join(sentences[j:j + 6]) for j in range(0, len(sentences), 6)]
+        return f"# Document {i}\n\n" + "\n\n".join(paragraphs) + "\n"
+
+    def write(self, directory: str) -> List[str]:
+        """Write the corpus as alternating .txt/.md files; returns the file paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for i in range(self.n_docs):
+            path = os.path.join(directory, f"doc_{i:06d}.{'md' if i % 2 else 'txt'}")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._document(i))
+            paths.append(path)
+        return paths
+
+    def queries(self, n: int, seed: int = 1) -> List[Tuple[int, str]]:
+        """(source document index, query) pairs: six consecutive words from a random sentence."""
+        rng = random.Random(seed)
+        out = []
+        for _ in range(n):
+            doc_i = rng.randrange(self.n_docs)
+            sentences = re.split(r"(?<=\.)\s+", self._document(doc_i).split("\n\n", 1)[1])
+            words = rng.choice(sentences).rstrip(".").split()
+            start = rng.randrange(max(1, len(words) - 6))
+            out.append((doc_i, " ".join(words[start:start + 6])))
+        return out
+
+
+class HashEmbedding(BaseEmbedding):
+    """
+    Deterministic feature-hashing embedding (signed token buckets, L2-normalized).
+    Texts sharing words get similar vectors, at a tiny fraction of a real model's cost.
+    """
+
+    dim: int = 384
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
@@ -0,0 +1,224 @@
+"""
+End-to-end benchmark: ingestion, persistence, engine start-up, retrieval and query latency.
+
+    python -m benchmarks.run --sizes 100 1000 5000
+    python -m benchmarks.run --embed minilm --compare benchmarks/results/<previous>.json
+
+Runs offline by default (MockLLM + deterministic hash embedding, reranker disabled).
+Results are written as JSON under benchmarks/results/ so runs can be diffed across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Benchmarks must never call out to the hosted reranker or download one; load_dotenv() won't override this
+os.environ["COHERE_API_KEY"] = ""
+os.environ["RERANKER"] = "none"
+# Stages below time a single (unsharded) index
+os.environ["SHARD_BY"] = "none"
+
+import numpy as np
+from llama_index.core.llms import MockLLM
+from src.bm25_store import BM25Index
+from src.config import EMBED_MODEL_NAME, init_settings
+from src.indexer import DocumentIndexer
+from src.loader import DocumentLoader
+from src.query_engine import RAGQueryEngine
+from src.storage import IndexStorage
+from .corpus import HashEmbedding, SyntheticCorpus
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class StageTimer:
+    """Wall time and (optionally) tracemalloc peak per named stage."""
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"seconds": round(time.perf_counter() - start, 4)}
+            if self.trace_memory:
+                record["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                tracemalloc.stop()
+            self.stages[name] = record
+
+
+def latency_summary(samples) -> dict:
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "qps": round(len(ms) / (ms.sum() / 1000), 2) if ms.sum() else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_size(n_docs: int, args) -> dict:
+    corpus = SyntheticCorpus(n_docs, words_per_doc=args.words_per_doc, seed=args.seed)
+    timer = StageTimer(trace_memory=not args.no_memory)
+    result = {"n_docs": n_docs, "stages": timer.stages}
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        data_dir = os.path.join(tmp, "data")
+        persist_dir = os.path.join(tmp, "storage")
+        paths = corpus.write(data_dir)
+        result["corpus_mb"] = round(sum(os.path.getsize(p) for p in paths) / 2**20, 2)
+
+        if args.loader in ("serial", "both"):
+            with timer.stage("load_serial"):
+                documents = [doc for p in paths for doc in DocumentLoader.load_file(p)]
+        if args.loader in ("parallel", "both"):
+            with timer.stage("load_parallel"):
+                documents = [doc for parsed in DocumentLoader.iter_files(paths) for doc in parsed.documents]
+
+        with timer.stage("create_index"):
+            index = DocumentIndexer.create_index(documents)
+        nodes = list(index.docstore.docs.values())
+        result["n_nodes"] = len(nodes)
+        result["docs_per_s"] = round(n_docs / timer.stages["create_index"]["seconds"], 2)
+        result["nodes_per_s"] = round(len(nodes) / timer.stages["create_index"]["seconds"], 2)
+
+        with timer.stage("bm25_build"):
+            BM25Index().add(nodes)
+
+        with timer.stage("persist_index"):
+            IndexStorage.persist_index(index, persist_dir=persist_dir)
+        result["index_mb"] = round(sum(
+            os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(persist_dir) for f in files
+        ) / 2**20, 2)
+        del index
+
+        with timer.stage("load_index"):
+            index = IndexStorage.load_index(persist_dir)
+        with timer.stage("engine_init"):
+            engine = RAGQueryEngine(index, answer_cache=None)
+
+        queries = corpus.queries(args.queries, seed=args.seed + 1)
+        # First query pays for the lazy vector memory map and BM25 load
+        with timer.stage("first_retrieval"):
+            engine.retriever.retrieve(queries[0][1])
+
+        latencies, hits = [], 0
+        for doc_i, query in queries:
+            start = time.perf_counter()
+            retrieved = engine.retriever.retrieve(query)
+            latencies.append(time.perf_counter() - start)
+            expected = os.path.basename(paths[doc_i])
+            hits += any(n.node.metadata.get("file_name") == expected for n in retrieved)
+        result["retrieval"] = latency_summary(latencies)
+        result["retrieval"]["hit_rate"] = round(hits / len(queries), 4)
+
+        latencies = []
+        for _, query in queries[:args.llm_queries]:
+            start = time.perf_counter()
+            engine.query_engine.query(query)
+            latencies.append(time.perf_counter() - start)
+        if latencies:
+            result["query"] = latency_summary(latencies)
+
+    return result
+
+
+def compare(current: dict, baseline_path: str):
+    """Print per-metric ratios (current / baseline) for sizes present in both runs."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["n_docs"]: r for r in json.load(f)["runs"]}
+    print(f"\nvs {baseline_path} (ratio > 1 is slower)")
+    for run in current["runs"]:
+        base = baseline.get(run["n_docs"])
+        if base is None:
+            continue
+        print(f"  n_docs={run['n_docs']}")
+        for name, stage in run["stages"].items():
+            if name in base["stages"] and base["stages"][name]["seconds"]:
+                print(f"    {name:<16} {stage['seconds'] / base['stages'][name]['seconds']:6.2f}x")
+        for section in ("retrieval", "query"):
+            if section in run and section in base:
+                print(f"    {section + ' p50':<16} {run[section]['p50_ms'] / base[section]['p50_ms']:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, persistence and retrieval on synthetic corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000], help="Corpus sizes (documents)")
+    parser.add_argument("--words-per-doc", type=int, default=800)
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per size")
+    parser.add_argument("--llm-queries", type=int, default=20, help="End-to-end queries through the (mock) LLM")
+    parser.add_argument("--loader", choices=["serial", "parallel", "both"], default="both")
+    parser.add_argument("--embed", choices=["hash", "minilm"], default="hash",
+                        help=f"Deterministic hash embedding, or the real {EMBED_MODEL_NAME} (uncached)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc (lower timing overhead)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Result JSON path (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Baseline result JSON to compare against")
+    args = parser.parse_args(argv)
+
+    if args.embed == "minilm":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
+    else:
+        embed_model = HashEmbedding()
+    init_settings(llm=MockLLM(max_tokens=32), embed_model=embed_model)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "runs": [],
+    }
+    for n_docs in args.sizes:
+        print(f"n_docs={n_docs} ...", file=sys.stderr)
+        run = bench_size(n_docs, args)
+        report["runs"].append(run)
+        stages = ", ".join(f"{k}={v['seconds']:.2f}s" for k, v in run["stages"].items())
+        print(f"  {run['n_nodes']} nodes; {stages}; retrieval p50={run['retrieval']['p50_ms']}ms "
+              f"p99={run['retrieval']['p99_ms']}ms hit_rate={run['retrieval']['hit_rate']}", file=sys.stderr)
+    # ru_maxrss is in KiB on Linux
+    report["meta"]["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Cold-start benchmark: time to first render vs. time to first answer.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --embed hash --compare benchmarks/results/startup-<previous>.json
+
+Each run is a fresh interpreter that replays the app's start-up sequence:
+
+    import      importing the modules app.py imports
+    init        init_settings()
+    first_render  import + init (what the UI waits for before drawing)
+    index_load  IndexStorage.load_index() of a small prebuilt index
+    engine      RAGQueryEngine construction
+    first_answer  everything up to a retrieved + generated answer (MockLLM),
+                  including loading the embedding model on first use
+
+The index is built once per invocation in a temporary directory.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ["import", "init", "first_render", "index_load", "engine", "first_answer"]
+
+
+def _offline_env():
+    # No reranker, and no embedding cache: a cached query vector would skip the model load
+    os.environ["COHERE_API_KEY"] = ""
+    os.environ["RERANKER"] = "none"
+    os.environ["EMBED_CACHE_MAX_MB"] = "0"
+    os.environ["SHARD_BY"] = "none"
+
+
+def _heavy_modules():
+    return [m for m in ("torch", "sentence_transformers", "groq", "cohere", "scipy.sparse") if m in sys.modules]
+
+
+def _embed_model(kind: str):
+    if kind == "hash":
+        from .corpus import HashEmbedding
+        return HashEmbedding()
+    return None  # the app's default: MiniLM, loaded on first use
+
+
+def child(persist_dir: str, embed: str, query: str):
+    """One cold start; prints cumulative phase timings (seconds since the first import) as JSON."""
+    _offline_env()
+    t0 = time.perf_counter()
+    marks = {}
+    from src.config import init_settings
+    from src.indexer import DocumentIndexer  # noqa: F401
+    from src.storage import IndexStorage
+    from src.query_engine import RAGQueryEngine
+    from src.evaluator import RAGEvaluator  # noqa: F401
+    from src.history_manager import HistoryManager  # noqa: F401
+    marks["import"] = time.perf_counter() - t0
+
+    from llama_index.core.llms import MockLLM
+    start = time.perf_counter()
+    init_settings(llm=MockLLM(max_tokens=32), embed_model=_embed_model(embed))
+    marks["init"] = time.perf_counter() - start
+    marks["first_render"] = time.perf_counter() - t0
+    heavy_at_render = _heavy_modules()
+
+    start = time.perf_counter()
+    index = IndexStorage.load_index(persist_dir)
+    marks["index_load"] = time.perf_counter() - start
+    start = time.perf_counter()
+    engine = RAGQueryEngine(index, answer_cache=None)
+    marks["engine"] = time.perf_counter() - start
+    engine.query_engine.query(query)
+    marks["first_answer"] = time.perf_counter() - t0
+
+    print(json.dumps({
+        "marks": marks,
+        "heavy_modules_at_first_render": heavy_at_render,
+        "heavy_modules_at_first_answer": _heavy_modules(),
+    }))
+
+
+def build_index(persist_dir: str, embed: str, n_docs: int):
+    from llama_index.core.llms import MockLLM
+    from src.config import init_settings
+    from src.indexer import DocumentIndexer
+    from src.loader import DocumentLoader
+    from src.storage import IndexStorage
+    from .corpus import SyntheticCorpus
+
+    init_settings(llm=MockLLM(max_tokens=32), embed_model=_embed_model(embed))
+    corpus = SyntheticCorpus(n_docs)
+    paths = corpus.write(os.path.join(os.path.dirname(persist_dir), "data"))
+    documents = [doc for p in paths for doc in DocumentLoader.load_file(p)]
+    IndexStorage.persist_index(DocumentIndexer.create_index(documents), persist_dir=persist_dir)
+    return corpus.queries(1)[0][1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start: time to first render and to first answer.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start (median is reported)")
+    parser.add_argument("--docs", type=int, default=50, help="Documents in the prebuilt index")
+    parser.add_argument("--embed", choices=["hash", "minilm"], default="minilm",
+                        help="minilm measures the real model load; hash runs without model weights")
+    parser.add_argument("-o", "--output", help="Result JSON path (default: benchmarks/results/startup-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Baseline startup JSON to compare against")
+    parser.add_argument("--child", nargs=3, metavar=("PERSIST_DIR", "EMBED", "QUERY"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(*args.child)
+
+    _offline_env()
+    from .run import git_commit
+    with tempfile.TemporaryDirectory(prefix="rag-startup-") as tmp:
+        persist_dir = os.path.join(tmp, "storage")
+        query = build_index(persist_dir, args.embed, args.docs)
+
+        runs = []
+        for i in range(args.runs):
+            start = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup", "--child", persist_dir, args.embed, query],
+                cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            result["process_s"] = time.perf_counter() - start
+            runs.append(result)
+            print(f"run {i + 1}: " + ", ".join(f"{k}={v:.2f}s" for k, v in result["marks"].items()), file=sys.stderr)
+
+    summary = {p: round(statistics.median(r["marks"][p] for r in runs), 4) for p in PHASES}
+    summary["process"] = round(statistics.median(r["process_s"] for r in runs), 4)
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "args": {k: v for k, v in vars(args).items() if k != "child"},
+        },
+        "median_s": summary,
+        "heavy_modules_at_first_render": runs[0]["heavy_modules_at_first_render"] if runs else [],
+        "runs": runs,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"startup-{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"first render {summary['first_render']:.2f}s, first answer {summary['first_answer']:.2f}s "
+          f"(median of {args.runs}); written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["median_s"]
+        print(f"\nvs {args.compare} (ratio > 1 is slower)")
+        for phase, value in summary.items():
+            if baseline.get(phase):
+                print(f"  {phase:<14} {value / baseline[phase]:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
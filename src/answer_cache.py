@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+
+
+class CacheTicket:
+    """What a lookup computed for a query, reused to store the answer on a miss."""
+
+    def __init__(
+        self, query: str, embedding: List[float], index_version: str, node_ids: List[str],
+        nodes: Optional[list] = None, query_filter=None
+    ):
+        self.query = query
+        self.embedding = embedding
+        self.index_version = index_version
+        self.node_ids = node_ids
+        # Retrieved nodes and the filter they were retrieved under, reused to answer a miss
+        self.nodes = nodes
+        self.query_filter = query_filter
+
+
+class CachedAnswer:
+    """An answer served from the semantic cache, shaped like a chat response."""
+
+    def __init__(self, key: str, response: str, source_nodes: list, eval_results: Optional[dict], similarity: float):
+        self.key = key
+        self.response = response
+        self.source_nodes = source_nodes
+        self.eval = eval_results
+        self.similarity = similarity
+
+    def __str__(self) -> str:
+        return self.response
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache for repeated and near-duplicate questions.
+
+    An entry matches when the query embedding is within `threshold` cosine
+    similarity, the index version is the same and the top `match_nodes`
+    retrieved node ids are identical. Entries expire after `ttl_seconds`
+    and the least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512, ttl_seconds: float = 3600, match_nodes: int = 3):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.match_nodes = match_nodes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._matrix = None
+        self._keys: List[str] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        v = np.asarray(embedding, dtype=np.float32)
+        return v / (np.linalg.norm(v) or 1.0)
+
+    def _rebuild_matrix(self):
+        self._keys = list(self._entries)
+        self._matrix = (
+            np.stack([self._entries[k]["embedding"] for k in self._keys])
+            if self._keys else None
+        )
+
+    def _expire(self, now: float):
+        expired = [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.expirations += len(expired)
+            self._matrix = None
+
+    def lookup(self, ticket: CacheTicket) -> Optional[CachedAnswer]:
+        """Return a cached answer for the ticket, or None on a miss."""
+        with self._lock:
+            self._expire(time.time())
+            if self._matrix is None:
+                self._rebuild_matrix()
+            if self._matrix is not None:
+                sims = self._matrix @ self._normalize(ticket.embedding)
+                wanted = ticket.node_ids[:self.match_nodes]
+                for i in np.argsort(-sims):
+                    if sims[i] < self.threshold:
+                        break
+                    key = self._keys[i]
+                    entry = self._entries[key]
+                    if entry["index_version"] == ticket.index_version and entry["node_ids"][:self.match_nodes] == wanted:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return CachedAnswer(key, entry["response"], entry["source_nodes"], entry["eval"], float(sims[i]))
+            self.misses += 1
+            return None
+
+    def store(self, ticket: CacheTicket, response: str, source_nodes: list, eval_results: Optional[dict] = None) -> str:
+        """Cache an answer; returns the entry key (used to attach evaluation later)."""
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._entries[key] = {
+                "embedding": self._normalize(ticket.embedding),
+                "index_version": ticket.index_version,
+                "node_ids": list(ticket.node_ids),
+                "response": response,
+                "source_nodes": list(source_nodes or []),
+                "eval": eval_results,
+                "created_at": time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+        return key
+
+    def attach_eval(self, key: str, eval_results: dict):
+        """Record evaluation results that finished after the answer was cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["eval"] = eval_results
+
+    def invalidate(self):
+        """Drop every entry (e.g. after the index was rebuilt)."""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
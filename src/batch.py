@@ -0,0 +1,176 @@
+"""
+Headless batch runner: answer a JSONL file of queries without the UI.
+
+    python -m src.batch queries.jsonl -o answers.jsonl --concurrency 8 --evaluate
+
+Each input line is a JSON object with a "query" (or "question") field, an
+optional "id" and optional "filters" (QueryFilter fields, e.g.
+{"extensions": [".pdf"], "page_min": 3}). One JSON line per query is written to the output as soon as
+it finishes (--append keeps the lines of earlier runs). Answers are always generated, never served
+from the semantic answer cache. Use --mock-llm / --mock-embed to run fully offline.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from .config import init_settings, EMBED_MODEL_NAME
+from .evaluator import RAGEvaluator
+from .metadata_index import QueryFilter
+from .query_engine import RAGQueryEngine
+from .storage import IndexStorage
+from .tracing import trace
+
+MOCK_EMBED_DIM = 384  # matches all-MiniLM-L6-v2, so mock runs can use a real index
+
+
+def read_queries(path: str):
+    """Yield (id, query, filter) triples from a JSONL file, skipping blank lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            query = record.get("query") or record.get("question")
+            if not query:
+                raise ValueError(f"{path}:{line_no}: missing 'query' field")
+            try:
+                query_filter = QueryFilter(**record["filters"]) if record.get("filters") else None
+            except TypeError as e:
+                raise ValueError(f"{path}:{line_no}: invalid 'filters': {e}") from None
+            yield record.get("id", line_no), query, query_filter
+
+
+def retry_delay(error: Exception, attempt: int, base_delay: float) -> float:
+    """
+    Seconds to wait before retrying, or -1 if the error is not retryable.
+    Rate limits (HTTP 429) honour Retry-After; timeouts and 5xx back off exponentially.
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    message = str(error).lower()
+    rate_limited = status == 429 or "rate limit" in message or "too many requests" in message
+    transient = (
+        rate_limited
+        or (isinstance(status, int) and status >= 500)
+        or isinstance(error, (asyncio.TimeoutError, ConnectionError))
+        or "timeout" in message
+    )
+    if not transient:
+        return -1
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after") if hasattr(headers, "get") else None
+    if rate_limited and retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return base_delay * (2 ** attempt) * (1 + random.random() * 0.25)
+
+
+class BatchRunner:
+    """Runs queries concurrently through the async LLM APIs and streams results to JSONL."""
+
+    def __init__(self, engine: RAGQueryEngine, concurrency: int = 4, max_retries: int = 5,
+                 base_delay: float = 1.0, evaluate: bool = False):
+        self.engine = engine
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.evaluate = evaluate
+        self.stats = {"ok": 0, "failed": 0, "retries": 0}
+
+    async def _with_retries(self, make_call):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_call()
+            except Exception as e:
+                delay = retry_delay(e, attempt, self.base_delay)
+                if delay < 0 or attempt == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def answer(self, query_id, query: str, query_filter: QueryFilter = None) -> dict:
+        """Stateless equivalent of query_with_precision: sanitize, retrieve, rerank, generate."""
+        start = time.perf_counter()
+        sanitized = self.engine._sanitize_input(query)
+        record = {"id": query_id, "query": query}
+        with trace("batch", query_id=query_id) as t:
+            try:
+                with self.engine.retriever.filtered(query_filter):
+                    response = await self._with_retries(lambda: self.engine.query_engine.aquery(sanitized))
+                record["answer"] = str(response.response)
+                record["source_node_ids"] = [n.node.node_id for n in response.source_nodes]
+                record["source_scores"] = [n.score for n in response.source_nodes]
+                if self.evaluate:
+                    record["eval"] = await self._with_retries(lambda: RAGEvaluator.aevaluate(query, response))
+                self.stats["ok"] += 1
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                self.stats["failed"] += 1
+        record["latency_s"] = round(time.perf_counter() - start, 4)
+        if t is not None:
+            record["timings_ms"] = t.breakdown()
+        return record
+
+    async def run(self, queries, out):
+        """Answer all queries with at most `concurrency` in flight, writing each result as it completes."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(query_id, query, query_filter):
+            async with semaphore:
+                record = await self.answer(query_id, query, query_filter)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        await asyncio.gather(*(worker(*q) for q in queries))
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL workload of queries against the persisted index.")
+    parser.add_argument("input", help="JSONL file with one {'id', 'query'} object per line")
+    parser.add_argument("-o", "--output", default="-", help="Output JSONL path (default: stdout)")
+    parser.add_argument("--append", action="store_true", help="Append to the output file instead of replacing it")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Max queries in flight")
+    parser.add_argument("--retries", type=int, default=5, help="Max retries per LLM call on rate limits/transient errors")
+    parser.add_argument("--evaluate", action="store_true", help="Add faithfulness/relevancy scores")
+    parser.add_argument("--mock-llm", action="store_true", help="Use LlamaIndex MockLLM (no API key, offline)")
+    parser.add_argument("--mock-embed", action="store_true", help=f"Use MockEmbedding instead of {EMBED_MODEL_NAME}")
+    args = parser.parse_args(argv)
+
+    llm = embed_model = None
+    if args.mock_llm:
+        from llama_index.core.llms import MockLLM
+        llm = MockLLM(max_tokens=64)
+    if args.mock_embed:
+        from llama_index.core.embeddings import MockEmbedding
+        embed_model = MockEmbedding(embed_dim=MOCK_EMBED_DIM)
+    if not init_settings(llm=llm, embed_model=embed_model):
+        parser.error("GROQ_API_KEY not found (use --mock-llm to run offline).")
+
+    index = IndexStorage.load_index()
+    if index is None:
+        parser.error("No index found; build it from the app first.")
+
+    runner = BatchRunner(
+        RAGQueryEngine(index, use_answer_cache=False),
+        concurrency=args.concurrency,
+        max_retries=args.retries,
+        evaluate=args.evaluate
+    )
+    queries = list(read_queries(args.input))
+    out = sys.stdout if args.output == "-" else open(args.output, "a" if args.append else "w", encoding="utf-8")
+    try:
+        stats = asyncio.run(runner.run(queries, out))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{stats['ok']} answered, {stats['failed']} failed, {stats['retries']} retries", file=sys.stderr)
+    return 0 if not stats["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
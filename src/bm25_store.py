@@ -0,0 +1,338 @@
+import os
+import re
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+BM25_DIR = "bm25"
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he in is it its of on or that the
+this to was were will with not no do does did so if than then there these those
+they we you your our their i me my him her his she them what which who whom how
+""".split())
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class CorpusStats(NamedTuple):
+    """
+    Collection statistics that BM25 scores depend on (live documents, their
+    total length and the document frequency of the query terms). Summed over
+    shards, they let every shard score as part of one corpus.
+    """
+
+    n_docs: int
+    total_len: int
+    df: Dict[str, int]
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.n_docs if self.n_docs else 1.0
+
+    @classmethod
+    def merge(cls, parts: Sequence["CorpusStats"]) -> "CorpusStats":
+        df: Dict[str, int] = {}
+        for part in parts:
+            for term, count in part.df.items():
+                df[term] = df.get(term, 0) + count
+        return cls(sum(p.n_docs for p in parts), sum(p.total_len for p in parts), df)
+
+
+def _sparse():
+    """scipy.sparse, imported on first use so loading the app does not pay for it."""
+    from scipy import sparse
+    return sparse
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a sparse document-term matrix.
+
+    Term frequencies are kept as a CSR matrix together with document
+    frequencies and document lengths, so new nodes are tokenized once and
+    appended, and queries are a sparse matrix-vector product. Persisted as
+    .npy arrays under `<persist_dir>/bm25` and loaded on first use.
+    """
+
+    _registry = weakref.WeakKeyDictionary()
+
+    def __init__(self, persist_dir: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.persist_dir = persist_dir
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._loaded = persist_dir is None
+        self._vocab: Dict[str, int] = {}
+        self._terms: List[str] = []
+        self._node_ids: List[str] = []
+        self._ref_doc_ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._ref_rows: Optional[Dict[str, List[int]]] = None
+        self._tf = None  # CSR term frequencies, created on first use
+        self._pending: list = []
+        self._df = np.zeros(0, dtype=np.int64)
+        self._doc_len = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._weights = None
+        self._weights_avgdl = None
+        self._version = 0
+
+    # ---- index registry ----------------------------------------------------
+
+    @classmethod
+    def attach(cls, index, bm25: "BM25Index") -> "BM25Index":
+        """Associate a BM25 index with a vector index."""
+        cls._registry[index] = bm25
+        return bm25
+
+    @classmethod
+    def for_index(cls, index) -> "BM25Index":
+        """BM25 index attached to a vector index, built from its docstore if none is attached."""
+        bm25 = cls._registry.get(index)
+        if bm25 is None:
+            bm25 = cls()
+            bm25.add(list(index.docstore.docs.values()))
+            cls.attach(index, bm25)
+        return bm25
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, BM25_DIR, "node_ids.tsv"))
+
+    # ---- loading / persistence ---------------------------------------------
+
+    def _path(self, persist_dir: str, name: str) -> str:
+        return os.path.join(persist_dir, BM25_DIR, name)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            with open(self._path(self.persist_dir, "vocab.txt"), "r", encoding="utf-8") as f:
+                self._terms = f.read().split("\n")[:-1]
+            self._vocab = {t: i for i, t in enumerate(self._terms)}
+            with open(self._path(self.persist_dir, "node_ids.tsv"), "r", encoding="utf-8") as f:
+                for line in f:
+                    node_id, _, ref_doc_id = line.rstrip("\n").partition("\t")
+                    self._node_ids.append(node_id)
+                    self._ref_doc_ids.append(ref_doc_id)
+            self._id_to_row = {n: i for i, n in enumerate(self._node_ids)}
+
+            load = lambda name: np.load(self._path(self.persist_dir, name))
+            self._tf = _sparse().csr_matrix(
+                (load("tf_data.npy"), load("tf_indices.npy"), load("tf_indptr.npy")),
+                shape=(len(self._node_ids), len(self._terms)),
+            )
+            self._df = load("df.npy").astype(np.int64)
+            self._doc_len = load("doc_len.npy")
+            self._alive = np.ones(len(self._node_ids), dtype=bool)
+            self._loaded = True
+
+    def persist(self, persist_dir: str):
+        """Write the (compacted) index as .npy arrays plus plain-text vocab/ids."""
+        self._ensure_loaded()
+        with self._lock:
+            tf = self._matrix()
+            keep = np.flatnonzero(self._alive)
+            if len(keep) != tf.shape[0]:
+                tf = tf[keep]
+            tf.sort_indices()
+            os.makedirs(os.path.join(persist_dir, BM25_DIR), exist_ok=True)
+
+            def save_array(name, array):
+                path = self._path(persist_dir, name)
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, array)
+                os.replace(path + ".tmp", path)
+
+            def save_lines(name, lines):
+                path = self._path(persist_dir, name)
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.writelines(lines)
+                os.replace(path + ".tmp", path)
+
+            save_array("tf_data.npy", tf.data.astype(np.float32))
+            save_array("tf_indices.npy", tf.indices.astype(np.int32))
+            save_array("tf_indptr.npy", tf.indptr.astype(np.int64))
+            save_array("df.npy", self._df.astype(np.int32))
+            save_array("doc_len.npy", self._doc_len[keep].astype(np.int32))
+            save_lines("vocab.txt", (t + "\n" for t in self._terms))
+            save_lines("node_ids.tsv", (f"{self._node_ids[r]}\t{self._ref_doc_ids[r]}\n" for r in keep))
+
+            self._tf = tf
+            self._pending = []
+            self._node_ids = [self._node_ids[r] for r in keep]
+            self._ref_doc_ids = [self._ref_doc_ids[r] for r in keep]
+            self._id_to_row = {n: i for i, n in enumerate(self._node_ids)}
+            self._ref_rows = None
+            self._doc_len = self._doc_len[keep]
+            self._alive = np.ones(len(keep), dtype=bool)
+            self._weights = None
+            self.persist_dir = persist_dir
+
+    # ---- mutation ----------------------------------------------------------
+
+    def _matrix(self) -> "sparse.csr_matrix":
+        sparse = _sparse()
+        if self._tf is None:
+            self._tf = sparse.csr_matrix((0, len(self._terms)), dtype=np.float32)
+        if self._pending:
+            n_terms = len(self._terms)
+            blocks = [m if m.shape[1] == n_terms else sparse.csr_matrix(
+                (m.data, m.indices, m.indptr), shape=(m.shape[0], n_terms)
+            ) for m in [self._tf] + self._pending]
+            self._tf = sparse.vstack(blocks, format="csr")
+            self._pending = []
+        return self._tf
+
+    def add(self, nodes: List[BaseNode]):
+        """Tokenize and append nodes; only the new text is processed."""
+        if not nodes:
+            return
+        self._ensure_loaded()
+        with self._lock:
+            self.delete_nodes([n.node_id for n in nodes if n.node_id in self._id_to_row])
+            indptr, indices, data, lengths = [0], [], [], []
+            for node in nodes:
+                counts = Counter(tokenize(node.get_content()))
+                for term, count in counts.items():
+                    col = self._vocab.get(term)
+                    if col is None:
+                        col = self._vocab[term] = len(self._terms)
+                        self._terms.append(term)
+                    indices.append(col)
+                    data.append(count)
+                indptr.append(len(indices))
+                lengths.append(sum(counts.values()))
+
+            block = _sparse().csr_matrix(
+                (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+                shape=(len(nodes), len(self._terms)),
+            )
+            self._df = np.concatenate([self._df, np.zeros(len(self._terms) - len(self._df), dtype=np.int64)])
+            np.add.at(self._df, block.indices, 1)
+
+            start = len(self._node_ids)
+            self._pending.append(block)
+            for offset, node in enumerate(nodes):
+                self._node_ids.append(node.node_id)
+                self._ref_doc_ids.append(node.ref_doc_id or "")
+                self._id_to_row[node.node_id] = start + offset
+                if self._ref_rows is not None:
+                    self._ref_rows.setdefault(node.ref_doc_id or "", []).append(start + offset)
+            self._doc_len = np.concatenate([self._doc_len, np.asarray(lengths, dtype=np.int32)])
+            self._alive = np.concatenate([self._alive, np.ones(len(nodes), dtype=bool)])
+            self._weights = None
+            self._version += 1
+
+    def _kill_rows(self, rows: List[int]):
+        rows = [r for r in rows if self._alive[r]]
+        if not rows:
+            return
+        tf = self._matrix()
+        np.add.at(self._df, tf[rows].indices, -1)
+        self._alive[rows] = False
+        for row in rows:
+            self._id_to_row.pop(self._node_ids[row], None)
+        self._weights = None
+        self._version += 1
+
+    def delete_ref_doc(self, ref_doc_id: str):
+        """Remove all nodes of a source document."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._ref_rows is None:
+                self._ref_rows = {}
+                for row, ref in enumerate(self._ref_doc_ids):
+                    self._ref_rows.setdefault(ref, []).append(row)
+            self._kill_rows(self._ref_rows.pop(ref_doc_id, []))
+
+    def delete_nodes(self, node_ids: List[str]):
+        """Remove nodes by id."""
+        self._ensure_loaded()
+        with self._lock:
+            self._kill_rows([self._id_to_row[n] for n in node_ids if n in self._id_to_row])
+
+    # ---- scoring -----------------------------------------------------------
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def node_ids(self) -> List[str]:
+        self._ensure_loaded()
+        return self._node_ids
+
+    def row_of(self, node_id: str) -> Optional[int]:
+        self._ensure_loaded()
+        return self._id_to_row.get(node_id)
+
+    def _weight_matrix(self, avgdl: Optional[float] = None) -> "sparse.csc_matrix":
+        """
+        Saturated, length-normalized term weights (CSC for fast column slicing),
+        normalized by this index's average document length unless `avgdl` is given.
+        """
+        if self._weights is None or self._weights_avgdl != avgdl:
+            tf = self._matrix().tocoo()
+            alive_len = self._doc_len[self._alive]
+            self._weights_avgdl = avgdl
+            if avgdl is None:
+                avgdl = int(alive_len.sum()) / len(alive_len) if len(alive_len) else 1.0
+            norm = self.k1 * (1 - self.b + self.b * self._doc_len / max(avgdl, 1e-9))
+            w = tf.data * (self.k1 + 1) / (tf.data + norm[tf.row])
+            w[~self._alive[tf.row]] = 0.0
+            self._weights = _sparse().csc_matrix((w.astype(np.float32), (tf.row, tf.col)), shape=tf.shape)
+        return self._weights
+
+    def idf(self) -> np.ndarray:
+        n_docs = int(self._alive.sum())
+        return np.log1p((n_docs - self._df + 0.5) / (self._df + 0.5)).astype(np.float32)
+
+    def corpus_stats(self, query: str) -> CorpusStats:
+        """This index's share of the collection statistics for the query's terms."""
+        self._ensure_loaded()
+        with self._lock:
+            terms = {t for t in tokenize(query) if t in self._vocab}
+            return CorpusStats(
+                int(self._alive.sum()),
+                int(self._doc_len[self._alive].sum()),
+                {t: int(self._df[self._vocab[t]]) for t in terms},
+            )
+
+    def scores(self, query: str, rows: Optional[np.ndarray] = None, corpus: Optional[CorpusStats] = None) -> np.ndarray:
+        """
+        BM25 score of every row (or a subset of rows) for the query; with
+        `corpus`, idf and length normalization use those statistics instead
+        of this index's own.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            counts = Counter(t for t in tokenize(query) if t in self._vocab)
+            n = len(self._node_ids) if rows is None else len(rows)
+            if not counts:
+                return np.zeros(n, dtype=np.float32)
+            cols = np.fromiter((self._vocab[t] for t in counts), dtype=np.int64)
+            if corpus is None:
+                idf = self.idf()[cols]
+                weights = self._weight_matrix()[:, cols]
+            else:
+                df = np.fromiter((corpus.df.get(t, 0) for t in counts), dtype=np.int64, count=len(counts))
+                idf = np.log1p((corpus.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+                weights = self._weight_matrix(corpus.avgdl)[:, cols]
+            qw = idf * np.fromiter(counts.values(), dtype=np.float32)
+            if rows is not None:
+                weights = weights.tocsr()[rows]
+            return np.asarray(weights @ qw, dtype=np.float32).ravel()
+
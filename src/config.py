@@ -1,9 +1,11 @@
 import os
+import threading
 from dotenv import load_dotenv
 from llama_index.core import Settings
-from llama_index.llms.groq import Groq
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core.node_parser import SentenceSplitter
+from . import tracing
+
+# Provider SDKs (Groq, HuggingFace/torch, Cohere) are imported inside the functions
+# that need them, and models load on first use, so importing this module is cheap.
 
 load_dotenv()
 
@@ -11,6 +13,8 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 STORAGE_DIR = os.path.join(BASE_DIR, "storage")
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+EMBED_CACHE_DIR = os.path.join(CACHE_DIR, "embeddings")
 
 # Ensure directories exist
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -20,15 +24,184 @@ os.makedirs(STORAGE_DIR, exist_ok=True)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 
-def init_settings():
-    if not GROQ_API_KEY:
-        return False
-    
+# Document parsing: worker processes and per-file timeout in seconds
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", str(os.cpu_count() or 1)))
+LOADER_FILE_TIMEOUT = float(os.getenv("LOADER_FILE_TIMEOUT", "300"))
+
+# Ingestion pipeline: embedding batch size, queue depth between stages,
+# and how many nodes to embed before flushing vectors to disk
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_FLUSH_NODES = int(os.getenv("PIPELINE_FLUSH_NODES", "4096"))
+
+# Chunk deduplication at ingestion: identical chunks (whitespace-normalized hash) and near
+# duplicates (MinHash estimate of word-shingle Jaccard >= DEDUP_NEAR_THRESHOLD, 0 = exact only)
+# are embedded once and point to every file they occur in. Near matching is off by default: a
+# revised copy of a document would otherwise never have its edited chunks embedded
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_NEAR_THRESHOLD = float(os.getenv("DEDUP_NEAR_THRESHOLD", "0"))
+
+# LLM (Groq) and the context window the prompt helper sizes prompts for
+LLM_MODEL_NAME = "llama-3.3-70b-versatile"
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+
+# Embedding model & on-disk embedding cache (0 disables the cache)
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+
+# Hybrid retrieval fusion: "rrf" (reciprocal rank) or "weighted" (alpha * dense + (1 - alpha) * BM25)
+HYBRID_FUSION_MODE = os.getenv("HYBRID_FUSION_MODE", "rrf")
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+
+# Index sharding: "none" (one index), "hash" (files spread over INDEX_SHARDS by path hash)
+# or "directory" (one shard per top-level folder of data/). Queries fan out over SHARD_WORKERS threads
+SHARD_BY = os.getenv("SHARD_BY", "none").lower()
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "8"))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Reranking: "auto" (Cohere with a key, else local), "cohere", "local" (CPU cross-encoder) or "none".
+# The local reranker scores up to RERANK_MAX_CANDIDATES chunks within RERANK_TIME_BUDGET_MS (0 = no budget)
+RERANKER = os.getenv("RERANKER", "auto").lower()
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_TIME_BUDGET_MS = float(os.getenv("RERANK_TIME_BUDGET_MS", "300"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+
+# Prompt packing: total tokens per answer (instructions + history + retrieved context).
+# Retrieved chunks get what history and instructions leave; overlapping chunks are merged and
+# chunks scoring below CONTEXT_MIN_SCORE_RATIO x the best score are dropped
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4096"))
+CONTEXT_MIN_SCORE_RATIO = float(os.getenv("CONTEXT_MIN_SCORE_RATIO", "0.3"))
+
+# Background answer evaluation: max evaluations running at once
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))
+
+# Per-session chat memory: token limit, idle eviction (seconds) and max cached sessions.
+# History beyond the limit is folded into a running LLM summary (MEMORY_SUMMARIZE=0 drops it instead)
+MEMORY_TOKEN_LIMIT = int(os.getenv("MEMORY_TOKEN_LIMIT", "1024"))
+MEMORY_SUMMARIZE = os.getenv("MEMORY_SUMMARIZE", "1") == "1"
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "100"))
+
+# Semantic answer cache (ANSWER_CACHE_MAX_ENTRIES=0 disables it)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+
+# Per-query tracing: latency histograms and trace log exported to TRACE_DIR
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+TRACE_DIR = os.path.join(CACHE_DIR, "traces")
+TRACE_LOG_MAX_MB = float(os.getenv("TRACE_LOG_MAX_MB", "50"))
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "5"))
+
+# Start loading the embedding model (and reranker) in a background thread at start-up
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+
+# Default models are built once per process and shared by every session
+_default_models = {}
+_default_models_lock = threading.Lock()
+
+def _groq_llm():
+    from llama_index.llms.groq import Groq
     # LLM: Llama 3.3 70B for high-precision logic
-    Settings.llm = Groq(model="llama-3.3-70b-versatile", api_key=GROQ_API_KEY)
-    
+    return Groq(model=LLM_MODEL_NAME, api_key=GROQ_API_KEY, context_window=LLM_CONTEXT_WINDOW, is_chat_model=True)
+
+def _huggingface_embedding():
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
     # Embedding: Optimized Local Model (No HF_TOKEN required, extremely fast)
-    Settings.embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    
+    return HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
+
+def _default_model(name: str):
+    """Process-wide lazy default LLM / embedding model; nothing heavy is loaded here."""
+    from .lazy_models import LazyEmbedding, LazyLLM
+    with _default_models_lock:
+        if name not in _default_models:
+            if name == "llm":
+                from llama_index.core.base.llms.types import LLMMetadata
+                # Same values the Groq client reports, so building engines does not construct it
+                model = LazyLLM(
+                    _groq_llm,
+                    metadata=LLMMetadata(
+                        context_window=LLM_CONTEXT_WINDOW,
+                        num_output=-1,
+                        is_chat_model=True,
+                        model_name=LLM_MODEL_NAME
+                    )
+                )
+            else:
+                model = LazyEmbedding(_huggingface_embedding, model_name=EMBED_MODEL_NAME)
+                if EMBED_CACHE_MAX_MB > 0:
+                    from .embedding_cache import CachedEmbedding
+                    # Content-addressed cache: rebuilds and repeated queries reuse stored vectors
+                    model = CachedEmbedding(
+                        model,
+                        cache_dir=EMBED_CACHE_DIR,
+                        max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024
+                    )
+            _default_models[name] = model
+        return _default_models[name]
+
+def init_settings(llm=None, embed_model=None):
+    """
+    Configure LlamaIndex global settings.
+    `llm` / `embed_model` override the defaults (e.g. mock models for offline runs);
+    without an override the Groq LLM requires GROQ_API_KEY. Default models are
+    only constructed on first use (see warm_up).
+    """
+    if llm is None and not GROQ_API_KEY:
+        return False
+    from llama_index.core.node_parser import SentenceSplitter
+
+    Settings.llm = llm or _default_model("llm")
+    Settings.embed_model = embed_model or _default_model("embed")
     Settings.node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=50)
+
+    tracing.configure(
+        TRACING_ENABLED, export_dir=TRACE_DIR, max_log_mb=TRACE_LOG_MAX_MB, flush_interval=TRACE_FLUSH_SECONDS
+    )
     return True
+
+def reranker_choice() -> str:
+    """RERANKER with "auto" resolved: Cohere when a key is set, otherwise the local cross-encoder."""
+    if RERANKER == "auto":
+        return "cohere" if COHERE_API_KEY else "local"
+    return RERANKER
+
+def _unwrap(model):
+    """The lazy model behind a (possibly cached) Settings model."""
+    return getattr(model, "_inner", model)
+
+def warm_up(background: bool = True):
+    """
+    Load the configured models ahead of the first query.
+    With background=True this returns immediately with the started thread.
+    """
+    def load():
+        for model in (Settings._llm, Settings._embed_model):
+            model = _unwrap(model)
+            if hasattr(model, "load"):
+                model.load()
+        reranker = reranker_choice()
+        if reranker == "cohere" and COHERE_API_KEY:
+            import llama_index.postprocessor.cohere_rerank  # noqa: F401
+        elif reranker == "local":
+            from .reranker import load_cross_encoder
+            try:
+                load_cross_encoder(RERANK_MODEL)
+            except Exception:
+                pass  # the reranker reports and disables itself on first use
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def embedding_cache_stats():
+    """Hit/miss counters of the embedding cache, or None when it is disabled."""
+    from .embedding_cache import CachedEmbedding
+    embed_model = Settings._embed_model
+    return embed_model.stats() if isinstance(embed_model, CachedEmbedding) else None
@@ -0,0 +1,126 @@
+from typing import List, Optional
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from . import tracing
+from .tracing import count_tokens
+
+# Longest chunk overlap looked for (characters); the splitter overlaps by 50 tokens
+_MAX_OVERLAP_CHARS = 2000
+_PROBE_CHARS = 64
+
+
+def _overlap(head: str, tail: str) -> int:
+    """Length of the longest suffix of `head` that is a prefix of `tail`."""
+    probe = tail[:_PROBE_CHARS]
+    if not probe:
+        return 0
+    pos = head.find(probe, max(0, len(head) - _MAX_OVERLAP_CHARS))
+    while pos != -1:
+        if tail.startswith(head[pos:]):
+            return len(head) - pos
+        pos = head.find(probe, pos + 1)
+    return 0
+
+
+class ContextBudget(BaseNodePostprocessor):
+    """
+    Packs retrieved chunks into a token budget before they reach the LLM.
+
+    Runs after the reranker. Chunks scoring below `min_score_ratio` times the
+    best score are dropped, text repeated between chunks of the same document
+    (the splitter's overlap, or a chunk contained in another) is cut from the
+    lower-scored chunk, and chunks are then added best first while they fit
+    into `token_budget` minus the query. The best chunk is always kept,
+    truncated if necessary. Token counts before and after are added to the
+    current trace.
+    """
+
+    token_budget: int = Field(default=2048)
+    min_score_ratio: float = Field(default=0.0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextBudget"
+
+    def _drop_low_scores(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        best = nodes[0].score
+        if not self.min_score_ratio or best is None or best <= 0:
+            return nodes
+        return [nodes[0]] + [n for n in nodes[1:] if (n.score or 0.0) >= self.min_score_ratio * best]
+
+    @staticmethod
+    def _with_text(node: NodeWithScore, text: str) -> NodeWithScore:
+        # Nodes may be shared with the docstore, so trimmed text goes on a copy
+        copy = node.node.model_copy()
+        copy.set_content(text)
+        return NodeWithScore(node=copy, score=node.score)
+
+    def _dedup(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """Remove text that a better-scored chunk of the same document already carries."""
+        kept: List[NodeWithScore] = []
+        for node in nodes:
+            text = node.node.get_content()
+            for other in kept:
+                if other.node.ref_doc_id != node.node.ref_doc_id:
+                    continue
+                kept_text = other.node.get_content()
+                if text in kept_text:
+                    text = ""
+                    break
+                cut = _overlap(kept_text, text)
+                if cut:
+                    text = text[cut:]
+                cut = _overlap(text, kept_text)
+                if cut:
+                    text = text[:len(text) - cut]
+            if not text.strip():
+                continue
+            kept.append(node if text == node.node.get_content() else self._with_text(node, text))
+        return kept
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return []
+        nodes = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+        tokens_in = sum(count_tokens(n.node.get_content(metadata_mode=MetadataMode.LLM)) for n in nodes)
+        budget = self.token_budget - (count_tokens(query_bundle.query_str) if query_bundle else 0)
+
+        packed, used = [], 0
+        for node in self._dedup(self._drop_low_scores(nodes)):
+            tokens = count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            if used + tokens <= budget:
+                packed.append(node)
+                used += tokens
+            elif not packed:
+                # Keep the best chunk even when it alone exceeds the budget, cut to size
+                text = node.node.get_content()
+                keep = max(1, int(len(text) * max(budget, 1) / tokens))
+                packed.append(self._with_text(node, text[:keep]))
+                used += count_tokens(packed[0].node.get_content(metadata_mode=MetadataMode.LLM))
+
+        tracing.count("context.tokens_in", tokens_in)
+        tracing.count("context.tokens_out", used)
+        tracing.count("context.tokens_saved", max(0, tokens_in - used))
+        tracing.count("context.nodes_dropped", len(nodes) - len(packed))
+        return packed
+
+
+def record_savings(t: Optional["tracing.Trace"]):
+    """
+    Estimate the latency the packed prompt saved this turn.
+
+    Uses the turn's own prompt processing rate (time to first token per
+    prompt token of the answer call), so it is only available for streamed
+    answers; network time is attributed to the prompt too, making this an
+    upper bound. Adds `latency.saved_ms_est` to the trace counters.
+    """
+    if t is None:
+        return
+    saved = t.counters.get("context.tokens_saved", 0) + t.counters.get("memory.tokens_saved", 0)
+    ttft = [s.attrs["ttft_ms"] for s in t.spans if s.name == "stream" and "ttft_ms" in s.attrs]
+    prompt = [s.attrs["prompt_tokens"] for s in t.spans if s.name == "llm.generate" and s.attrs.get("prompt_tokens")]
+    if saved and ttft and prompt:
+        t.incr("latency.saved_ms_est", round(saved * ttft[-1] / prompt[-1], 1))
@@ -0,0 +1,306 @@
+import hashlib
+import os
+import re
+import threading
+import weakref
+import zlib
+from typing import Dict, List, Optional, Set
+import numpy as np
+from llama_index.core.schema import BaseNode
+from .config import DEDUP_ENABLED, DEDUP_NEAR_THRESHOLD
+
+DEDUP_DIR = "dedup"
+NUM_PERM = 64
+BANDS = 8
+SHINGLE_SIZE = 5
+_MERSENNE = np.uint64((1 << 31) - 1)
+_EMPTY = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Fixed permutations so signatures stay comparable across processes and runs
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+
+
+def content_hash(text: str) -> str:
+    """Hash of a chunk's text with whitespace normalized."""
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature over word shingles (NUM_PERM uint32 values)."""
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return _EMPTY.copy()
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    hashed = (_PERM_A[:, None] * (x[None, :] & _MERSENNE) + _PERM_B[:, None]) % _MERSENNE
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+class ChunkDeduplicator:
+    """
+    Detects duplicate chunks before they are embedded.
+
+    Every indexed ("canonical") chunk is remembered by a content hash and a
+    MinHash signature; signatures are bucketed by LSH bands so a new chunk is
+    only compared with the few chunks sharing a band. A chunk with the same
+    hash, or an estimated Jaccard similarity of at least `near_threshold`
+    (0 = exact only), is not indexed again: its document is recorded as an
+    extra source of the canonical chunk (`also_in` metadata).
+
+    A canonical chunk disappears with its document; documents that only
+    referenced it are reported by `pop_orphans` so they can be re-ingested.
+    Persisted under `<persist_dir>/dedup` and loaded on first use.
+    """
+
+    _registry = weakref.WeakKeyDictionary()
+
+    def __init__(self, persist_dir: Optional[str] = None, near_threshold: float = DEDUP_NEAR_THRESHOLD, enabled: bool = DEDUP_ENABLED):
+        self.persist_dir = persist_dir
+        self.near_threshold = near_threshold
+        self.enabled = enabled
+        self._lock = threading.RLock()
+        self._loaded = persist_dir is None
+        self._node_ids: List[str] = []
+        self._ref_doc_ids: List[str] = []
+        self._hashes: List[str] = []
+        self._alive: List[bool] = []
+        # Grown by doubling; rows beyond len(self._node_ids) are unused
+        self._signatures = np.zeros((0, NUM_PERM), dtype=np.uint32)
+        self._by_hash: Dict[str, int] = {}
+        self._by_node: Dict[str, int] = {}
+        self._by_doc: Dict[str, List[int]] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(BANDS)]
+        # canonical row -> {referencing ref_doc_id: source name}, and the reverse
+        self._refs: Dict[int, Dict[str, str]] = {}
+        self._referenced_by: Dict[str, Set[int]] = {}
+        self._orphans: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self.stats = {"chunks": 0, "exact": 0, "near": 0}
+
+    # ---- index registry ----------------------------------------------------
+
+    @classmethod
+    def attach(cls, index, dedup: "ChunkDeduplicator") -> "ChunkDeduplicator":
+        """Associate a deduplicator with a vector index."""
+        cls._registry[index] = dedup
+        return dedup
+
+    @classmethod
+    def for_index(cls, index, **kwargs) -> "ChunkDeduplicator":
+        """Deduplicator attached to a vector index, built from its docstore if none is attached."""
+        dedup = cls._registry.get(index)
+        if dedup is None:
+            dedup = cls(**kwargs)
+            with dedup._lock:
+                for node in index.docstore.docs.values():
+                    dedup._add_canonical(node, content_hash(node.get_content()), minhash(node.get_content()))
+            cls.attach(index, dedup)
+        return dedup
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, DEDUP_DIR, "chunks.tsv"))
+
+    # ---- loading / persistence ---------------------------------------------
+
+    def _path(self, persist_dir: str, name: str) -> str:
+        return os.path.join(persist_dir, DEDUP_DIR, name)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._signatures = np.load(self._path(self.persist_dir, "signatures.npy"))
+            with open(self._path(self.persist_dir, "chunks.tsv"), "r", encoding="utf-8") as f:
+                for row, line in enumerate(f):
+                    node_id, ref_doc_id, digest = line.rstrip("\n").split("\t")
+                    self._register(node_id, ref_doc_id, digest, self._signatures[row])
+            with open(self._path(self.persist_dir, "refs.tsv"), "r", encoding="utf-8") as f:
+                for line in f:
+                    node_id, ref_doc_id, source = line.rstrip("\n").split("\t")
+                    self._add_reference(self._by_node[node_id], ref_doc_id, source, dirty=False)
+            self._loaded = True
+
+    def persist(self, persist_dir: str):
+        """Write live canonical chunks (compacted), their signatures and extra sources."""
+        self._ensure_loaded()
+        with self._lock:
+            signatures = self._matrix()
+            keep = [r for r in range(len(self._node_ids)) if self._alive[r]]
+            os.makedirs(os.path.join(persist_dir, DEDUP_DIR), exist_ok=True)
+
+            def save_lines(name, lines):
+                path = self._path(persist_dir, name)
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.writelines(lines)
+                os.replace(path + ".tmp", path)
+
+            path = self._path(persist_dir, "signatures.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, signatures[keep])
+            os.replace(path + ".tmp", path)
+            save_lines("chunks.tsv", (f"{self._node_ids[r]}\t{self._ref_doc_ids[r]}\t{self._hashes[r]}\n" for r in keep))
+            save_lines("refs.tsv", (
+                f"{self._node_ids[r]}\t{ref}\t{source}\n"
+                for r in keep for ref, source in self._refs.get(r, {}).items()
+            ))
+            self.persist_dir = persist_dir
+
+    # ---- bookkeeping -------------------------------------------------------
+
+    def _matrix(self) -> np.ndarray:
+        return self._signatures[:len(self._node_ids)]
+
+    def _register(self, node_id: str, ref_doc_id: str, digest: str, signature: np.ndarray) -> int:
+        row = len(self._node_ids)
+        self._node_ids.append(node_id)
+        self._ref_doc_ids.append(ref_doc_id)
+        self._hashes.append(digest)
+        self._alive.append(True)
+        self._by_hash.setdefault(digest, row)
+        self._by_node[node_id] = row
+        self._by_doc.setdefault(ref_doc_id, []).append(row)
+        if not (signature == _EMPTY).all():
+            rows = NUM_PERM // BANDS
+            for band in range(BANDS):
+                key = signature[band * rows:(band + 1) * rows].tobytes()
+                self._buckets[band].setdefault(key, []).append(row)
+        return row
+
+    def _add_canonical(self, node: BaseNode, digest: str, signature: np.ndarray):
+        row = len(self._node_ids)
+        if row == len(self._signatures):
+            grown = np.zeros((max(1024, 2 * row), NUM_PERM), dtype=np.uint32)
+            grown[:row] = self._signatures[:row]
+            self._signatures = grown
+        self._signatures[row] = signature
+        self._register(node.node_id, node.ref_doc_id or "", digest, signature)
+
+    def _add_reference(self, row: int, ref_doc_id: str, source: str, dirty: bool = True):
+        self._refs.setdefault(row, {})[ref_doc_id] = source
+        self._referenced_by.setdefault(ref_doc_id, set()).add(row)
+        if dirty:
+            self._dirty.add(self._node_ids[row])
+
+    def _near_match(self, signature: np.ndarray) -> Optional[int]:
+        """Live canonical row most similar to the signature, if above the threshold."""
+        if not self.near_threshold or (signature == _EMPTY).all():
+            return None
+        rows = NUM_PERM // BANDS
+        candidates = set()
+        for band in range(BANDS):
+            candidates.update(self._buckets[band].get(signature[band * rows:(band + 1) * rows].tobytes(), ()))
+        candidates = [r for r in candidates if self._alive[r]]
+        if not candidates:
+            return None
+        similarity = (self._matrix()[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        return candidates[best] if similarity[best] >= self.near_threshold else None
+
+    # ---- ingestion ---------------------------------------------------------
+
+    def filter(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        """
+        Keep only chunks not already indexed (nor repeated earlier in `nodes`).
+        The kept chunks become canonical; the others are recorded as sources.
+        """
+        if not self.enabled or not nodes:
+            return nodes
+        self._ensure_loaded()
+        unique = []
+        with self._lock:
+            for node in nodes:
+                text = node.get_content()
+                digest = content_hash(text)
+                row, kind = self._by_hash.get(digest), "exact"
+                if row is not None and not self._alive[row]:
+                    row = None
+                signature = minhash(text)
+                if row is None:
+                    row, kind = self._near_match(signature), "near"
+                self.stats["chunks"] += 1
+                if row is None or self._ref_doc_ids[row] == (node.ref_doc_id or ""):
+                    # Repeats inside one document are kept: they share its lifetime anyway
+                    self._add_canonical(node, digest, signature)
+                    unique.append(node)
+                    continue
+                self.stats[kind] += 1
+                source = " ".join(str(node.metadata.get("file_name") or node.ref_doc_id).split())
+                self._add_reference(row, node.ref_doc_id or "", source)
+        return unique
+
+    def apply_references(self, docstore, metadata=None):
+        """
+        Record extra sources on canonical chunks already in the docstore as
+        `also_in` metadata (kept out of embedding and LLM text), and in the
+        MetadataIndex `metadata` so file filters find the chunk under them.
+        """
+        with self._lock:
+            updated = []
+            for node_id in list(self._dirty):
+                row = self._by_node.get(node_id)
+                node = docstore.get_node(node_id, raise_error=False)
+                if node is None or row is None:
+                    if row is None or not self._alive[row]:
+                        self._dirty.discard(node_id)
+                    continue  # not written yet; retried after the next batch
+                sources = sorted(set(self._refs.get(row, {}).values()) - {node.metadata.get("file_name")})
+                if sources:
+                    node.metadata["also_in"] = sources
+                else:
+                    node.metadata.pop("also_in", None)
+                for keys in (node.excluded_embed_metadata_keys, node.excluded_llm_metadata_keys):
+                    if "also_in" not in keys:
+                        keys.append("also_in")
+                if metadata is not None:
+                    metadata.set_sources(node_id, sources)
+                updated.append(node)
+                self._dirty.discard(node_id)
+            if updated:
+                docstore.add_documents(updated, allow_update=True)
+
+    def delete_ref_doc(self, ref_doc_id: str):
+        """
+        Forget a document: its canonical chunks and its references. Documents
+        that referenced one of its chunks become orphans (see pop_orphans).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            for row in self._referenced_by.pop(ref_doc_id, set()):
+                if self._refs.get(row, {}).pop(ref_doc_id, None) is not None and self._alive[row]:
+                    self._dirty.add(self._node_ids[row])
+            for row in self._by_doc.pop(ref_doc_id, []):
+                if not self._alive[row]:
+                    continue
+                self._alive[row] = False
+                self._by_node.pop(self._node_ids[row], None)
+                if self._by_hash.get(self._hashes[row]) == row:
+                    del self._by_hash[self._hashes[row]]
+                for ref in self._refs.pop(row, {}):
+                    self._referenced_by.get(ref, set()).discard(row)
+                    self._orphans.add(ref)
+            self._orphans.discard(ref_doc_id)
+
+    def pop_orphans(self) -> Set[str]:
+        """Documents whose duplicate chunks lost their indexed copy since the last call."""
+        with self._lock:
+            orphans, self._orphans = self._orphans, set()
+            return orphans
+
+    def reset_stats(self):
+        self.stats = {"chunks": 0, "exact": 0, "near": 0}
+
+    def summary(self) -> dict:
+        """Chunk counts since the last reset_stats and the share that was deduplicated."""
+        duplicates = self.stats["exact"] + self.stats["near"]
+        return {
+            **self.stats,
+            "duplicates": duplicates,
+            "ratio": round(duplicates / self.stats["chunks"], 4) if self.stats["chunks"] else 0.0,
+        }
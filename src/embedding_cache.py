@@ -0,0 +1,358 @@
+import atexit
+import hashlib
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, List
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from . import tracing
+
+try:
+    import fcntl
+except ImportError:  # Windows: a cache directory must not be shared between processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+LOCK_FILE = "lock"
+
+
+def _slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name).strip("_") or "model"
+
+
+def _replace_with(path: str, write: Callable):
+    with open(path + ".tmp", "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class EmbeddingCacheStore:
+    """
+    Content-addressed embedding store for a single model.
+
+    Vectors live in a raw float32 matrix (`vectors.f32`) that is read through
+    a memory map; row i belongs to the 16-byte key at offset 16*i of
+    `keys.bin`. Last-access ticks (`ticks.npy`) drive size-based eviction.
+
+    The store may be shared by several processes (the app, the sharding CLI,
+    batch runs). Every access holds an flock on `lock` and first catches up
+    with rows other processes appended, so rows are numbered from the files,
+    never from a stale in-memory count. Eviction writes the compacted files
+    as a new generation (`vectors.<n>.f32`, ...) and then switches `meta.npy`
+    to it, so keys are never paired with another generation's vectors.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.meta_path = os.path.join(cache_dir, "meta.npy")
+        self._lock_path = os.path.join(cache_dir, LOCK_FILE)
+        self._lock = threading.RLock()
+        self._gen = 0
+        self._rows = {}
+        self._ticks: List[int] = []
+        self._clock = 0
+        self._dim = None
+        self._mm = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._lock, self._file_lock():
+            self._open()
+
+    def _path(self, name: str, ext: str, gen: int = None) -> str:
+        gen = self._gen if gen is None else gen
+        return os.path.join(self.cache_dir, f"{name}.{gen}{ext}" if gen else f"{name}{ext}")
+
+    @property
+    def vectors_path(self) -> str:
+        return self._path("vectors", ".f32")
+
+    @property
+    def keys_path(self) -> str:
+        return self._path("keys", ".bin")
+
+    @property
+    def ticks_path(self) -> str:
+        return self._path("ticks", ".npy")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the cache directory across processes (callers hold self._lock)."""
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _read_meta(self):
+        """(dimension or None, generation) as last committed by any process."""
+        if not os.path.exists(self.meta_path):
+            return None, 0
+        meta = np.load(self.meta_path)
+        return int(meta[0]), int(meta[1]) if len(meta) > 1 else 0
+
+    def _write_meta(self, gen: int):
+        _replace_with(self.meta_path, lambda f: np.save(f, np.asarray([self._dim, gen], dtype=np.int64)))
+
+    def _file_rows(self):
+        """(rows in keys.bin, bytes in vectors.f32) of the current generation."""
+        n_keys = os.path.getsize(self.keys_path) // KEY_BYTES if os.path.exists(self.keys_path) else 0
+        vec_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        return n_keys, vec_bytes
+
+    def _open(self):
+        self._dim, self._gen = self._read_meta()
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                keys = f.read()
+        n_keys = len(keys) // KEY_BYTES
+        vec_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+
+        n_rows = min(n_keys, vec_bytes // (4 * self._dim)) if self._dim else 0
+        if n_rows != n_keys or (self._dim and n_rows * self._dim * 4 != vec_bytes):
+            # An interrupted append left the two files out of step; keep the common prefix.
+            self._truncate(n_rows)
+            keys = keys[: n_rows * KEY_BYTES]
+
+        self._rows = {keys[i * KEY_BYTES:(i + 1) * KEY_BYTES]: i for i in range(n_rows)}
+        ticks = np.load(self.ticks_path) if os.path.exists(self.ticks_path) else np.zeros(0, dtype=np.uint64)
+        self._ticks = [int(t) for t in ticks[:n_rows]] + [0] * max(0, n_rows - len(ticks))
+        self._clock = max(self._ticks, default=0)
+        self._mm = None
+        self._remove_stale_generations()
+
+    def _remove_stale_generations(self):
+        """Delete files of other generations (replaced by an eviction, or left by one that crashed)."""
+        current = {os.path.basename(p) for p in (self.vectors_path, self.keys_path, self.ticks_path)}
+        for name in os.listdir(self.cache_dir):
+            if re.fullmatch(r"(vectors|keys|ticks)(\.\d+)?\.(f32|bin|npy)(\.tmp)?", name) and name not in current:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _sync(self):
+        """Catch up with rows appended (or an eviction committed) by other processes."""
+        dim, gen = self._read_meta()
+        if gen != self._gen or dim != self._dim:
+            self._open()
+            return
+        if self._dim is None:
+            return  # nothing appended yet (meta is written before the first append)
+        n_keys, vec_bytes = self._file_rows()
+        known = len(self._ticks)
+        if n_keys < known or vec_bytes != n_keys * self._dim * 4:
+            # An append was cut short (or repaired since): start over from the files
+            self._open()
+            return
+        if n_keys > known:
+            with open(self.keys_path, "rb") as f:
+                f.seek(known * KEY_BYTES)
+                keys = f.read((n_keys - known) * KEY_BYTES)
+            for i in range(n_keys - known):
+                self._rows[keys[i * KEY_BYTES:(i + 1) * KEY_BYTES]] = known + i
+            self._ticks.extend([0] * (n_keys - known))
+
+    def _truncate(self, n_rows: int):
+        with open(self.keys_path, "ab") as f:
+            f.truncate(n_rows * KEY_BYTES)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(n_rows * (self._dim or 0) * 4)
+
+    def _matrix(self):
+        n_rows = len(self._ticks)
+        if self._mm is None or self._mm.shape[0] < n_rows:
+            self._mm = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self._dim))
+        return self._mm
+
+    @staticmethod
+    def make_key(kind: str, text: str) -> bytes:
+        """Key on the embedding kind and whitespace-normalized text."""
+        normalized = " ".join(text.split())
+        return hashlib.blake2b(f"{kind}\0{normalized}".encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+    def get_many(self, keys: List[bytes]) -> List[Any]:
+        """Return cached vectors (or None) for each key."""
+        with self._lock, self._file_lock():
+            self._sync()
+            out = []
+            matrix = None
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    out.append(None)
+                    continue
+                if matrix is None:
+                    matrix = self._matrix()
+                self._clock += 1
+                self._ticks[row] = self._clock
+                self.hits += 1
+                out.append(matrix[row].tolist())
+            return out
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        """Append new vectors; evicts least recently used rows when over budget."""
+        with self._lock, self._file_lock():
+            self._sync()
+            new = {k: v for k, v in zip(keys, vectors) if k not in self._rows}
+            if not new:
+                return
+            block = np.asarray(list(new.values()), dtype=np.float32)
+            if self._dim is None:
+                self._dim = block.shape[1]
+                self._write_meta(self._gen)
+            if block.shape[1] != self._dim:
+                logger.warning(
+                    "Not caching %d embeddings of dimension %d in %s, which holds dimension %d",
+                    len(new), block.shape[1], self.cache_dir, self._dim
+                )
+                return
+            # Vectors first: an append cut short leaves keys without vectors, which _open drops
+            with open(self.vectors_path, "ab") as f:
+                f.write(block.tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new))
+            for key in new:
+                self._clock += 1
+                self._rows[key] = len(self._ticks)
+                self._ticks.append(self._clock)
+
+            if self.size_bytes > self.max_bytes:
+                self._evict()
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._ticks) * ((self._dim or 0) * 4 + KEY_BYTES)
+
+    def _evict(self):
+        """Rewrite the store keeping the most recently used rows (down to 80% of the budget)."""
+        row_bytes = self._dim * 4 + KEY_BYTES
+        keep_n = max(0, int(self.max_bytes * 0.8) // row_bytes)
+        ticks = np.asarray(self._ticks, dtype=np.uint64)
+        keep = np.sort(np.argsort(ticks)[::-1][:keep_n])
+
+        keys_by_row = [None] * len(self._ticks)
+        for key, row in self._rows.items():
+            keys_by_row[row] = key
+        vectors = np.asarray(self._matrix()[keep], dtype=np.float32)
+
+        gen = self._gen + 1
+        _replace_with(self._path("vectors", ".f32", gen), lambda f: f.write(vectors.tobytes()))
+        _replace_with(self._path("keys", ".bin", gen), lambda f: f.write(b"".join(keys_by_row[r] for r in keep)))
+        _replace_with(self._path("ticks", ".npy", gen), lambda f: np.save(f, ticks[keep]))
+        # The switch to the new generation is this one atomic replace
+        self._write_meta(gen)
+
+        self.evictions += len(self._ticks) - len(keep)
+        self._gen = gen
+        self._mm = None
+        self._rows = {keys_by_row[r]: i for i, r in enumerate(keep)}
+        self._ticks = [int(ticks[r]) for r in keep]
+        self._remove_stale_generations()
+
+    def flush(self):
+        """Persist access ticks so eviction order survives restarts."""
+        with self._lock, self._file_lock():
+            self._sync()
+            _replace_with(self.ticks_path, lambda f: np.save(f, np.asarray(self._ticks, dtype=np.uint64)))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._ticks),
+            "size_bytes": self.size_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model with a persistent on-disk cache.
+    Both query and document embeddings are served from the cache when the
+    same (model, normalized text) pair has been embedded before.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingCacheStore = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache_dir: str, max_bytes: int = 512 * 1024 * 1024, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._store = EmbeddingCacheStore(os.path.join(cache_dir, _slug(inner.model_name)), max_bytes)
+        atexit.register(self._store.flush)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCacheStore:
+        return self._store
+
+    def stats(self) -> dict:
+        """Hit/miss counters of the underlying cache."""
+        return self._store.stats()
+
+    def _split(self, kind: str, texts: List[str]):
+        keys = [EmbeddingCacheStore.make_key(kind, t) for t in texts]
+        cached = self._store.get_many(keys)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        tracing.count("embed_cache.hits", len(keys) - len(missing))
+        tracing.count("embed_cache.misses", len(missing))
+        return keys, cached, missing
+
+    def _merge(self, keys, cached, missing, computed):
+        self._store.put_many([keys[i] for i in missing], computed)
+        for i, vector in zip(missing, computed):
+            cached[i] = vector
+        return cached
+
+    def _embed(self, kind: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]):
+        keys, cached, missing = self._split(kind, texts)
+        if not missing:
+            return cached
+        return self._merge(keys, cached, missing, compute([texts[i] for i in missing]))
+
+    async def _aembed(self, kind: str, texts: List[str], acompute):
+        keys, cached, missing = self._split(kind, texts)
+        if not missing:
+            return cached
+        return self._merge(keys, cached, missing, await acompute([texts[i] for i in missing]))
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed("query", [query], lambda q: [self._inner.get_query_embedding(q[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        async def compute(q):
+            return [await self._inner.aget_query_embedding(q[0])]
+        return (await self._aembed("query", [query], compute))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed("text", [text], self._inner.get_text_embedding_batch)[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("text", texts, self._inner.get_text_embedding_batch)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed("text", texts, self._inner.aget_text_embedding_batch)
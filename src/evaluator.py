@@ -1,21 +1,128 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
 from llama_index.core.evaluation import FaithfulnessEvaluator, RelevancyEvaluator
+from llama_index.core.base.response.schema import Response
 from llama_index.core import Settings
+from .config import EVAL_CONCURRENCY
+from .tracing import span, trace
 
 class RAGEvaluator:
     """Handles Evaluation of RAG responses."""
-    
-    @staticmethod
-    def evaluate(query: str, response_obj):
-        """Evaluate the accuracy and faithfulness of a response."""
+
+    _lock = threading.Lock()
+    _llm = None
+    _faith_eval = None
+    _rel_eval = None
+    _executor = None
+    _loop = None
+
+    @classmethod
+    def _evaluators(cls):
+        """Faithfulness/relevancy evaluators, rebuilt only when the global LLM changes."""
         llm = Settings.llm
-        faith_eval = FaithfulnessEvaluator(llm=llm)
-        rel_eval = RelevancyEvaluator(llm=llm)
-        
-        faith_result = faith_eval.evaluate_response(response=response_obj)
-        rel_result = rel_eval.evaluate_response(query=query, response=response_obj)
-        
+        with cls._lock:
+            if cls._llm is not llm:
+                cls._faith_eval = FaithfulnessEvaluator(llm=llm)
+                cls._rel_eval = RelevancyEvaluator(llm=llm)
+                cls._llm = llm
+            return cls._faith_eval, cls._rel_eval
+
+    @staticmethod
+    def _snapshot(response_obj) -> Response:
+        """Detach the answer text and sources from (possibly streaming) chat responses."""
+        return Response(
+            response=str(getattr(response_obj, "response", response_obj)),
+            source_nodes=list(getattr(response_obj, "source_nodes", []) or [])
+        )
+
+    @staticmethod
+    async def _timed(name: str, awaitable):
+        with span(name):
+            return await awaitable
+
+    @classmethod
+    async def aevaluate(cls, query: str, response_obj):
+        """Run both LLM judgments concurrently."""
+        faith_eval, rel_eval = cls._evaluators()
+        response = cls._snapshot(response_obj)
+        faith_result, rel_result = await asyncio.gather(
+            cls._timed("eval.faithfulness", faith_eval.aevaluate_response(response=response)),
+            cls._timed("eval.relevancy", rel_eval.aevaluate_response(query=query, response=response))
+        )
+
         return {
             "faithfulness": faith_result.passing,
             "relevancy": rel_result.passing,
             "feedback": faith_result.feedback
         }
+
+    @classmethod
+    def evaluate(cls, query: str, response_obj):
+        """Evaluate the accuracy and faithfulness of a response (blocking)."""
+        return cls.submit(query, response_obj).result()
+
+    @classmethod
+    def _event_loop(cls) -> asyncio.AbstractEventLoop:
+        """
+        Long-lived loop shared by all evaluations. The LLM's async HTTP client
+        binds its connections to the loop that opened them, so every judgment
+        has to run on the same loop rather than a fresh one per evaluation.
+        """
+        with cls._lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name="rag-eval-loop", daemon=True).start()
+            return cls._loop
+
+    @classmethod
+    def _run_on_loop(cls, coro):
+        """Run a coroutine on the shared loop in the caller's context (so its trace) and wait for it."""
+        loop = cls._event_loop()
+        done = Future()
+
+        def finish(task: asyncio.Task):
+            if task.cancelled():
+                done.cancel()
+            elif task.exception() is not None:
+                done.set_exception(task.exception())
+            else:
+                done.set_result(task.result())
+
+        def start():
+            loop.create_task(coro).add_done_callback(finish)
+
+        loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return done.result()
+
+    @classmethod
+    def _run_traced(cls, query: str, response: Response):
+        """Worker entry point: one trace per evaluation, its stage timings attached to the result."""
+        with trace("evaluate") as t:
+            result = cls._run_on_loop(cls.aevaluate(query, response))
+        if t is not None:
+            result["timings_ms"] = t.breakdown()
+        return result
+
+    @classmethod
+    def submit(cls, query: str, response_obj, callback: Optional[Callable] = None) -> Future:
+        """
+        Schedule an evaluation in the background worker pool.
+        At most EVAL_CONCURRENCY evaluations run at once; `callback(result, error)`
+        is invoked from the worker thread when the evaluation finishes.
+        """
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=EVAL_CONCURRENCY,
+                    thread_name_prefix="rag-eval"
+                )
+        response = cls._snapshot(response_obj)
+        future = cls._executor.submit(cls._run_traced, query, response)
+        if callback:
+            future.add_done_callback(
+                lambda f: callback(f.result() if not f.exception() else None, f.exception())
+            )
+        return future
@@ -1,63 +1,201 @@
 import json
 import os
 import glob
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from .config import BASE_DIR
 
 HISTORY_DIR = os.path.join(BASE_DIR, "history")
+HISTORY_DB = os.path.join(HISTORY_DIR, "history.db")
+MIGRATED_DIR = os.path.join(HISTORY_DIR, "migrated")
 os.makedirs(HISTORY_DIR, exist_ok=True)
 
+PREVIEW_CHARS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    preview TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+# Sessions are also written from background evaluation threads
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _preview(content: str) -> str:
+    return content[:PREVIEW_CHARS] + "..."
+
+
+def _split_message(message: dict):
+    """Split a message into its columns and a JSON blob with any extra keys (eval, ...)."""
+    extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+    return message["role"], message["content"], json.dumps(extra, ensure_ascii=False) if extra else None
+
+
+def _join_message(role: str, content: str, extra: str) -> dict:
+    message = {"role": role, "content": content}
+    if extra:
+        message.update(json.loads(extra))
+    return message
+
+
+@contextmanager
+def _connect():
+    """Short-lived connection in WAL mode; commits on success."""
+    _ensure_db()
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _ensure_db():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        conn = sqlite3.connect(HISTORY_DB, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            _migrate_json_sessions(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        _initialized = True
+
+
+def _migrate_json_sessions(conn):
+    """Import legacy per-session JSON files once, then move them out of the way."""
+    files = glob.glob(os.path.join(HISTORY_DIR, "*.json"))
+    if not files:
+        return
+    os.makedirs(MIGRATED_DIR, exist_ok=True)
+    for f in files:
+        try:
+            with open(f, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            _write_session(conn, data["session_id"], data.get("messages", []), data.get("updated_at"))
+        except Exception:
+            continue
+        shutil.move(f, os.path.join(MIGRATED_DIR, os.path.basename(f)))
+
+
+def _write_session(conn, session_id: str, messages: list, updated_at: str = None):
+    now = updated_at or datetime.now().isoformat()
+    conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+    conn.executemany(
+        "INSERT INTO messages (session_id, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+        [(session_id, i, *_split_message(m)) for i, m in enumerate(messages)]
+    )
+    conn.execute(
+        "INSERT INTO sessions (id, created_at, updated_at, preview, message_count) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at, preview = excluded.preview, "
+        "message_count = excluded.message_count",
+        (session_id, now, now, _preview(messages[0]["content"]) if messages else "Empty Chat", len(messages))
+    )
+
+
 class HistoryManager:
-    """Manages persistent chat history sessions."""
-    
+    """
+    Manages persistent chat history sessions.
+
+    Sessions live in a SQLite database: a `sessions` table holding only the
+    metadata needed for the archive list, and a `messages` table with one
+    row per turn so appending a message is a single-row write.
+    """
+
     @staticmethod
     def save_session(session_id: str, messages: list):
-        """Save a list of messages to a JSON file."""
+        """Replace the stored transcript of a session with the given messages."""
         if not messages:
             return
-            
-        file_path = os.path.join(HISTORY_DIR, f"{session_id}.json")
-        data = {
-            "session_id": session_id,
-            "updated_at": datetime.now().isoformat(),
-            "messages": messages
-        }
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with _connect() as conn:
+            _write_session(conn, session_id, messages)
+
+    @staticmethod
+    def append_message(session_id: str, message: dict) -> int:
+        """Append one message to a session (creating it if needed); returns its position."""
+        now = datetime.now().isoformat()
+        with _connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT message_count FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            seq = row[0] if row else 0
+            conn.execute(
+                "INSERT OR REPLACE INTO messages (session_id, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+                (session_id, seq, *_split_message(message))
+            )
+            if row:
+                conn.execute(
+                    "UPDATE sessions SET updated_at = ?, message_count = ? WHERE id = ?",
+                    (now, seq + 1, session_id)
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO sessions (id, created_at, updated_at, preview, message_count) VALUES (?, ?, ?, ?, 1)",
+                    (session_id, now, now, _preview(message["content"]))
+                )
+        return seq
+
+    @staticmethod
+    def update_message(session_id: str, seq: int, message: dict):
+        """Rewrite a single stored message (e.g. to attach evaluation results)."""
+        with _connect() as conn:
+            conn.execute(
+                "UPDATE messages SET role = ?, content = ?, extra = ? WHERE session_id = ? AND seq = ?",
+                (*_split_message(message), session_id, seq)
+            )
 
     @staticmethod
     def load_session(session_id: str):
-        """Load messages from a JSON file."""
-        file_path = os.path.join(HISTORY_DIR, f"{session_id}.json")
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("messages", [])
-        return []
+        """Load the messages of a session in order."""
+        with _connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, extra FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        return [_join_message(*r) for r in rows]
+
+    @staticmethod
+    def list_sessions(limit: int = 50, offset: int = 0):
+        """Return session metadata, most recently updated first (reads no transcripts)."""
+        with _connect() as conn:
+            rows = conn.execute(
+                "SELECT id, updated_at, preview FROM sessions ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [{"id": r[0], "updated_at": r[1], "preview": r[2]} for r in rows]
 
     @staticmethod
-    def list_sessions():
-        """Return a list of all session metadata, sorted by date."""
-        files = glob.glob(os.path.join(HISTORY_DIR, "*.json"))
-        sessions = []
-        for f in files:
-            try:
-                with open(f, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-                    sessions.append({
-                        "id": data["session_id"],
-                        "updated_at": data["updated_at"],
-                        "preview": data["messages"][0]["content"][:30] + "..." if data["messages"] else "Empty Chat"
-                    })
-            except Exception:
-                continue
-        
-        # Sort by updated_at descending
-        return sorted(sessions, key=lambda x: x["updated_at"], reverse=True)
+    def count_sessions() -> int:
+        """Number of archived sessions."""
+        with _connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
 
     @staticmethod
     def delete_session(session_id: str):
-        """Delete a session file."""
-        file_path = os.path.join(HISTORY_DIR, f"{session_id}.json")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        """Delete a session and its messages."""
+        with _connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
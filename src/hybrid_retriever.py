@@ -0,0 +1,326 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, List, NamedTuple, Optional, Tuple
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from .bm25_store import BM25Index, CorpusStats
+from .metadata_index import MetadataIndex, QueryFilter
+from .tracing import span
+from .vector_store import MmapVectorStore
+
+
+def _top_k(scores: np.ndarray, k: int, tiebreak: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Indices of the k highest finite scores, best first. Equal scores are
+    ordered by `tiebreak` (higher first) when given, so the selection does
+    not depend on row order (and thus not on how rows are split into shards).
+    """
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    if tiebreak is None:
+        return top[np.argsort(-scores[top], kind="stable")]
+    cut = scores[top].min()
+    above = np.flatnonzero(scores > cut)
+    tied = np.flatnonzero(scores == cut)
+    top = np.concatenate([above, tied[np.argsort(-tiebreak[tied], kind="stable")][:k - len(above)]])
+    return top[np.lexsort((-tiebreak[top], -scores[top]))]
+
+
+# Filter of the retrieval running in this context; set through filtered()
+_active_filter: ContextVar[Optional[QueryFilter]] = ContextVar("retrieval_filter", default=None)
+
+
+@contextmanager
+def filtered(query_filter: Optional[QueryFilter]):
+    """Restrict retrievals made in this context (thread/task) to the filter's scope."""
+    token = _active_filter.set(query_filter)
+    try:
+        yield
+    finally:
+        _active_filter.reset(token)
+
+
+# Results of a retrieval already made in this context; set through prefetched()
+_prefetched: ContextVar[Optional[tuple]] = ContextVar("retrieval_prefetched", default=None)
+
+
+@contextmanager
+def prefetched(query_str: str, query_filter: Optional[QueryFilter], nodes: List[NodeWithScore]):
+    """
+    Serve `nodes` to retrievals in this context that repeat `query_str` under
+    the same filter, instead of embedding and retrieving again (e.g. the chat
+    engine answering a question the answer cache just looked up).
+    """
+    token = _prefetched.set((query_str, query_filter, nodes))
+    try:
+        yield
+    finally:
+        _prefetched.reset(token)
+
+
+def reused_nodes(query_bundle: QueryBundle) -> Optional[List[NodeWithScore]]:
+    """Prefetched results for this retrieval, if any (copies, as postprocessors may rescore them)."""
+    entry = _prefetched.get()
+    if entry is None or entry[0] != query_bundle.query_str or entry[1] != _active_filter.get():
+        return None
+    return [NodeWithScore(node=n.node, score=n.score) for n in entry[2]]
+
+
+class Candidates(NamedTuple):
+    """Fusion candidates of one index with their raw scores (see HybridRetriever.candidates)."""
+
+    node_ids: List[str]
+    dense: np.ndarray
+    lexical: np.ndarray
+    # Score ranges over every row in scope, for weighted fusion's min-max normalization
+    dense_range: Tuple[float, float]
+    lexical_range: Tuple[float, float]
+    docstore: Any
+
+
+def fuse(
+    pools: List[Optional[Candidates]],
+    k: int,
+    mode: str = "rrf",
+    candidate_k: int = 50,
+    alpha: float = 0.5,
+    rrf_k: int = 60,
+) -> List[NodeWithScore]:
+    """
+    Fuse the raw scores of one or more candidate pools into the top-k nodes.
+
+    Ranks (rrf) and normalization ranges (weighted) are taken over all pools
+    together, so pools from several shards fuse exactly as one index would.
+    Only the `candidate_k` best candidates by each signal take part; ties are
+    broken by dense score.
+    """
+    pools = [p for p in pools if p is not None and p.node_ids]
+    if not pools:
+        return []
+    with span("retrieve.fusion") as s:
+        dense = np.concatenate([p.dense for p in pools])
+        lexical = np.concatenate([p.lexical for p in pools])
+        dense_top = _top_k(dense, candidate_k, tiebreak=lexical)
+        lexical_top = _top_k(np.where(lexical > 0, lexical, -np.inf), candidate_k, tiebreak=dense)
+        candidates = np.union1d(dense_top, lexical_top)
+
+        fused = np.full(len(dense), -np.inf, dtype=np.float32)
+        if mode == "rrf":
+            ranks = np.arange(1, candidate_k + 1, dtype=np.float32)
+            fused[candidates] = 0.0
+            fused[dense_top] += 1.0 / (rrf_k + ranks[:len(dense_top)])
+            fused[lexical_top] += 1.0 / (rrf_k + ranks[:len(lexical_top)])
+        else:
+            def normalize(x, lo, hi):
+                return (x - lo) / (hi - lo) if hi > lo else np.zeros_like(x)
+
+            d_lo, d_hi = min(p.dense_range[0] for p in pools), max(p.dense_range[1] for p in pools)
+            l_lo, l_hi = min(p.lexical_range[0] for p in pools), max(p.lexical_range[1] for p in pools)
+            alive = candidates[np.isfinite(dense[candidates])]
+            fused[alive] = (
+                alpha * normalize(dense[alive], d_lo, d_hi) + (1 - alpha) * normalize(lexical[alive], l_lo, l_hi)
+            )
+        s.set(candidates=int(np.isfinite(fused).sum()))
+
+        order = np.lexsort((-dense, -fused))
+        top = [i for i in order[:k] if np.isfinite(fused[i])]
+
+    with span("retrieve.fetch"):
+        owner = np.repeat(np.arange(len(pools)), [len(p.node_ids) for p in pools])
+        offset = np.concatenate([[0], np.cumsum([len(p.node_ids) for p in pools])])
+        results = []
+        for i in top:
+            pool = pools[owner[i]]
+            node = pool.docstore.get_node(pool.node_ids[i - offset[owner[i]]])
+            results.append(NodeWithScore(node=node, score=float(fused[i])))
+    return results
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    In-process dense + BM25 retrieval with vectorized score fusion.
+
+    Dense similarity is one matrix-vector product over the memory-mapped
+    vector store, BM25 one sparse matrix-vector product. The `candidate_k`
+    best rows by each signal are fused with Reciprocal Rank Fusion ("rrf")
+    or min-max normalized weighting ("weighted") and the top-k is picked with
+    argpartition; no event loop or per-node Python scoring is involved.
+    Candidate scoring and fusion are separate steps (`candidates`, `fuse`)
+    so a sharded index can fuse the pools of all shards at once.
+
+    Inside `filtered(query_filter)` the metadata index narrows the candidate
+    rows first, and only those rows are scored, so a selective filter makes
+    retrieval cheaper rather than adding a post-filter pass. Inside
+    `prefetched(...)` a repeated retrieval returns the earlier results.
+    """
+
+    def __init__(
+        self,
+        vector_store: MmapVectorStore,
+        bm25: BM25Index,
+        docstore,
+        similarity_top_k: int = 5,
+        candidate_k: int = 50,
+        mode: str = "rrf",
+        alpha: float = 0.5,
+        rrf_k: int = 60,
+        embed_model=None,
+        metadata: MetadataIndex = None,
+        **kwargs
+    ):
+        if mode not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion mode: {mode}")
+        self._vector_store = vector_store
+        self._bm25 = bm25
+        self._docstore = docstore
+        self._similarity_top_k = similarity_top_k
+        self._candidate_k = max(candidate_k, similarity_top_k)
+        self._mode = mode
+        self._alpha = alpha
+        self._rrf_k = rrf_k
+        self._embed_model = embed_model
+        self._metadata = metadata
+        self._lock = threading.Lock()
+        self._alignment = None
+        self._alignment_key = None
+        self._inverse = None
+        self._inverse_key = None
+        self._meta_alignment = None
+        self._meta_alignment_key = None
+        super().__init__(**kwargs)
+
+    def _bm25_to_vector_rows(self) -> np.ndarray:
+        """Vector-store row for every BM25 row (-1 if absent), rebuilt only after mutations."""
+        key = (self._vector_store.version, self._bm25.version)
+        with self._lock:
+            if self._alignment_key != key:
+                row_of = self._vector_store.row_of
+                self._alignment = np.fromiter(
+                    (-1 if (r := row_of(n)) is None else r for n in self._bm25.node_ids),
+                    dtype=np.int64,
+                )
+                self._alignment_key = key
+            return self._alignment
+
+    def _vector_to_bm25_rows(self) -> np.ndarray:
+        """BM25 row for every vector-store row (-1 if absent)."""
+        alignment = self._bm25_to_vector_rows()
+        with self._lock:
+            if self._inverse_key != self._alignment_key:
+                inverse = np.full(len(self._vector_store.node_ids), -1, dtype=np.int64)
+                valid = alignment >= 0
+                inverse[alignment[valid]] = np.flatnonzero(valid)
+                self._inverse = inverse
+                self._inverse_key = self._alignment_key
+            return self._inverse
+
+    def _metadata_to_vector_rows(self) -> np.ndarray:
+        """Vector-store row for every metadata-index row (-1 if absent)."""
+        key = (self._vector_store.version, self._metadata.version)
+        with self._lock:
+            if self._meta_alignment_key != key:
+                row_of = self._vector_store.row_of
+                self._meta_alignment = np.fromiter(
+                    (-1 if (r := row_of(n)) is None else r for n in self._metadata.node_ids),
+                    dtype=np.int64,
+                )
+                self._meta_alignment_key = key
+            return self._meta_alignment
+
+    def _filtered_rows(self, query_filter: QueryFilter) -> np.ndarray:
+        """Sorted vector-store rows in scope of the filter."""
+        rows = self._metadata_to_vector_rows()[self._metadata.match(query_filter)]
+        return np.unique(rows[rows >= 0])
+
+    def filtered(self, query_filter: Optional[QueryFilter]):
+        """Restrict retrievals made in this context (thread/task) to the filter's scope."""
+        return filtered(query_filter)
+
+    def _lexical_scores(
+        self, query_str: str, n_rows: int, rows: Optional[np.ndarray] = None, corpus: Optional[CorpusStats] = None
+    ) -> np.ndarray:
+        """BM25 scores laid out on the vector-store rows (or on `rows` only)."""
+        aligned = np.zeros(n_rows, dtype=np.float32)
+        if rows is not None:
+            bm25_rows = self._vector_to_bm25_rows()[rows]
+            valid = bm25_rows >= 0
+            if valid.any():
+                aligned[valid] = self._bm25.scores(query_str, rows=bm25_rows[valid], corpus=corpus)
+            return aligned
+        lexical = self._bm25.scores(query_str, corpus=corpus)
+        bm25_rows = self._bm25_to_vector_rows()
+        valid = bm25_rows >= 0
+        aligned[bm25_rows[valid]] = lexical[valid]
+        return aligned
+
+    def corpus_stats(self, query_str: str) -> CorpusStats:
+        return self._bm25.corpus_stats(query_str)
+
+    def candidates(self, query_bundle: QueryBundle, corpus: Optional[CorpusStats] = None) -> Optional[Candidates]:
+        """
+        Raw dense and BM25 scores of this index's fusion candidates: the
+        `candidate_k` best rows by each signal (within the active filter).
+        With `corpus`, BM25 is scored against those collection statistics.
+        """
+        rows = None
+        query_filter = _active_filter.get()
+        if query_filter is not None and not query_filter.is_empty and self._metadata is not None:
+            with span("retrieve.filter") as s:
+                rows = self._filtered_rows(query_filter)
+                s.set(rows=len(rows))
+            if not len(rows):
+                return None
+
+        embedding: Optional[List[float]] = query_bundle.embedding
+        if embedding is None:
+            with span("retrieve.embed"):
+                embed_model = self._embed_model or Settings.embed_model
+                embedding = embed_model.get_query_embedding(query_bundle.query_str)
+
+        with span("retrieve.dense") as s:
+            dense = self._vector_store.similarities(embedding, rows)
+            s.set(rows=len(dense))
+        alive = np.isfinite(dense)
+        if not alive.any():
+            return None
+        with span("retrieve.bm25") as s:
+            lexical = self._lexical_scores(query_bundle.query_str, len(dense), rows, corpus)
+            s.set(matches=int(np.count_nonzero(lexical)))
+
+        pool = np.union1d(
+            _top_k(dense, self._candidate_k, tiebreak=lexical),
+            _top_k(np.where(lexical > 0, lexical, -np.inf), self._candidate_k, tiebreak=dense),
+        )
+        # Scores of a filtered retrieval are indexed by position in `rows`
+        vector_rows = pool if rows is None else rows[pool]
+        node_ids = self._vector_store.node_ids
+        return Candidates(
+            node_ids=[node_ids[r] for r in vector_rows],
+            dense=dense[pool],
+            lexical=lexical[pool],
+            dense_range=(float(dense[alive].min()), float(dense[alive].max())),
+            lexical_range=(float(lexical[alive].min()), float(lexical[alive].max())),
+            docstore=self._docstore,
+        )
+
+    def fuse(self, pools: List[Optional[Candidates]]) -> List[NodeWithScore]:
+        """Fuse candidate pools (of one or several indexes) into the final top-k."""
+        return fuse(
+            pools, self._similarity_top_k, mode=self._mode,
+            candidate_k=self._candidate_k, alpha=self._alpha, rrf_k=self._rrf_k
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        with span("retrieve", mode=self._mode) as retrieve_span:
+            results = reused_nodes(query_bundle)
+            if results is not None:
+                retrieve_span.set(reused=True, returned=len(results))
+                return results
+            results = self.fuse([self.candidates(query_bundle)])
+            retrieve_span.set(returned=len(results))
+            return results
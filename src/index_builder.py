@@ -0,0 +1,146 @@
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from typing import List, Optional
+from .config import STORAGE_DIR
+from .indexer import DocumentIndexer
+from .storage import IndexStorage
+
+
+class BuildJob:
+    """
+    One index build running in a background thread.
+
+    The published index is copied to a new version directory, synced with
+    the data directory there and persisted; only then is the version
+    published. Until that moment every reader keeps using the old version,
+    and a crash mid-build leaves an unpublished directory that the next
+    publish removes. The build holds the storage root's build lock
+    throughout, so a second build (e.g. the sharding CLI) fails fast with
+    BuildInProgress instead of racing it.
+    """
+
+    def __init__(self, required_exts: Optional[List[str]] = None, root: str = STORAGE_DIR):
+        self.id = uuid.uuid4().hex[:8]
+        self.required_exts = required_exts
+        self.root = root
+        self.state = "queued"   # queued | running | done | failed
+        self.phase = "Queued"
+        self.files_done = 0
+        self.files_total = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error: Optional[str] = None
+        self.diff = None
+        self.version: Optional[str] = None
+        self.index = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.state in ("queued", "running")
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the files to ingest that are written (0..1)."""
+        return self.files_done / self.files_total if self.files_total else 0.0
+
+    def status(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "phase": self.phase,
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "progress": round(self.progress, 4),
+            "elapsed_s": round((self.finished_at or time.time()) - self.started_at, 1) if self.started_at else 0.0,
+            "version": self.version,
+            "error": self.error,
+            "diff": self.diff.summary() if self.diff else None,
+        }
+
+    def start(self) -> "BuildJob":
+        self._thread = threading.Thread(target=self._run, name=f"rag-build-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: float = None) -> "BuildJob":
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self
+
+    def _on_progress(self, done: int, total: int):
+        self.files_done, self.files_total = done, total
+        self.phase = f"Indexing files ({done}/{total})"
+
+    def _run(self):
+        self.state, self.started_at = "running", time.time()
+        version_dir = None
+        try:
+            with IndexStorage.build_lock(self.root) as lock:
+                self.phase = "Preparing new index version"
+                live_dir = IndexStorage.active_dir(self.root)
+                self.version, version_dir = IndexStorage.new_version(lock)
+                index = IndexStorage.load_index(version_dir)
+
+                self.phase = "Scanning data directory"
+                index, manifest, self.diff = DocumentIndexer.sync_index(
+                    index,
+                    required_exts=self.required_exts,
+                    persist_dir=version_dir,
+                    progress=self._on_progress
+                )
+
+                if index is None or not self.diff.has_changes:
+                    # Nothing to publish; refreshed file stats go to the live manifest
+                    if index is not None:
+                        manifest.save(live_dir)
+                    shutil.rmtree(version_dir, ignore_errors=True)
+                    self.version = lock.base
+                    self.phase = "No documents found" if index is None else "Index already up to date"
+                else:
+                    self.phase = "Writing index"
+                    IndexStorage.persist_index(index, manifest, persist_dir=version_dir)
+                    self.phase = "Switching to new index"
+                    IndexStorage.publish(lock)
+                    self.index = index
+                    self.phase = "Done"
+            self.state = "done"
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.phase = "Failed"
+            self.state = "failed"
+            traceback.print_exc()
+            if version_dir and IndexStorage.current_version(self.root) != self.version:
+                shutil.rmtree(version_dir, ignore_errors=True)
+        finally:
+            self.finished_at = time.time()
+
+
+class IndexBuilder:
+    """Runs at most one background BuildJob per process and remembers the last one."""
+
+    _lock = threading.Lock()
+    _job: Optional[BuildJob] = None
+
+    @classmethod
+    def start(cls, required_exts: Optional[List[str]] = None, root: str = STORAGE_DIR) -> BuildJob:
+        """Start a build, or return the one already running."""
+        with cls._lock:
+            if cls._job is None or not cls._job.running:
+                cls._job = BuildJob(required_exts, root).start()
+            return cls._job
+
+    @classmethod
+    def job(cls) -> Optional[BuildJob]:
+        return cls._job
+
+    @classmethod
+    def built_index(cls, version: Optional[str]):
+        """The in-memory index of a version this process just built (saves reloading it)."""
+        job = cls._job
+        if version and job is not None and job.version == version and job.index is not None:
+            return job.index
+        return None
@@ -1,19 +1,157 @@
-from llama_index.core import VectorStoreIndex
-from typing import List
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.ingestion import run_transformations
+from typing import Callable, List
+from .bm25_store import BM25Index
+from .dedup import ChunkDeduplicator
+from .metadata_index import MetadataIndex
+from .loader import DocumentLoader
+from .pipeline import IngestPipeline
+from .manifest import IndexManifest
+from .storage import IndexStorage
+from .config import SHARD_BY, STORAGE_DIR
 
 class DocumentIndexer:
     """Handles Indexing of loaded documents into vector representations."""
     
+    @staticmethod
+    def empty_index():
+        """A new, empty vector index with its BM25, metadata and dedup companions."""
+        index = VectorStoreIndex(
+            nodes=[],
+            storage_context=IndexStorage.new_storage_context()
+        )
+        BM25Index.attach(index, BM25Index())
+        MetadataIndex.attach(index, MetadataIndex())
+        ChunkDeduplicator.attach(index, ChunkDeduplicator())
+        return index
+
     @staticmethod
     def create_index(documents: List):
-        """Build a vector index from the provided documents."""
+        """Build a vector index (and its BM25 companion) from the provided documents."""
         if not documents:
             return None
-        return VectorStoreIndex.from_documents(documents, show_progress=True)
+        return DocumentIndexer.add_to_index(DocumentIndexer.empty_index(), documents, show_progress=True)
     
     @staticmethod
-    def add_to_index(index: VectorStoreIndex, documents: List):
-        """Append new documents to an existing index."""
+    def add_to_index(index: VectorStoreIndex, documents: List, show_progress: bool = False):
+        """
+        Append new documents to an existing index.
+        Nodes are parsed once, deduplicated against the index and fed to the
+        vector index, BM25 and the metadata index.
+        """
+        dedup = ChunkDeduplicator.for_index(index)
+        nodes = dedup.filter(run_transformations(documents, Settings.transformations, show_progress=show_progress))
+        metadata = MetadataIndex.for_index(index)
+        index.insert_nodes(nodes)
+        BM25Index.for_index(index).add(nodes)
+        metadata.add(nodes)
+        dedup.apply_references(index.docstore, metadata)
         for doc in documents:
-            index.insert(doc)
+            index.docstore.set_document_hash(doc.doc_id, doc.hash)
+        return index
+
+    @staticmethod
+    def delete_from_index(index: VectorStoreIndex, doc_ids: List[str]):
+        """
+        Remove documents (and all of their nodes) from an existing index.
+        Documents whose duplicate chunks pointed at removed nodes are left
+        without them; see ChunkDeduplicator.pop_orphans.
+        """
+        bm25 = BM25Index.for_index(index)
+        metadata = MetadataIndex.for_index(index)
+        dedup = ChunkDeduplicator.for_index(index)
+        for doc_id in doc_ids:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+            bm25.delete_ref_doc(doc_id)
+            metadata.delete_ref_doc(doc_id)
+            dedup.delete_ref_doc(doc_id)
+        dedup.apply_references(index.docstore, metadata)
         return index
+
+    @staticmethod
+    def sync_index(
+        index: VectorStoreIndex = None,
+        required_exts: list = None,
+        persist_dir: str = STORAGE_DIR,
+        file_paths: list = None,
+        progress: Callable[[int, int], None] = None
+    ):
+        """
+        Bring the index in line with the data directory (or with `file_paths`).
+
+        Only new or changed files are parsed and embedded; nodes belonging to
+        changed or removed files are deleted first, and unchanged files whose
+        duplicate chunks were only indexed through those files are re-ingested
+        with them. An index without a
+        manifest (built before manifests existed) is rebuilt from scratch.
+        `progress(files_done, files_total)` is called as each file is written.
+        Returns (index, manifest, diff); the caller persists both.
+        With sharding enabled (SHARD_BY) the whole data directory is synced
+        shard by shard into a ShardedIndex.
+        """
+        if SHARD_BY != "none" and file_paths is None:
+            from .sharding import ShardedIndex
+            sharded = index if isinstance(index, ShardedIndex) else ShardedIndex(persist_dir)
+            return sharded.sync(required_exts, progress=progress)
+
+        manifest = IndexManifest.load(persist_dir) if index is not None else None
+        if manifest is None:
+            index, manifest = None, IndexManifest()
+
+        diff = manifest.diff(file_paths if file_paths is not None else DocumentLoader.list_files(required_exts))
+
+        stale_ids = []
+        for path in diff.changed + diff.removed:
+            stale_ids.extend(manifest.doc_ids(path))
+            manifest.forget(path)
+        if index is not None and stale_ids:
+            DocumentIndexer.delete_from_index(index, stale_ids)
+
+        for path in diff.unchanged:
+            manifest.touch(path, diff.fingerprints[path])
+
+        reingest = DocumentIndexer._orphaned_files(index, manifest) if index is not None else []
+        to_ingest = diff.added + diff.changed + reingest
+        if not to_ingest:
+            return index, manifest, diff
+
+        # Parse, split, embed and write in overlapping stages with bounded memory;
+        # failed files stay out of the manifest so the next update retries them
+        done = 0
+
+        def on_file(parsed):
+            nonlocal done
+            if parsed.error is not None:
+                diff.failed[parsed.path] = str(parsed.error)
+            else:
+                manifest.record(parsed.path, diff.fingerprints[parsed.path], [d.doc_id for d in parsed.documents])
+            done += 1
+            if progress:
+                progress(done, len(to_ingest))
+
+        target = index if index is not None else DocumentIndexer.empty_index()
+        stats = IngestPipeline(target, persist_dir=persist_dir).run(to_ingest, on_file=on_file)
+        diff.chunks, diff.duplicates = stats["chunks"], stats["duplicates"]
+        if index is None and stats["nodes"]:
+            index = target
+        return index, manifest, diff
+
+    @staticmethod
+    def _orphaned_files(index: VectorStoreIndex, manifest: IndexManifest) -> List[str]:
+        """
+        Drop (from index and manifest) files that lost the indexed copy of a
+        duplicate chunk, so they can be ingested again; repeats until no
+        deletion orphans further files.
+        """
+        dedup = ChunkDeduplicator.for_index(index)
+        reingest = []
+        while True:
+            orphans = dedup.pop_orphans()
+            paths = [p for p in manifest.files if orphans.intersection(manifest.doc_ids(p))] if orphans else []
+            if not paths:
+                return reingest
+            doc_ids = [doc_id for p in paths for doc_id in manifest.doc_ids(p)]
+            for path in paths:
+                manifest.forget(path)
+            DocumentIndexer.delete_from_index(index, doc_ids)
+            reingest.extend(paths)
@@ -0,0 +1,127 @@
+"""
+Stand-ins for the LLM and embedding model that construct the real model on first use.
+
+Importing the provider SDKs and loading model weights dominates cold start;
+with these wrappers `init_settings()` is cheap and the cost moves to the first
+query, or to a background `load()` (see config.warm_up).
+"""
+import threading
+from typing import Any, Callable, List, Sequence
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage, ChatResponse, ChatResponseAsyncGen, ChatResponseGen,
+    CompletionResponse, CompletionResponseAsyncGen, CompletionResponseGen, LLMMetadata
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import LLM
+
+
+class LazyEmbedding(BaseEmbedding):
+    """
+    Defers constructing an embedding model until the first text is embedded.
+    Loading a sentence-transformers model imports torch and reads the weights;
+    wrapped in CachedEmbedding, cache hits never load the model at all.
+    """
+
+    _factory: Callable[[], BaseEmbedding] = PrivateAttr()
+    _model: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, factory: Callable[[], BaseEmbedding], model_name: str, **kwargs: Any):
+        super().__init__(model_name=model_name, **kwargs)
+        self._factory = factory
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LazyEmbedding"
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> BaseEmbedding:
+        """Construct the wrapped model (once; safe to call from several threads)."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._factory()
+        return self._model
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.load().get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self.load().aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.load().get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.load().get_text_embedding_batch(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self.load().aget_text_embedding_batch(texts)
+
+
+class LazyLLM(LLM):
+    """
+    Defers constructing (and importing) an LLM client until its first call.
+    `metadata` is given up front, since engines read it (prompt helper sizing)
+    when they are built, long before the first call.
+    """
+
+    _factory: Callable[[], LLM] = PrivateAttr()
+    _metadata: LLMMetadata = PrivateAttr()
+    _model: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, factory: Callable[[], LLM], metadata: LLMMetadata, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._factory = factory
+        self._metadata = metadata
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LazyLLM"
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> LLM:
+        """Construct the wrapped LLM (once; safe to call from several threads)."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._factory()
+        return self._model
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._metadata
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self.load().chat(messages, **kwargs)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return self.load().complete(prompt, formatted=formatted, **kwargs)
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self.load().stream_chat(messages, **kwargs)
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        return self.load().stream_complete(prompt, formatted=formatted, **kwargs)
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self.load().achat(messages, **kwargs)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await self.load().acomplete(prompt, formatted=formatted, **kwargs)
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return await self.load().astream_chat(messages, **kwargs)
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        return await self.load().astream_complete(prompt, formatted=formatted, **kwargs)
@@ -1,24 +1,139 @@
+import os
+import time
+import multiprocessing
+from typing import Iterator, List, NamedTuple, Optional
 from llama_index.core import SimpleDirectoryReader
-from .config import DATA_DIR
+from .config import DATA_DIR, LOADER_WORKERS, LOADER_FILE_TIMEOUT
+
+
+class ParsedFile(NamedTuple):
+    """Outcome of parsing one file: its documents, or the error that stopped it."""
+    path: str
+    documents: list
+    error: Optional[Exception]
+
+
+# Excluded from embedding and LLM text like the reader's other file attributes. The
+# splitter budgets chunks net of that text, so a path left in it would give copies of a
+# file at different paths different chunk boundaries (and defeat chunk deduplication)
+PATH_METADATA_KEYS = ("file_path", "file_name")
+
+
+def _exclude_path_metadata(documents: list) -> list:
+    for doc in documents:
+        for keys in (doc.excluded_embed_metadata_keys, doc.excluded_llm_metadata_keys):
+            keys.extend(k for k in PATH_METADATA_KEYS if k not in keys)
+    return documents
+
+
+def _parse_file(file_path: str):
+    """Process-pool entry point (must be importable at module level)."""
+    return DocumentLoader.load_file(file_path)
+
 
 class DocumentLoader:
     """Handles Parsing & Loading of documents."""
     
     @staticmethod
-    def load_from_data_dir(required_exts: list = None):
+    def load_from_data_dir(required_exts: list = None, parallel: bool = False):
         """
         Load data from the local data directory.
         Allows specifying extensions (e.g., ['.pdf', '.txt', '.md']).
+        With parallel=True files are parsed in a process pool; files that
+        fail or time out are skipped.
         """
+        if parallel:
+            docs = []
+            for parsed in DocumentLoader.iter_files(DocumentLoader.list_files(required_exts)):
+                docs.extend(parsed.documents)
+            return docs
         reader = SimpleDirectoryReader(
             DATA_DIR, 
             required_exts=required_exts,
             recursive=True
         )
-        return reader.load_data()
+        return _exclude_path_metadata(reader.load_data())
     
     @staticmethod
     def load_file(file_path: str):
         """Load a single specific file with robust parsing."""
-        reader = SimpleDirectoryReader(input_files=[file_path])
-        return reader.load_data()
+        reader = SimpleDirectoryReader(input_files=[file_path], filename_as_id=True)
+        return _exclude_path_metadata(reader.load_data())
+
+    @staticmethod
+    def list_files(required_exts: list = None):
+        """
+        List the files in the data directory that would be parsed,
+        using the same rules as load_from_data_dir (recursive, no hidden files).
+        """
+        exts = {e.lower() for e in required_exts} if required_exts else None
+        files = []
+        for root, dirs, names in os.walk(DATA_DIR):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                if name.startswith("."):
+                    continue
+                if exts and os.path.splitext(name)[1].lower() not in exts:
+                    continue
+                files.append(os.path.join(root, name))
+        return sorted(files)
+
+    @staticmethod
+    def iter_files(file_paths: List[str], max_workers: int = None, timeout: float = None) -> Iterator[ParsedFile]:
+        """
+        Parse files in a process pool and yield each ParsedFile as soon as it finishes.
+
+        At most `max_workers` files are in flight, so a file's clock starts when
+        it is handed to a worker. A file that raises is reported with its error;
+        a file that exceeds `timeout` seconds is reported as a TimeoutError and
+        the pool is recycled (the stuck worker is terminated) while the other
+        in-flight files are resubmitted.
+        """
+        max_workers = max_workers or LOADER_WORKERS
+        timeout = LOADER_FILE_TIMEOUT if timeout is None else timeout
+        queue = list(reversed(file_paths))
+
+        if max_workers <= 1 or len(queue) <= 1:
+            while queue:
+                path = queue.pop()
+                try:
+                    yield ParsedFile(path, DocumentLoader.load_file(path), None)
+                except Exception as e:
+                    yield ParsedFile(path, [], e)
+            return
+
+        # "spawn" avoids forking a parent that already runs model/UI threads
+        ctx = multiprocessing.get_context("spawn")
+        workers = min(max_workers, len(queue))
+        pool = ctx.Pool(workers)
+        in_flight = {}
+        try:
+            while queue or in_flight:
+                while queue and len(in_flight) < workers:
+                    path = queue.pop()
+                    in_flight[path] = (pool.apply_async(_parse_file, (path,)), time.monotonic())
+
+                finished = False
+                now = time.monotonic()
+                for path, (result, started) in list(in_flight.items()):
+                    if result.ready():
+                        del in_flight[path]
+                        finished = True
+                        try:
+                            yield ParsedFile(path, result.get(), None)
+                        except Exception as e:
+                            yield ParsedFile(path, [], e)
+                    elif timeout and now - started > timeout:
+                        del in_flight[path]
+                        finished = True
+                        yield ParsedFile(path, [], TimeoutError(f"Parsing exceeded {timeout:.0f}s"))
+                        pool.terminate()
+                        pool = ctx.Pool(workers)
+                        queue.extend(in_flight)
+                        in_flight.clear()
+                        break
+
+                if not finished:
+                    time.sleep(0.05)
+        finally:
+            pool.terminate()
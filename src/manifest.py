@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+from .config import STORAGE_DIR
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ManifestDiff:
+    """Result of comparing the files on disk against an index manifest."""
+
+    def __init__(self):
+        self.added: List[str] = []
+        self.changed: List[str] = []
+        self.removed: List[str] = []
+        self.unchanged: List[str] = []
+        self.fingerprints: Dict[str, dict] = {}
+        self.failed: Dict[str, str] = {}
+        self.chunks = 0
+        self.duplicates = 0
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def summary(self) -> dict:
+        return {
+            "added": len(self.added),
+            "changed": len(self.changed),
+            "removed": len(self.removed),
+            "unchanged": len(self.unchanged),
+            "failed": len(self.failed),
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "dedup_ratio": round(self.duplicates / self.chunks, 4) if self.chunks else 0.0,
+        }
+
+
+class IndexManifest:
+    """
+    Tracks which source files are reflected in a persisted index.
+
+    Each entry records the file size, mtime and content hash together with
+    the document ids produced when the file was parsed, so an update only
+    has to re-embed files that actually changed.
+    """
+
+    def __init__(self, files: Optional[Dict[str, dict]] = None, updated_at: Optional[str] = None):
+        self.files = files or {}
+        self.updated_at = updated_at
+
+    @staticmethod
+    def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+        """Return the SHA-256 of a file, read in fixed-size blocks."""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @classmethod
+    def fingerprint(cls, file_path: str, previous: Optional[dict] = None) -> dict:
+        """
+        Describe a file by size, mtime and content hash.
+        The hash is only recomputed when size or mtime moved.
+        """
+        stat = os.stat(file_path)
+        if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+            return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": previous["sha256"]}
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": cls.hash_file(file_path)}
+
+    def diff(self, file_paths: List[str]) -> ManifestDiff:
+        """Classify the given files as added, changed, removed or unchanged."""
+        result = ManifestDiff()
+        current = set(file_paths)
+
+        for path in sorted(current):
+            previous = self.files.get(path)
+            fp = self.fingerprint(path, previous)
+            result.fingerprints[path] = fp
+            if previous is None:
+                result.added.append(path)
+            elif previous.get("sha256") != fp["sha256"]:
+                result.changed.append(path)
+            else:
+                result.unchanged.append(path)
+
+        result.removed = sorted(set(self.files) - current)
+        return result
+
+    def doc_ids(self, file_path: str) -> List[str]:
+        """Document ids that were indexed for a file."""
+        entry = self.files.get(file_path)
+        return list(entry.get("doc_ids", [])) if entry else []
+
+    def record(self, file_path: str, fingerprint: dict, doc_ids: List[str]):
+        """Store (or replace) the entry for a file."""
+        self.files[file_path] = {**fingerprint, "doc_ids": list(doc_ids)}
+
+    def forget(self, file_path: str):
+        """Drop the entry for a file."""
+        self.files.pop(file_path, None)
+
+    def touch(self, file_path: str, fingerprint: dict):
+        """Refresh size/mtime for a file whose content did not change."""
+        entry = self.files.get(file_path)
+        if entry:
+            entry.update(fingerprint)
+
+    def save(self, persist_dir: str = STORAGE_DIR):
+        """Write the manifest next to the index (atomically)."""
+        os.makedirs(persist_dir, exist_ok=True)
+        self.updated_at = datetime.now().isoformat()
+        path = os.path.join(persist_dir, MANIFEST_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": self.updated_at, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_dir: str = STORAGE_DIR):
+        """Load the manifest stored next to the index, or None if missing."""
+        path = os.path.join(persist_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(files=data.get("files", {}), updated_at=data.get("updated_at"))
@@ -0,0 +1,288 @@
+import os
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+METADATA_DIR = "metadata"
+ROWS_FILE = "rows.tsv"
+KEYWORD_FIELDS = ("file_name", "extension")
+
+
+class QueryFilter(NamedTuple):
+    """Restricts retrieval to chunks whose source matches every given criterion."""
+    files: Optional[List[str]] = None
+    extensions: Optional[List[str]] = None
+    ingested_after: Optional[float] = None   # unix timestamp, inclusive
+    ingested_before: Optional[float] = None  # unix timestamp, exclusive
+    page_min: Optional[int] = None
+    page_max: Optional[int] = None
+
+    @property
+    def is_empty(self) -> bool:
+        return all(v is None or v == [] for v in self)
+
+
+def _clean(value: str) -> str:
+    return value.replace("\t", " ").replace("\n", " ")
+
+
+def _page(node: BaseNode) -> int:
+    label = str(node.metadata.get("page_label", "")).strip()
+    return int(label) if label.isdigit() else -1
+
+
+def _file_date(node: BaseNode) -> Optional[float]:
+    value = node.metadata.get("last_modified_date") or node.metadata.get("creation_date")
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d").timestamp()
+    except ValueError:
+        return None
+
+
+class MetadataIndex:
+    """
+    Inverted index over chunk source attributes, used to narrow retrieval
+    before any scoring happens.
+
+    File name and extension map to posting lists of rows; ingestion time and
+    page number are kept as columns for range filters. A filter resolves to
+    the set of node ids in scope, so dense and BM25 scoring only touch those
+    rows. A chunk stored once for several files (see ChunkDeduplicator) is
+    posted under every file it occurs in. Persisted as
+    `<persist_dir>/metadata/rows.tsv` and loaded on first use.
+    """
+
+    _registry = weakref.WeakKeyDictionary()
+
+    def __init__(self, persist_dir: Optional[str] = None):
+        self.persist_dir = persist_dir
+        self._lock = threading.RLock()
+        self._loaded = persist_dir is None
+        self._node_ids: List[str] = []
+        self._ref_doc_ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._ref_rows: Optional[Dict[str, List[int]]] = None
+        self._keywords: Dict[str, List[str]] = {f: [] for f in KEYWORD_FIELDS}
+        self._postings: Dict[str, Dict[str, List[int]]] = {f: {} for f in KEYWORD_FIELDS}
+        # row -> other files holding the same chunk (deduplicated sources)
+        self._also_in: Dict[int, List[str]] = {}
+        self._ingested_at = np.zeros(0, dtype=np.float64)
+        self._page = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._version = 0
+
+    # ---- index registry ----------------------------------------------------
+
+    @classmethod
+    def attach(cls, index, metadata: "MetadataIndex") -> "MetadataIndex":
+        """Associate a metadata index with a vector index."""
+        cls._registry[index] = metadata
+        return metadata
+
+    @classmethod
+    def for_index(cls, index) -> "MetadataIndex":
+        """Metadata index attached to a vector index, built from its docstore if none is attached."""
+        metadata = cls._registry.get(index)
+        if metadata is None:
+            metadata = cls()
+            metadata.add(list(index.docstore.docs.values()), use_file_dates=True)
+            cls.attach(index, metadata)
+        return metadata
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, METADATA_DIR, ROWS_FILE))
+
+    # ---- loading / persistence ---------------------------------------------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = []
+            with open(os.path.join(self.persist_dir, METADATA_DIR, ROWS_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    node_id, ref_doc_id, file_name, extension, page, ingested_at, *also_in = line.rstrip("\n").split("\t")
+                    rows.append((node_id, ref_doc_id, file_name, extension, int(page), float(ingested_at), also_in))
+            self._append(rows)
+            self._loaded = True
+
+    def persist(self, persist_dir: str):
+        """Write the live rows (compacted) as a tab-separated table; extra source files trail each row."""
+        self._ensure_loaded()
+        with self._lock:
+            keep = np.flatnonzero(self._alive)
+            rows = [
+                (self._node_ids[r], self._ref_doc_ids[r], self._keywords["file_name"][r],
+                 self._keywords["extension"][r], int(self._page[r]), float(self._ingested_at[r]),
+                 self._also_in.get(r, []))
+                for r in keep
+            ]
+            path = os.path.join(persist_dir, METADATA_DIR, ROWS_FILE)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines("\t".join([*map(str, row[:6]), *row[6]]) + "\n" for row in rows)
+            os.replace(path + ".tmp", path)
+
+            self._node_ids, self._ref_doc_ids, self._id_to_row, self._ref_rows = [], [], {}, None
+            self._keywords = {f: [] for f in KEYWORD_FIELDS}
+            self._postings = {f: {} for f in KEYWORD_FIELDS}
+            self._also_in = {}
+            self._ingested_at = np.zeros(0, dtype=np.float64)
+            self._page = np.zeros(0, dtype=np.int32)
+            self._alive = np.zeros(0, dtype=bool)
+            self._append(rows)
+            self.persist_dir = persist_dir
+
+    # ---- mutation ----------------------------------------------------------
+
+    def _append(self, rows: List[tuple]):
+        """Append (node_id, ref_doc_id, file_name, extension, page, ingested_at, also_in) rows."""
+        start = len(self._node_ids)
+        for offset, (node_id, ref_doc_id, file_name, extension, _, _, also_in) in enumerate(rows):
+            self._node_ids.append(node_id)
+            self._ref_doc_ids.append(ref_doc_id)
+            self._id_to_row[node_id] = start + offset
+            if self._ref_rows is not None:
+                self._ref_rows.setdefault(ref_doc_id, []).append(start + offset)
+            self._keywords["file_name"].append(file_name)
+            self._keywords["extension"].append(extension)
+            self._postings["file_name"].setdefault(file_name, []).append(start + offset)
+            self._postings["extension"].setdefault(extension, []).append(start + offset)
+            self._set_also_in(start + offset, also_in)
+        self._page = np.concatenate([self._page, np.asarray([r[4] for r in rows], dtype=np.int32)])
+        self._ingested_at = np.concatenate([self._ingested_at, np.asarray([r[5] for r in rows], dtype=np.float64)])
+        self._alive = np.concatenate([self._alive, np.ones(len(rows), dtype=bool)])
+        self._version += 1
+
+    def add(self, nodes: List[BaseNode], ingested_at: Optional[float] = None, use_file_dates: bool = False):
+        """
+        Index the source attributes of nodes. Ingestion time defaults to now;
+        with use_file_dates (rebuilding from an existing docstore) the file's
+        modification date is used instead when known.
+        """
+        if not nodes:
+            return
+        self._ensure_loaded()
+        now = ingested_at or time.time()
+        rows = []
+        for node in nodes:
+            file_name = node.metadata.get("file_name") or os.path.basename(str(node.metadata.get("file_path", "")))
+            file_name = _clean(str(file_name))
+            stamp = (_file_date(node) if use_file_dates else None) or now
+            rows.append((
+                node.node_id, node.ref_doc_id or "", file_name,
+                os.path.splitext(file_name)[1].lower(), _page(node), stamp,
+                [_clean(str(f)) for f in node.metadata.get("also_in", [])],
+            ))
+        with self._lock:
+            self.delete_nodes([n.node_id for n in nodes if n.node_id in self._id_to_row])
+            self._append(rows)
+
+    def _set_also_in(self, row: int, file_names: List[str]):
+        """Replace the extra source files of a row, moving its postings accordingly."""
+        def postings(names):
+            own = (self._keywords["file_name"][row], self._keywords["extension"][row])
+            pairs = {("file_name", f) for f in names} | {("extension", os.path.splitext(f)[1].lower()) for f in names}
+            return pairs - {("file_name", own[0]), ("extension", own[1])}
+
+        old, new = postings(self._also_in.get(row, [])), postings(file_names)
+        for field, value in old - new:
+            self._postings[field][value].remove(row)
+        for field, value in new - old:
+            self._postings[field].setdefault(value, []).append(row)
+        if file_names:
+            self._also_in[row] = list(file_names)
+        else:
+            self._also_in.pop(row, None)
+
+    def set_sources(self, node_id: str, file_names: List[str]):
+        """Set the other files a (deduplicated) chunk occurs in, so file filters find it there too."""
+        self._ensure_loaded()
+        with self._lock:
+            row = self._id_to_row.get(node_id)
+            if row is not None:
+                self._set_also_in(row, [_clean(str(f)) for f in file_names])
+                self._version += 1
+
+    def _kill_rows(self, rows: List[int]):
+        rows = [r for r in rows if self._alive[r]]
+        if rows:
+            self._alive[rows] = False
+            for row in rows:
+                self._id_to_row.pop(self._node_ids[row], None)
+            self._version += 1
+
+    def delete_ref_doc(self, ref_doc_id: str):
+        """Remove all nodes of a source document."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._ref_rows is None:
+                self._ref_rows = {}
+                for row, ref in enumerate(self._ref_doc_ids):
+                    self._ref_rows.setdefault(ref, []).append(row)
+            self._kill_rows(self._ref_rows.pop(ref_doc_id, []))
+
+    def delete_nodes(self, node_ids: List[str]):
+        """Remove nodes by id."""
+        self._ensure_loaded()
+        with self._lock:
+            self._kill_rows([self._id_to_row[n] for n in node_ids if n in self._id_to_row])
+
+    # ---- reading -----------------------------------------------------------
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def node_ids(self) -> List[str]:
+        self._ensure_loaded()
+        return self._node_ids
+
+    def values(self, field: str) -> List[str]:
+        """Distinct values of a keyword field among live rows (for filter pickers)."""
+        self._ensure_loaded()
+        with self._lock:
+            return sorted(v for v, rows in self._postings[field].items() if v and self._alive[rows].any())
+
+    def ingestion_range(self) -> Optional[tuple]:
+        """(oldest, newest) ingestion timestamps of live rows."""
+        self._ensure_loaded()
+        stamps = self._ingested_at[self._alive]
+        return (float(stamps.min()), float(stamps.max())) if len(stamps) else None
+
+    def match(self, query_filter: QueryFilter) -> np.ndarray:
+        """
+        Sorted rows of this index that satisfy the filter. Keyword criteria are
+        resolved through posting lists first, so range checks only see candidates.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            rows = None
+            for field, wanted in (("file_name", query_filter.files), ("extension", query_filter.extensions)):
+                if wanted:
+                    if field == "extension":
+                        wanted = [w.lower() if w.startswith(".") else f".{w.lower()}" for w in wanted]
+                    postings = [self._postings[field].get(v, []) for v in wanted]
+                    hits = np.unique(np.fromiter((r for p in postings for r in p), dtype=np.int64))
+                    rows = hits if rows is None else np.intersect1d(rows, hits, assume_unique=True)
+            if rows is None:
+                rows = np.arange(len(self._node_ids), dtype=np.int64)
+
+            keep = self._alive[rows]
+            if query_filter.ingested_after is not None:
+                keep &= self._ingested_at[rows] >= query_filter.ingested_after
+            if query_filter.ingested_before is not None:
+                keep &= self._ingested_at[rows] < query_filter.ingested_before
+            if query_filter.page_min is not None:
+                keep &= self._page[rows] >= query_filter.page_min
+            if query_filter.page_max is not None:
+                keep &= (self._page[rows] <= query_filter.page_max) & (self._page[rows] >= 0)
+            return rows[keep]
@@ -0,0 +1,222 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import MetadataMode
+from .bm25_store import BM25Index
+from .dedup import ChunkDeduplicator
+from .metadata_index import MetadataIndex
+from .config import EMBED_BATCH_SIZE, PIPELINE_QUEUE_SIZE, PIPELINE_FLUSH_NODES
+from .loader import DocumentLoader, ParsedFile
+
+_DONE = object()
+
+# Mid-build vector flushes go here (inside the target directory) rather than into
+# the target's own files, which must only change together with the docstore
+SCRATCH_DIR = "ingest.tmp"
+
+
+class _Batch:
+    """Embedded nodes plus the files whose last nodes are contained in them."""
+
+    def __init__(self, nodes: list, completed: List[ParsedFile]):
+        self.nodes = nodes
+        self.completed = completed
+
+
+class IngestPipeline:
+    """
+    Streaming load → split → dedup → embed → write pipeline with bounded memory.
+
+    Each stage runs in its own thread and hands work to the next through a
+    bounded queue, so parsing, splitting and embedding overlap and only a
+    few batches are ever in flight. Embeddings are computed in batches of
+    `embed_batch_size`, and vector rows are flushed to a scratch directory
+    inside `persist_dir` every `flush_every` nodes so they leave RAM for the
+    memory map; IndexStorage.persist_index later writes them next to the
+    docstore and removes the scratch directory. Chunks that
+    duplicate an indexed chunk are dropped before embedding and recorded as
+    extra sources of that chunk (see ChunkDeduplicator).
+    """
+
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        persist_dir: Optional[str] = None,
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        flush_every: int = PIPELINE_FLUSH_NODES,
+    ):
+        self.index = index
+        self.persist_dir = persist_dir
+        self.embed_batch_size = embed_batch_size
+        self.queue_size = queue_size
+        self.flush_every = flush_every
+        self.stats = {
+            "files": 0, "failed": 0, "nodes": 0, "batches": 0, "flushes": 0,
+            "chunks": 0, "duplicates": 0, "near_duplicates": 0, "split_s": 0.0, "embed_s": 0.0, "write_s": 0.0,
+        }
+        self._errors: List[BaseException] = []
+        self._stop = threading.Event()
+        self._dedup: Optional[ChunkDeduplicator] = None
+
+    def _put(self, q: queue.Queue, item):
+        """Blocking put that gives up once the pipeline is being torn down."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        """Blocking get that returns _DONE once the pipeline is being torn down."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(self, target: Callable, *args) -> threading.Thread:
+        def run():
+            try:
+                target(*args)
+            except BaseException as e:
+                self._errors.append(e)
+                self._stop.set()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _load(self, file_paths: List[str], out: queue.Queue):
+        try:
+            for parsed in DocumentLoader.iter_files(file_paths):
+                if self._stop.is_set():
+                    return
+                self._put(out, parsed)
+        finally:
+            self._put(out, _DONE)
+
+    def _split(self, inp: queue.Queue, out: queue.Queue):
+        transformations = Settings.transformations
+        while True:
+            parsed = self._get(inp)
+            if parsed is _DONE:
+                break
+            if parsed.error is None and parsed.documents:
+                start = time.perf_counter()
+                nodes = run_transformations(parsed.documents, transformations)
+                self.stats["chunks"] += len(nodes)
+                nodes = self._dedup.filter(nodes)
+                self.stats["split_s"] += time.perf_counter() - start
+                for i in range(0, len(nodes), self.embed_batch_size):
+                    self._put(out, nodes[i:i + self.embed_batch_size])
+            # The file marker follows its nodes, so it completes with the batch holding its last node
+            self._put(out, parsed)
+        self._put(out, _DONE)
+
+    def _embed(self, inp: queue.Queue, out: queue.Queue):
+        embed_model = Settings.embed_model
+        pending, completed = [], []
+
+        def emit():
+            if pending:
+                start = time.perf_counter()
+                texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in pending]
+                for node, embedding in zip(pending, embed_model.get_text_embedding_batch(texts)):
+                    node.embedding = embedding
+                self.stats["embed_s"] += time.perf_counter() - start
+            self._put(out, _Batch(list(pending), list(completed)))
+            pending.clear()
+            completed.clear()
+
+        while True:
+            item = self._get(inp)
+            if item is _DONE:
+                break
+            if isinstance(item, ParsedFile):
+                completed.append(item)
+            else:
+                pending.extend(item)
+            if len(pending) >= self.embed_batch_size:
+                emit()
+        emit()
+        self._put(out, _DONE)
+
+    def _flush(self):
+        """Move written vector rows from RAM to the scratch matrix."""
+        vector_store = self.index.vector_store
+        if self.persist_dir and hasattr(vector_store, "persist"):
+            vector_store.persist(os.path.join(self.persist_dir, SCRATCH_DIR, "default__vector_store.json"))
+            self.stats["flushes"] += 1
+
+    def run(self, file_paths: List[str], on_file: Callable[[ParsedFile], None] = None):
+        """
+        Ingest the given files into the index.
+        `on_file(parsed)` is called once all nodes of a file are written
+        (or immediately for files that failed to parse).
+        """
+        bm25 = BM25Index.for_index(self.index)
+        metadata = MetadataIndex.for_index(self.index)
+        self._dedup = ChunkDeduplicator.for_index(self.index)
+        self._dedup.reset_stats()
+        parsed_q = queue.Queue(maxsize=self.queue_size)
+        nodes_q = queue.Queue(maxsize=self.queue_size)
+        batch_q = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            self._stage(self._load, file_paths, parsed_q),
+            self._stage(self._split, parsed_q, nodes_q),
+            self._stage(self._embed, nodes_q, batch_q),
+        ]
+
+        unflushed = 0
+        try:
+            while True:
+                try:
+                    batch = batch_q.get(timeout=0.1)
+                except queue.Empty:
+                    if self._errors:
+                        break
+                    continue
+                if batch is _DONE:
+                    break
+
+                if batch.nodes:
+                    start = time.perf_counter()
+                    self.index.insert_nodes(batch.nodes)
+                    bm25.add(batch.nodes)
+                    metadata.add(batch.nodes)
+                    self._dedup.apply_references(self.index.docstore, metadata)
+                    self.stats["write_s"] += time.perf_counter() - start
+                    self.stats["nodes"] += len(batch.nodes)
+                    self.stats["batches"] += 1
+                    unflushed += len(batch.nodes)
+                if unflushed >= self.flush_every:
+                    self._flush()
+                    unflushed = 0
+
+                for parsed in batch.completed:
+                    if parsed.error is None:
+                        self.stats["files"] += 1
+                        for doc in parsed.documents:
+                            self.index.docstore.set_document_hash(doc.doc_id, doc.hash)
+                    else:
+                        self.stats["failed"] += 1
+                    if on_file:
+                        on_file(parsed)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+
+        if self._errors:
+            raise self._errors[0]
+        # Sources found after their canonical chunk was written
+        self._dedup.apply_references(self.index.docstore, metadata)
+        dedup = self._dedup.summary()
+        self.stats["duplicates"], self.stats["near_duplicates"] = dedup["duplicates"], dedup["near"]
+        return self.stats
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.events.rerank import ReRankEndEvent, ReRankStartEvent
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from . import tracing
+from .config import RERANK_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+dispatcher = get_dispatcher(__name__)
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_cross_encoder(model_name: str, max_length: int = 512):
+    """Process-wide CPU CrossEncoder, loaded once (sentence-transformers is imported here)."""
+    key = (model_name, max_length)
+    with _models_lock:
+        if key not in _models:
+            from sentence_transformers import CrossEncoder
+            _models[key] = CrossEncoder(model_name, device="cpu", max_length=max_length)
+        return _models[key]
+
+
+class ScoreCache:
+    """LRU of cross-encoder scores keyed by (model, query hash, node id)."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._scores: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def query_key(query: str) -> bytes:
+        return hashlib.blake2b(" ".join(query.split()).encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: tuple) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put_many(self, items):
+        with self._lock:
+            for key, score in items:
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+
+shared_score_cache = ScoreCache(RERANK_CACHE_SIZE)
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Local cross-encoder reranker (drop-in for CohereRerank in `node_postprocessors`).
+
+    The best `max_candidates` retrieved nodes are scored against the query on
+    CPU in batches of `batch_size` (a single forward pass for typical candidate
+    counts). Scores are cached per (query, node), so repeated questions skip
+    inference. With a `time_budget_ms`, batches are sized to what is
+    predicted to fit in the remaining budget and scoring stops when nothing
+    more fits; unscored candidates keep their retrieval order below the
+    scored ones. If the model cannot be loaded (e.g. offline without cached
+    weights) nodes pass through in retrieval order.
+    """
+
+    model_name: str = Field(default="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    top_n: int = Field(default=3)
+    max_candidates: int = Field(default=20)
+    batch_size: int = Field(default=32)
+    time_budget_ms: Optional[float] = Field(default=None)
+    max_length: int = Field(default=512)
+
+    _cache: ScoreCache = PrivateAttr()
+    _seconds_per_pair: Optional[float] = PrivateAttr(default=None)
+    _disabled: bool = PrivateAttr(default=False)
+
+    def __init__(self, cache: ScoreCache = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._cache = cache or shared_score_cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def _model(self):
+        if self._disabled:
+            return None
+        try:
+            return load_cross_encoder(self.model_name, self.max_length)
+        except Exception as e:
+            logger.warning("Cross-encoder %s unavailable, reranking disabled: %s", self.model_name, e)
+            self._disabled = True
+            return None
+
+    def _predict(self, model, pairs: List[tuple], deadline: Optional[float]) -> List[float]:
+        """
+        Score pairs in batches of at most `batch_size`. With a deadline each
+        batch is cut to the pairs that still fit, going by the smoothed cost
+        per pair (before the first measurement, a small probe batch), and
+        scoring stops once not even one more pair fits.
+        """
+        scores: List[float] = []
+        i = 0
+        while i < len(pairs):
+            size = min(self.batch_size, len(pairs) - i)
+            if deadline is not None:
+                if self._seconds_per_pair is None:
+                    size = min(size, max(1, self.batch_size // 8))
+                else:
+                    fit = int((deadline - time.perf_counter()) / max(self._seconds_per_pair, 1e-9))
+                    if fit < 1:
+                        break
+                    size = min(size, fit)
+            batch = pairs[i:i + size]
+            start = time.perf_counter()
+            scores.extend(float(s) for s in model.predict(batch, batch_size=len(batch), show_progress_bar=False))
+            per_pair = (time.perf_counter() - start) / len(batch)
+            # Smoothed cost estimate used to size the remaining work against the budget
+            self._seconds_per_pair = per_pair if self._seconds_per_pair is None else (
+                0.7 * self._seconds_per_pair + 0.3 * per_pair
+            )
+            i += size
+        return scores
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+
+        dispatcher.event(ReRankStartEvent(
+            query=query_bundle, nodes=nodes, top_n=self.top_n, model_name=self.model_name
+        ))
+        deadline = None
+        if self.time_budget_ms:
+            deadline = time.perf_counter() + self.time_budget_ms / 1000
+
+        candidates = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)[:self.max_candidates]
+        query_key = ScoreCache.query_key(query_bundle.query_str)
+        keys = [(self.model_name, query_key, n.node.node_id) for n in candidates]
+        scores = [self._cache.get(k) for k in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        model = self._model() if missing else None
+        computed = []
+        if model is not None:
+            pairs = [
+                (query_bundle.query_str, candidates[i].node.get_content(metadata_mode=MetadataMode.EMBED))
+                for i in missing
+            ]
+            computed = self._predict(model, pairs, deadline)
+            self._cache.put_many((keys[i], score) for i, score in zip(missing, computed))
+            for i, score in zip(missing, computed):
+                scores[i] = score
+        tracing.count("rerank.cache_hits", len(candidates) - len(missing))
+        tracing.count("rerank.scored", len(computed))
+
+        scored = sorted(
+            (NodeWithScore(node=n.node, score=score) for n, score in zip(candidates, scores) if score is not None),
+            key=lambda n: n.score,
+            reverse=True,
+        )
+        unscored = [n for n, score in zip(candidates, scores) if score is None]
+        new_nodes = (scored + unscored)[:self.top_n]
+
+        dispatcher.event(ReRankEndEvent(nodes=new_nodes))
+        return new_nodes
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer, ChatSummaryMemoryBuffer
+from . import tracing
+from .config import MEMORY_SUMMARIZE, MEMORY_TOKEN_LIMIT, SESSION_IDLE_TTL, SESSION_MAX_ACTIVE
+
+
+def history_to_chat_messages(messages: List[dict]) -> List[ChatMessage]:
+    """Convert stored HistoryManager messages into LLM chat messages."""
+    roles = {"user": MessageRole.USER, "assistant": MessageRole.ASSISTANT}
+    return [
+        ChatMessage(role=roles[m["role"]], content=m["content"])
+        for m in messages if m.get("role") in roles
+    ]
+
+
+def _tokens(messages: List[ChatMessage]) -> int:
+    return sum(tracing.count_tokens(str(m.content or "")) for m in messages)
+
+
+class CondensedMemory(ChatSummaryMemoryBuffer):
+    """
+    Chat memory that keeps recent turns verbatim and folds older ones into a
+    running summary once the history exceeds its token limit.
+
+    The summary replaces the turns it covers, so the next fold summarizes the
+    previous summary plus the newly overflowing turns instead of the whole
+    conversation. Reports history tokens sent (`memory.tokens`) and tokens no
+    longer resent thanks to summaries (`memory.tokens_saved`) to the trace.
+    """
+
+    _folded_tokens: int = PrivateAttr(default=0)
+
+    def get(self, input: Optional[str] = None, initial_token_count: int = 0, **kwargs) -> List[ChatMessage]:
+        before = self.get_all()
+        with tracing.span("memory"):
+            history = super().get(input=input, initial_token_count=initial_token_count, **kwargs)
+        if len(history) < len(before):
+            self._folded_tokens += max(0, _tokens(before) - _tokens(history))
+            tracing.count("memory.summaries")
+        tracing.gauge("memory.tokens", _tokens(history))
+        tracing.gauge("memory.tokens_saved", self._folded_tokens)
+        return history
+
+
+def new_memory():
+    """Conversation memory for a new session, bounded by MEMORY_TOKEN_LIMIT."""
+    if MEMORY_SUMMARIZE:
+        return CondensedMemory.from_defaults(llm=Settings.llm, token_limit=MEMORY_TOKEN_LIMIT)
+    return ChatMemoryBuffer.from_defaults(token_limit=MEMORY_TOKEN_LIMIT)
+
+
+class ChatSession:
+    """Per-session conversation state: memory plus a chat engine bound to it."""
+
+    def __init__(self, session_id: str, memory):
+        self.session_id = session_id
+        self.memory = memory
+        self.chat_engine = None
+        self.engine = None
+        self.last_used = time.monotonic()
+
+    def get_chat_engine(self, engine):
+        """Chat engine for this session, built once per owning RAGQueryEngine."""
+        if self.chat_engine is None or self.engine is not engine:
+            self.chat_engine = engine.build_chat_engine(self.memory)
+            self.engine = engine
+        return self.chat_engine
+
+
+class SessionRegistry:
+    """
+    Process-wide cache of ChatSessions keyed by session id.
+
+    Sessions idle for longer than `idle_ttl` seconds are dropped, and at most
+    `max_sessions` are kept (least recently used first out). A session that is
+    not cached is rebuilt from its stored history when a loader is given.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_ACTIVE, idle_ttl: float = SESSION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        for session_id in [s for s, chat in self._sessions.items() if now - chat.last_used > self.idle_ttl]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str, history_loader: Optional[Callable[[str], List[dict]]] = None) -> ChatSession:
+        """Return the session, creating (and restoring its memory) if needed."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                memory = new_memory()
+                if history_loader is not None:
+                    memory.set(history_to_chat_messages(history_loader(session_id)))
+                session = ChatSession(session_id, memory)
+                self._sessions[session_id] = session
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = now
+            self._evict(now)
+            return session
+
+    def restore(self, session_id: str, messages: List[dict]) -> ChatSession:
+        """Reset a session's memory to the given stored history."""
+        session = self.get(session_id)
+        session.memory.set(history_to_chat_messages(messages))
+        return session
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+# Shared by every RAGQueryEngine in the process so conversations survive index rebuilds
+shared_sessions = SessionRegistry()
@@ -0,0 +1,352 @@
+"""
+Sharded index: the corpus split into independent indexes under
+`<persist_dir>/shards/<shard_id>/`, each a complete index directory
+(docstore, vectors, BM25, metadata, manifest).
+
+Files are assigned to shards by SHARD_BY ("hash" of the path relative to
+data/, or the top-level "directory"), so a shard is built, persisted,
+loaded and rebuilt without touching the others. Queries fan out over
+all shards in a thread pool and the shards' candidates are fused once.
+
+    python -m src.sharding status
+    python -m src.sharding rebuild <shard_id>
+
+A CLI rebuild writes a new index version (see IndexStorage.publish), so a
+running app switches to it without ever reading a half-written shard. It
+takes the storage root's build lock and exits if a build is running.
+"""
+import argparse
+import contextvars
+import hashlib
+import os
+import re
+import shutil
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from .bm25_store import BM25Index, CorpusStats
+from .config import DATA_DIR, INDEX_SHARDS, SHARD_BY, SHARD_WORKERS, STORAGE_DIR
+from .hybrid_retriever import HybridRetriever, filtered, reused_nodes
+from .loader import DocumentLoader
+from .manifest import IndexManifest, ManifestDiff
+from .metadata_index import MetadataIndex, QueryFilter
+from .tracing import span
+
+SHARDS_DIR = "shards"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    """Process-wide pool for shard loading and query fan-out."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, SHARD_WORKERS), thread_name_prefix="rag-shard")
+        return _executor
+
+
+def shard_key(file_path: str, mode: str = None, n_shards: int = None) -> str:
+    """Shard a source file belongs to."""
+    mode = mode or SHARD_BY
+    rel = os.path.relpath(file_path, DATA_DIR)
+    if mode == "directory":
+        head, sep, _ = rel.partition(os.sep)
+        return re.sub(r"[^\w.-]", "_", head) if sep else "_root"
+    digest = hashlib.blake2b(rel.replace(os.sep, "/").encode("utf-8"), digest_size=8).digest()
+    return f"shard-{int.from_bytes(digest, 'big') % max(1, n_shards or INDEX_SHARDS):02d}"
+
+
+def _merge_diff(total: ManifestDiff, part: ManifestDiff):
+    total.added.extend(part.added)
+    total.changed.extend(part.changed)
+    total.removed.extend(part.removed)
+    total.unchanged.extend(part.unchanged)
+    total.fingerprints.update(part.fingerprints)
+    total.failed.update(part.failed)
+    total.chunks += part.chunks
+    total.duplicates += part.duplicates
+
+
+class ShardManifests:
+    """Per-shard manifests returned by ShardedIndex.sync; saved into each shard's directory."""
+
+    def __init__(self):
+        self.shards: Dict[str, IndexManifest] = {}
+
+    def save(self, persist_dir: str = STORAGE_DIR):
+        for shard_id, manifest in self.shards.items():
+            manifest.save(os.path.join(persist_dir, SHARDS_DIR, shard_id))
+
+
+class ShardedMetadata:
+    """Read-only union of the shards' metadata indexes (same reading API as MetadataIndex)."""
+
+    def __init__(self, indexes: List[MetadataIndex]):
+        self._indexes = indexes
+
+    def values(self, field: str) -> List[str]:
+        return sorted({v for m in self._indexes for v in m.values(field)})
+
+    def ingestion_range(self) -> Optional[tuple]:
+        ranges = [r for r in (m.ingestion_range() for m in self._indexes) if r]
+        return (min(r[0] for r in ranges), max(r[1] for r in ranges)) if ranges else None
+
+    def match(self, query_filter: QueryFilter) -> np.ndarray:
+        """Matching rows of every shard, concatenated (useful for counting only)."""
+        parts = [m.match(query_filter) for m in self._indexes]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+class ShardedIndex:
+    """A set of independently persisted shard indexes keyed by shard id."""
+
+    def __init__(self, persist_dir: str = STORAGE_DIR, shards: Dict = None):
+        self.persist_dir = persist_dir
+        self.shards = dict(shards or {})
+        self._dirty = set()
+
+    def shard_dir(self, shard_id: str, persist_dir: str = None) -> str:
+        return os.path.join(persist_dir or self.persist_dir, SHARDS_DIR, shard_id)
+
+    @staticmethod
+    def shard_ids(persist_dir: str = STORAGE_DIR) -> List[str]:
+        """Persisted shards (directories holding a docstore; staging leftovers are skipped)."""
+        root = os.path.join(persist_dir, SHARDS_DIR)
+        if not os.path.isdir(root):
+            return []
+        return sorted(
+            name for name in os.listdir(root)
+            if "~" not in name and os.path.exists(os.path.join(root, name, "docstore.json"))
+        )
+
+    @classmethod
+    def load(cls, persist_dir: str = STORAGE_DIR) -> Optional["ShardedIndex"]:
+        """Load every persisted shard in parallel, or None if there are none."""
+        from .storage import IndexStorage
+        shard_ids = cls.shard_ids(persist_dir)
+        if not shard_ids:
+            return None
+        sharded = cls(persist_dir)
+        loaded = _pool().map(lambda s: IndexStorage.load_index(sharded.shard_dir(s), sharded=False), shard_ids)
+        sharded.shards = {s: index for s, index in zip(shard_ids, loaded) if index is not None}
+        return sharded
+
+    @property
+    def version(self) -> str:
+        """Changes whenever any shard's contents change."""
+        return ";".join(
+            f"{s}:{index.vector_store.generation}:{index.vector_store.version}:{BM25Index.for_index(index).version}"
+            for s, index in sorted(self.shards.items())
+        )
+
+    @property
+    def metadata(self) -> ShardedMetadata:
+        return ShardedMetadata([MetadataIndex.for_index(index) for index in self.shards.values()])
+
+    def sync(self, required_exts: list = None, progress: Callable[[int, int], None] = None):
+        """
+        Bring every shard in line with the data directory (see DocumentIndexer.sync_index).
+        Shards whose files did not change are left untouched. `progress(done, total)`
+        counts files across shards; the total grows as each shard is diffed. Returns
+        (index_or_None, ShardManifests, combined diff); persist with IndexStorage.persist_index.
+        """
+        from .indexer import DocumentIndexer
+        groups = defaultdict(list)
+        for path in DocumentLoader.list_files(required_exts):
+            groups[shard_key(path)].append(path)
+
+        manifests, diff = ShardManifests(), ManifestDiff()
+        finished = 0
+
+        def shard_progress(done, total):
+            if progress:
+                progress(finished + done, finished + total)
+
+        for shard_id in sorted(set(groups) | set(self.shards)):
+            index, manifest, shard_diff = DocumentIndexer.sync_index(
+                self.shards.get(shard_id),
+                file_paths=groups.get(shard_id, []),
+                persist_dir=self.shard_dir(shard_id),
+                progress=shard_progress
+            )
+            finished += len(shard_diff.added) + len(shard_diff.changed)
+            _merge_diff(diff, shard_diff)
+            manifests.shards[shard_id] = manifest
+            if index is not None:
+                if shard_diff.has_changes or index is not self.shards.get(shard_id):
+                    self._dirty.add(shard_id)
+                self.shards[shard_id] = index
+        return (self if self.shards else None), manifests, diff
+
+    def persist(self, manifests: ShardManifests = None, persist_dir: str = None):
+        """Write shards changed since the last persist; manifests of the others are refreshed."""
+        from .storage import IndexStorage
+        manifests = manifests or ShardManifests()
+        for shard_id in sorted(set(self.shards) | set(manifests.shards)):
+            shard_dir = self.shard_dir(shard_id, persist_dir)
+            manifest = manifests.shards.get(shard_id)
+            if shard_id in self._dirty:
+                IndexStorage.persist_index(self.shards[shard_id], manifest, persist_dir=shard_dir)
+            elif manifest is not None and shard_id in self.shards:
+                manifest.save(shard_dir)
+        self._dirty.clear()
+
+    def rebuild_shard(self, shard_id: str, required_exts: list = None) -> ManifestDiff:
+        """
+        Re-index one shard from scratch in a staging directory and swap it in;
+        other shards are neither read nor written.
+        """
+        from .indexer import DocumentIndexer
+        from .storage import IndexStorage
+        if not re.fullmatch(r"[\w.-]+", shard_id) or shard_id in (".", ".."):
+            raise ValueError(f"Invalid shard id: {shard_id!r}")
+        files = [p for p in DocumentLoader.list_files(required_exts) if shard_key(p) == shard_id]
+        live_dir = self.shard_dir(shard_id)
+        staging_dir, retired_dir = live_dir + "~rebuild", live_dir + "~old"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        index, manifest, diff = DocumentIndexer.sync_index(None, file_paths=files, persist_dir=staging_dir)
+        if index is not None:
+            IndexStorage.persist_index(index, manifest, persist_dir=staging_dir)
+        shutil.rmtree(retired_dir, ignore_errors=True)
+        if os.path.exists(live_dir):
+            os.replace(live_dir, retired_dir)
+        if index is not None:
+            os.replace(staging_dir, live_dir)
+            # Reload so the shard's stores point at its final directory
+            self.shards[shard_id] = IndexStorage.load_index(live_dir, sharded=False)
+        else:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self.shards.pop(shard_id, None)
+        shutil.rmtree(retired_dir, ignore_errors=True)
+        self._dirty.discard(shard_id)
+        return diff
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Fans a query out to one HybridRetriever per shard and fuses the results once.
+
+    The query is embedded once and the shards are searched concurrently in
+    the shared thread pool (the dense and sparse products release the GIL).
+    BM25 uses collection statistics summed over all shards, and each shard
+    returns the raw dense and BM25 scores of its fusion candidates; ranks and
+    normalization are only taken over the merged pools, so the top-k matches
+    that of a single index over the same corpus. Retrieval filters and the
+    current trace carry over to the worker threads.
+    """
+
+    def __init__(self, retrievers: Dict[str, HybridRetriever], similarity_top_k: int = 5, embed_model=None, **kwargs):
+        self._retrievers = retrievers
+        self._similarity_top_k = similarity_top_k
+        self._embed_model = embed_model
+        super().__init__(**kwargs)
+
+    def filtered(self, query_filter: Optional[QueryFilter]):
+        """Restrict retrievals made in this context (thread/task) to the filter's scope."""
+        return filtered(query_filter)
+
+    @staticmethod
+    def _fan_out(fn: Callable, retrievers: List[HybridRetriever]) -> list:
+        futures = [_pool().submit(contextvars.copy_context().run, fn, r) for r in retrievers]
+        return [f.result() for f in futures]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        retrievers = list(self._retrievers.values())
+        if not retrievers:
+            return []
+        reused = reused_nodes(query_bundle)
+        if reused is not None:
+            return reused
+        if query_bundle.embedding is None:
+            with span("retrieve.embed"):
+                embed_model = self._embed_model or Settings.embed_model
+                query_bundle = QueryBundle(
+                    query_str=query_bundle.query_str,
+                    embedding=embed_model.get_query_embedding(query_bundle.query_str),
+                )
+        with span("retrieve.fanout", shards=len(retrievers)) as s:
+            corpus = CorpusStats.merge(self._fan_out(lambda r: r.corpus_stats(query_bundle.query_str), retrievers))
+            pools = self._fan_out(lambda r: r.candidates(query_bundle, corpus), retrievers)
+            # Shards share their fusion settings (see build_retriever)
+            merged = retrievers[0].fuse(pools)
+            s.set(candidates=sum(len(p.node_ids) for p in pools if p is not None), returned=len(merged))
+        return merged
+
+
+def build_retriever(sharded: ShardedIndex, similarity_top_k: int, **hybrid_kwargs) -> ShardedRetriever:
+    """ShardedRetriever with one HybridRetriever per shard."""
+    return ShardedRetriever(
+        {
+            shard_id: HybridRetriever(
+                index.vector_store,
+                BM25Index.for_index(index),
+                index.docstore,
+                similarity_top_k=similarity_top_k,
+                metadata=MetadataIndex.for_index(index),
+                **hybrid_kwargs
+            )
+            for shard_id, index in sorted(sharded.shards.items())
+        },
+        similarity_top_k=similarity_top_k
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or rebuild index shards.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="List shards with their node and file counts")
+    rebuild = sub.add_parser("rebuild", help="Re-index a single shard from its source files")
+    rebuild.add_argument("shard_id")
+    rebuild.add_argument("--exts", nargs="*", default=[".pdf", ".txt", ".md"], help="File extensions to index")
+    args = parser.parse_args(argv)
+
+    from .storage import BuildInProgress, IndexStorage
+    if args.command == "status":
+        root = IndexStorage.active_dir()
+        for shard_id in ShardedIndex.shard_ids(root):
+            manifest = IndexManifest.load(os.path.join(root, SHARDS_DIR, shard_id))
+            files = len(manifest.files) if manifest else 0
+            size_mb = os.path.getsize(os.path.join(root, SHARDS_DIR, shard_id, "docstore.json")) / 1e6
+            print(f"{shard_id:<24} {files:>7} files  docstore {size_mb:8.1f} MB")
+        return 0
+
+    # Shards the data directory maps files to, plus persisted ones (whose files may all be gone)
+    known = {shard_key(p) for p in DocumentLoader.list_files(args.exts)}
+    known.update(ShardedIndex.shard_ids(IndexStorage.active_dir()))
+    if args.shard_id not in known:
+        print(f"Unknown shard {args.shard_id!r}; known shards: {', '.join(sorted(known)) or 'none'}", file=sys.stderr)
+        return 2
+
+    from .config import init_settings
+    if not init_settings():
+        # Indexing never calls the LLM; a key is only needed to answer queries
+        from llama_index.core.llms import MockLLM
+        init_settings(llm=MockLLM())
+    try:
+        with IndexStorage.build_lock() as lock:
+            version, version_dir = IndexStorage.new_version(lock)
+            sharded = ShardedIndex.load(version_dir) or ShardedIndex(version_dir)
+            diff = sharded.rebuild_shard(args.shard_id, required_exts=args.exts)
+            IndexStorage.publish(lock)
+    except BuildInProgress as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(
+        f"{args.shard_id}: {len(diff.added)} files indexed, {len(diff.failed)} failed, "
+        f"{diff.duplicates}/{diff.chunks} chunks deduplicated",
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,271 @@
+import json
 import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Optional
 from llama_index.core import StorageContext, load_index_from_storage, VectorStoreIndex
-from .config import STORAGE_DIR
+from .config import SHARD_BY, STORAGE_DIR
+from .vector_store import MmapVectorStore
+from .bm25_store import BM25Index
+from .dedup import ChunkDeduplicator
+from .metadata_index import MetadataIndex
+from .pipeline import SCRATCH_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized across processes
+    fcntl = None
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "build.lock"
+COMPLETE_FILE = "COMPLETE"
+
+
+class BuildInProgress(RuntimeError):
+    """Another build (in this or another process) holds the storage root's build lock."""
+
+
+class StaleBaseVersion(RuntimeError):
+    """The published version changed after a build copied it; publishing would discard that version."""
+
+
+class BuildLock:
+    """
+    Held build lock of a storage root. The version a build started from
+    (`base`) and the one it writes are recorded in the lock file, so other
+    processes can tell which unfinished version directory is in use.
+    """
+
+    def __init__(self, root: str, fd: int):
+        self.root = root
+        self.base: Optional[str] = None
+        self.version: Optional[str] = None
+        self._fd = fd
+
+    def record(self, base: Optional[str], version: str):
+        self.base, self.version = base, version
+        os.ftruncate(self._fd, 0)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, json.dumps({"pid": os.getpid(), "base": base, "version": version}).encode("utf-8"))
+        os.fsync(self._fd)
+
+
+def _link_or_copy(src: str, dst: str):
+    """Hard-link a file into a new version, copying where links are unsupported."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _unshare(persist_dir: str):
+    """
+    Give the JSON stores of `persist_dir` their own inodes. llama_index
+    rewrites them in place, which would also change the hard-linked copy in
+    the published version; every other index file is replaced via rename.
+    """
+    if not os.path.isdir(persist_dir):
+        return
+    for name in os.listdir(persist_dir):
+        path = os.path.join(persist_dir, name)
+        if name.endswith(".json") and os.stat(path).st_nlink > 1:
+            os.unlink(path)
+
 
 class IndexStorage:
-    """Handles Storing and loading indices from persistent storage."""
+    """
+    Handles Storing and loading indices from persistent storage.
+
+    Background builds write complete index versions to `<root>/versions/<id>`
+    and then atomically repoint `<root>/CURRENT` at them, so readers only ever
+    see a finished index. A root without CURRENT holds the index directly.
+    Builds hold the root's build lock from copying their base version until
+    publishing, so concurrent builds (other processes included) cannot
+    overwrite each other's results or delete each other's directories.
+    """
     
     @staticmethod
-    def persist_index(index: VectorStoreIndex):
-        """Save index to disk."""
+    def current_version(root: str = STORAGE_DIR) -> Optional[str]:
+        """Id of the published index version, or None for an unversioned root."""
+        try:
+            with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def version_dir(version: Optional[str], root: str = STORAGE_DIR) -> str:
+        """Directory of an index version (the root itself for None)."""
+        return os.path.join(root, VERSIONS_DIR, version) if version else root
+
+    @staticmethod
+    def active_dir(root: str = STORAGE_DIR) -> str:
+        """Directory holding the index readers should use."""
+        return IndexStorage.version_dir(IndexStorage.current_version(root), root)
+
+    @staticmethod
+    @contextmanager
+    def build_lock(root: str = STORAGE_DIR) -> Iterator[BuildLock]:
+        """
+        Exclusive right to build and publish versions under `root`, held for a
+        whole build. An advisory flock on `<root>/build.lock`, so it is released
+        when its holder exits or crashes. Raises BuildInProgress when held.
+        """
+        os.makedirs(root, exist_ok=True)
+        fd = os.open(os.path.join(root, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise BuildInProgress("Another index build is running.") from None
+            yield BuildLock(root, fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def live_build(root: str = STORAGE_DIR) -> Optional[dict]:
+        """What the build holding `root`'s lock recorded ({} if unreadable), or None if no build runs."""
+        path = os.path.join(root, LOCK_FILE)
+        if fcntl is None or not os.path.exists(path):
+            return None
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                try:
+                    return json.loads(os.read(fd, 4096) or b"{}")
+                except ValueError:
+                    return {}
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return None
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def new_version(lock: BuildLock, copy_current: bool = True):
+        """
+        Create a directory for a new index version; returns (version_id, path).
+        With `copy_current`, the index files of the published version are
+        hard-linked in (only directories are created), so untouched shards
+        cost nothing; files a build rewrites are replaced by rename or
+        unshared first (see persist_index), never written through the link.
+        The published version is recorded in the lock as the build's base.
+        """
+        root = lock.root
+        base = IndexStorage.current_version(root)
+        copy_from = IndexStorage.version_dir(base, root)
+        version = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        path = os.path.join(root, VERSIONS_DIR, version)
+        lock.record(base, version)
+        if copy_current and os.path.isdir(copy_from):
+            shutil.copytree(copy_from, path, copy_function=_link_or_copy, ignore=shutil.ignore_patterns(
+                VERSIONS_DIR, CURRENT_FILE, LOCK_FILE, COMPLETE_FILE, SCRATCH_DIR, "*.tmp", "*~rebuild", "*~old"
+            ))
+        else:
+            os.makedirs(path)
+        return version, path
+
+    @staticmethod
+    def publish(lock: BuildLock, keep_previous: bool = True):
+        """
+        Mark the lock's new version complete and atomically make it the active
+        index. Refuses (StaleBaseVersion) when the published version is no
+        longer the one the build started from. The version it replaces is kept
+        (engines may still be answering from it); older ones are removed.
+        """
+        root, version = lock.root, lock.version
+        previous = IndexStorage.current_version(root)
+        if previous != lock.base:
+            raise StaleBaseVersion(
+                f"Index version {previous} was published after this build started from {lock.base}."
+            )
+        marker = os.path.join(IndexStorage.version_dir(version, root), COMPLETE_FILE)
+        with open(marker, "w", encoding="utf-8") as f:
+            f.write(datetime.now().isoformat())
+            f.flush()
+            os.fsync(f.fileno())
+        path = os.path.join(root, CURRENT_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+        keep = {version, previous} if keep_previous else {version}
+        IndexStorage.prune_versions(root, keep)
+
+    @staticmethod
+    def prune_versions(root: str = STORAGE_DIR, keep=()):
+        """
+        Delete version directories not in `keep`: complete ones, and unfinished
+        ones (left behind by a crashed build) unless a running build owns them.
+        """
+        versions_dir = os.path.join(root, VERSIONS_DIR)
+        if not os.path.isdir(versions_dir):
+            return
+        live = IndexStorage.live_build(root)
+        for name in os.listdir(versions_dir):
+            path = os.path.join(versions_dir, name)
+            if name in keep:
+                continue
+            if not os.path.exists(os.path.join(path, COMPLETE_FILE)) and live is not None and live.get("version") in (name, None):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+    
+    @staticmethod
+    def persist_index(index: VectorStoreIndex, manifest=None, persist_dir: str = STORAGE_DIR):
+        """Save index to disk. The manifest is written last so it never runs ahead of the index."""
+        from .sharding import ShardedIndex
+        if isinstance(index, ShardedIndex):
+            # Only shards changed since the last persist are written
+            index.persist(manifest, persist_dir=persist_dir)
+            return
         if index:
-            index.storage_context.persist(persist_dir=STORAGE_DIR)
+            _unshare(persist_dir)
+            index.storage_context.persist(persist_dir=persist_dir)
+            # Vectors flushed mid-build now live next to the docstore
+            shutil.rmtree(os.path.join(persist_dir, SCRATCH_DIR), ignore_errors=True)
+            BM25Index.for_index(index).persist(persist_dir)
+            MetadataIndex.for_index(index).persist(persist_dir)
+            ChunkDeduplicator.for_index(index).persist(persist_dir)
+            if manifest is not None:
+                manifest.save(persist_dir)
+    
+    @staticmethod
+    def new_storage_context():
+        """Storage context for a fresh index, backed by the binary vector store."""
+        return StorageContext.from_defaults(vector_store=MmapVectorStore())
     
     @staticmethod
-    def load_index():
-        """Load index from disk if it exists."""
-        if os.path.exists(STORAGE_DIR) and os.listdir(STORAGE_DIR):
-            storage_context = StorageContext.from_defaults(persist_dir=STORAGE_DIR)
-            return load_index_from_storage(storage_context)
+    def load_index(persist_dir: str = STORAGE_DIR, sharded: bool = None):
+        """
+        Load index from disk if it exists (the published version of a versioned root).
+        Vectors are memory-mapped lazily; only the docstore is parsed up front.
+        With sharding enabled (SHARD_BY) this returns a ShardedIndex whose
+        shards are loaded in parallel.
+        """
+        persist_dir = IndexStorage.active_dir(persist_dir)
+        if sharded if sharded is not None else SHARD_BY != "none":
+            from .sharding import ShardedIndex
+            return ShardedIndex.load(persist_dir)
+        if os.path.exists(os.path.join(persist_dir, "docstore.json")):
+            storage_context = StorageContext.from_defaults(
+                persist_dir=persist_dir,
+                vector_store=MmapVectorStore.from_persist_dir(persist_dir)
+            )
+            index = load_index_from_storage(storage_context)
+            if BM25Index.exists(persist_dir):
+                # Loaded lazily on the first lexical query
+                BM25Index.attach(index, BM25Index(persist_dir=persist_dir))
+            if MetadataIndex.exists(persist_dir):
+                MetadataIndex.attach(index, MetadataIndex(persist_dir=persist_dir))
+            if ChunkDeduplicator.exists(persist_dir):
+                # Only read when documents are added or removed
+                ChunkDeduplicator.attach(index, ChunkDeduplicator(persist_dir=persist_dir))
+            return index
         return None
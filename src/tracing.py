@@ -0,0 +1,514 @@
+"""
+Per-query tracing and latency histograms.
+
+A trace collects timed spans for one user-facing operation (a chat turn, an
+evaluation). Spans come from explicit `span()` blocks in our own code
+(sanitization, answer cache, hybrid retrieval stages, evaluators) and from
+LlamaIndex instrumentation events (LLM calls, reranking). Finished traces
+feed process-wide histograms that a background thread exports to TRACE_DIR
+every TRACE_FLUSH_SECONDS (and at exit):
+
+    metrics.json   aggregated latency histograms and counters (rewritten)
+    traces.jsonl   one line per finished trace (rotated at TRACE_LOG_MAX_MB)
+
+Print a summary with `python -m src.tracing [metrics.json]`.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+_span_stack: contextvars.ContextVar = contextvars.ContextVar("rag_span_stack", default=())
+
+
+class Span:
+    """One timed stage of a trace."""
+
+    __slots__ = ("name", "start", "duration", "depth", "attrs")
+
+    def __init__(self, name: str, start: float, depth: int, attrs: dict):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.depth = depth
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, t0: float) -> dict:
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - t0) * 1000, 3),
+            "ms": round((self.duration or 0.0) * 1000, 3),
+            "depth": self.depth,
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class _NoopSpan:
+    """Returned outside of a trace so call sites never need to check."""
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    """Spans, counters and attributes of one traced operation."""
+
+    def __init__(self, name: str, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self.t0 = time.perf_counter()
+        self.duration = None
+        self.attrs = dict(attrs)
+        self.counters: Dict[str, float] = {}
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def open_span(self, name: str, depth: int = 0, start: float = None, **attrs) -> Span:
+        span = Span(name, start or time.perf_counter(), depth, attrs)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def has_span(self, name: str) -> bool:
+        return any(s.name == name and s.duration is not None for s in self.spans)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total milliseconds per span name, in order of first appearance."""
+        out: Dict[str, float] = {}
+        for s in self.spans:
+            if s.duration is not None:
+                out[s.name] = round(out.get(s.name, 0.0) + s.duration * 1000, 3)
+        return out
+
+    def summary(self) -> dict:
+        """Compact form for display next to an answer."""
+        return {
+            "total_ms": round((self.duration or 0.0) * 1000, 3),
+            "stages": self.breakdown(),
+            "counters": dict(self.counters),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_ms": round((self.duration or 0.0) * 1000, 3),
+            "attrs": self.attrs,
+            "counters": self.counters,
+            "spans": [s.to_dict(self.t0) for s in sorted(self.spans, key=lambda s: s.start)],
+        }
+
+
+class Histogram:
+    """Log-bucketed latency histogram (milliseconds) with exact count/sum/min/max."""
+
+    BOUNDS = [round(0.05 * 1.5 ** i, 3) for i in range(40)]  # 0.05 ms .. ~370 s
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        lo, hi = 0, len(self.BOUNDS)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ms <= self.BOUNDS[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.buckets[lo] += 1
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (clamped to the observed range)."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                bound = self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "min_ms": round(self.min, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p90_ms": round(self.percentile(90), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max, 3),
+            "buckets": {str(b): n for b, n in zip(self.BOUNDS + ["inf"], self.buckets) if n},
+        }
+
+
+class MetricsRegistry:
+    """Process-wide aggregation of finished traces, exported to files."""
+
+    def __init__(self):
+        self.enabled = True
+        self.export_dir: Optional[str] = None
+        self.max_log_bytes = 50 * 1024 * 1024
+        self.flush_interval = 5.0
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Finished traces not yet written; exported off the request path by the flush thread
+        self._unexported: List[dict] = []
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def configure(self, enabled: bool = True, export_dir: str = None, max_log_mb: float = 50,
+                  flush_interval: float = 5.0):
+        self.flush()
+        self.enabled = enabled
+        self.export_dir = export_dir
+        self.max_log_bytes = int(max_log_mb * 1024 * 1024)
+        self.flush_interval = flush_interval
+        if enabled:
+            _install_event_handler()
+
+    def observe(self, name: str, ms: float):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        hist.observe(ms)
+
+    def record(self, trace: Trace):
+        with self._lock:
+            self.observe(f"{trace.name}.total", trace.duration * 1000)
+            for s in trace.spans:
+                if s.duration is not None:
+                    self.observe(s.name, s.duration * 1000)
+            self.counters[f"{trace.name}.count"] = self.counters.get(f"{trace.name}.count", 0) + 1
+            for name, value in trace.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            if self.export_dir:
+                self._unexported.append(trace.to_dict())
+                self._start_flusher()
+
+    def snapshot(self) -> dict:
+        return {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "histograms": {k: h.to_dict() for k, h in sorted(self.histograms.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def flush(self):
+        """Write the traces recorded since the last flush and the current metrics.json."""
+        with self._flush_lock:
+            with self._lock:
+                traces, self._unexported = self._unexported, []
+                if not traces or not self.export_dir:
+                    return
+                export_dir, snapshot = self.export_dir, self.snapshot()
+            self._export(export_dir, traces, snapshot)
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning("Could not export metrics to %s: %s", self.export_dir, e)
+
+    def _export(self, export_dir: str, traces: List[dict], snapshot: dict):
+        os.makedirs(export_dir, exist_ok=True)
+        log_path = os.path.join(export_dir, "traces.jsonl")
+        if os.path.exists(log_path) and os.path.getsize(log_path) > self.max_log_bytes:
+            os.replace(log_path, log_path + ".1")
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(t, ensure_ascii=False, default=str) + "\n" for t in traces)
+
+        metrics_path = os.path.join(export_dir, "metrics.json")
+        tmp_path = metrics_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, metrics_path)
+
+
+metrics = MetricsRegistry()
+
+
+def configure(enabled: bool = True, export_dir: str = None, max_log_mb: float = 50, flush_interval: float = 5.0):
+    """Enable/disable tracing and set where metrics are exported (None keeps them in memory)."""
+    metrics.configure(enabled, export_dir, max_log_mb, flush_interval)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Optional[Trace]]:
+    """
+    Trace the enclosed block. Nested calls join the enclosing trace, so
+    library entry points can open a trace that an outer caller may widen.
+    Yields None when tracing is disabled.
+    """
+    active = _current_trace.get()
+    if active is not None:
+        active.set(**attrs)
+        yield active
+        return
+    if not metrics.enabled:
+        yield None
+        return
+
+    t = Trace(name, **attrs)
+    token = _current_trace.set(t)
+    stack_token = _span_stack.set(())
+    try:
+        yield t
+    except BaseException as e:
+        t.set(error=type(e).__name__)
+        raise
+    finally:
+        t.duration = time.perf_counter() - t.t0
+        _span_stack.reset(stack_token)
+        _current_trace.reset(token)
+        metrics.record(t)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the enclosed block as a stage of the current trace (no-op outside one)."""
+    t = _current_trace.get()
+    if t is None:
+        yield _NOOP
+        return
+    stack = _span_stack.get()
+    s = t.open_span(name, depth=len(stack), **attrs)
+    token = _span_stack.set(stack + (name,))
+    try:
+        yield s
+    finally:
+        s.duration = time.perf_counter() - s.start
+        _span_stack.reset(token)
+
+
+def count(name: str, value: float = 1):
+    """Add to a counter of the current trace (no-op outside one)."""
+    t = _current_trace.get()
+    if t is not None:
+        t.incr(name, value)
+
+
+def gauge(name: str, value: float):
+    """Set a counter of the current trace to a value, replacing earlier ones (no-op outside one)."""
+    t = _current_trace.get()
+    if t is not None:
+        with t._lock:
+            t.counters[name] = value
+
+
+def annotate(**attrs):
+    """Set attributes on the current trace (no-op outside one)."""
+    t = _current_trace.get()
+    if t is not None:
+        t.set(**attrs)
+
+
+def count_tokens(text: str) -> int:
+    from llama_index.core.utils import get_tokenizer
+    return len(get_tokenizer()(text))
+
+
+def traced_stream(gen, name: str = "stream"):
+    """
+    Wrap a token generator so consuming it is timed as a span, with
+    time-to-first-token and an estimated completion token count. This is
+    the only place completion tokens of a streamed generation are counted;
+    the event handler leaves them out for streamed LLM calls.
+    """
+    t = _current_trace.get()
+    if t is None:
+        yield from gen
+        return
+    s = t.open_span(name, depth=len(_span_stack.get()))
+    chunks = []
+    try:
+        for chunk in gen:
+            if not chunks:
+                s.set(ttft_ms=round((time.perf_counter() - s.start) * 1000, 3))
+            chunks.append(str(chunk))
+            yield chunk
+    finally:
+        s.duration = time.perf_counter() - s.start
+        completion_tokens = count_tokens("".join(chunks))
+        s.set(chunks=len(chunks), completion_tokens=completion_tokens)
+        t.incr("tokens.completion", completion_tokens)
+
+
+# --- LlamaIndex instrumentation -------------------------------------------------
+
+_handler_installed = False
+_handler_lock = threading.Lock()
+
+
+def _usage(response) -> dict:
+    """Prompt/completion token counts reported by the provider, if any."""
+    raw = getattr(response, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is not None and not isinstance(usage, dict):
+        usage = {k: getattr(usage, k, None) for k in ("prompt_tokens", "completion_tokens")}
+    usage = usage or getattr(response, "additional_kwargs", None) or {}
+    return {k: usage[k] for k in ("prompt_tokens", "completion_tokens") if usage.get(k) is not None}
+
+
+def _response_text(response) -> str:
+    message = getattr(response, "message", None)
+    return str(getattr(response, "text", None) or getattr(message, "content", None) or "")
+
+
+def _install_event_handler():
+    """Register (once) a handler that turns LLM and rerank events into spans."""
+    global _handler_installed
+    with _handler_lock:
+        if _handler_installed:
+            return
+        from llama_index.core.instrumentation import get_dispatcher
+        from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+        from llama_index.core.instrumentation.events.llm import (
+            LLMChatStartEvent, LLMChatInProgressEvent, LLMChatEndEvent,
+            LLMCompletionStartEvent, LLMCompletionInProgressEvent, LLMCompletionEndEvent,
+        )
+        from llama_index.core.instrumentation.events.rerank import ReRankStartEvent, ReRankEndEvent
+
+        starts = (LLMChatStartEvent, LLMCompletionStartEvent, ReRankStartEvent)
+        ends = (LLMChatEndEvent, LLMCompletionEndEvent, ReRankEndEvent)
+        # Only streamed calls report progress
+        deltas = (LLMChatInProgressEvent, LLMCompletionInProgressEvent)
+        pending: Dict[str, tuple] = {}
+        pending_lock = threading.Lock()
+
+        def key(event):
+            return event.span_id or f"thread-{threading.get_ident()}", "rerank" if isinstance(
+                event, (ReRankStartEvent, ReRankEndEvent)) else "llm"
+
+        def span_name(t: Trace, kind: str) -> str:
+            stack = _span_stack.get()
+            if kind == "rerank":
+                return "rerank"
+            if stack and (stack[-1].startswith("eval.") or stack[-1] == "memory"):
+                return f"{stack[-1]}.llm"
+            # CondensePlusContext condenses the question before retrieving; generation comes after
+            return "llm.generate" if t.has_span("retrieve") else "llm.condense"
+
+        class TraceEventHandler(BaseEventHandler):
+            @classmethod
+            def class_name(cls) -> str:
+                return "TraceEventHandler"
+
+            def handle(self, event, **kwargs):
+                if isinstance(event, starts):
+                    t = _current_trace.get()
+                    if t is None:
+                        return
+                    k = key(event)
+                    attrs = {}
+                    if isinstance(event, ReRankStartEvent):
+                        attrs = {"nodes_in": len(event.nodes or []), "top_n": event.top_n}
+                    s = t.open_span(span_name(t, k[1]), depth=len(_span_stack.get()), **attrs)
+                    with pending_lock:
+                        # Ends that never arrive in a matching context (e.g. streams finished
+                        # on another thread) must not accumulate
+                        if len(pending) >= 256:
+                            pending.pop(next(iter(pending)))
+                        pending[k] = (t, s, event, False)
+                elif isinstance(event, deltas):
+                    k = key(event)
+                    with pending_lock:
+                        entry = pending.get(k)
+                        if entry is not None and not entry[3]:
+                            pending[k] = entry[:3] + (True,)
+                elif isinstance(event, ends):
+                    with pending_lock:
+                        entry = pending.pop(key(event), None)
+                    if entry is None:
+                        return
+                    t, s, start_event, streamed = entry
+                    s.duration = time.perf_counter() - s.start
+                    if isinstance(event, ReRankEndEvent):
+                        s.set(nodes_out=len(event.nodes or []))
+                        return
+                    usage = _usage(event.response)
+                    if not usage:
+                        prompt = getattr(start_event, "messages", None) or [getattr(start_event, "prompt", "")]
+                        usage = {
+                            "prompt_tokens": count_tokens("\n".join(str(getattr(m, "content", m)) for m in prompt)),
+                            "completion_tokens": count_tokens(_response_text(event.response)),
+                            "estimated": True,
+                        }
+                    s.set(**usage)
+                    t.incr("tokens.prompt", usage.get("prompt_tokens", 0))
+                    if streamed:
+                        # traced_stream counts the tokens the caller consumed
+                        s.set(streamed=True)
+                    else:
+                        t.incr("tokens.completion", usage.get("completion_tokens", 0))
+
+        get_dispatcher().add_event_handler(TraceEventHandler())
+        _handler_installed = True
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        path = argv[0]
+    else:
+        from .config import TRACE_DIR
+        path = os.path.join(TRACE_DIR, "metrics.json")
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    print(f"{'stage':<32}{'count':>8}{'p50 ms':>12}{'p90 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    for name, h in data["histograms"].items():
+        print(f"{name:<32}{h['count']:>8}{h['p50_ms']:>12.1f}{h['p90_ms']:>12.1f}{h['p99_ms']:>12.1f}{h['max_ms']:>12.1f}")
+    for name, value in data["counters"].items():
+        print(f"{name}: {value:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+VECTORS_FILE = "vectors.f32"
+IDS_FILE = "vector_ids.tsv"
+LEGACY_VECTOR_STORE_FILE = "default__vector_store.json"
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """
+    Binary vector store backed by a memory-mapped float32 matrix.
+
+    Embeddings are L2-normalized and stored row-major in `vectors.f32`;
+    `vector_ids.tsv` maps each row to its node id and ref doc id. Node text
+    and metadata stay in the docstore. Nothing is read until the first
+    query, and only the pages that a query touches become resident.
+    """
+
+    stores_text: bool = False
+    persist_dir: Optional[str] = None
+
+    _lock: Any = PrivateAttr()
+    _loaded: bool = PrivateAttr(default=False)
+    _dim: Optional[int] = PrivateAttr(default=None)
+    _base: Any = PrivateAttr(default=None)
+    _base_rows: int = PrivateAttr(default=0)
+    _pending: List[np.ndarray] = PrivateAttr(default_factory=list)
+    _extra: Any = PrivateAttr(default=None)
+    _node_ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _alive: Any = PrivateAttr(default=None)
+    _id_to_row: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _ref_rows: Optional[Dict[str, List[int]]] = PrivateAttr(default=None)
+    _deleted: bool = PrivateAttr(default=False)
+    _version: int = PrivateAttr(default=0)
+    _generation: str = PrivateAttr(default="")
+
+    def __init__(self, persist_dir: Optional[str] = None, **kwargs: Any):
+        super().__init__(persist_dir=persist_dir, **kwargs)
+        self._lock = threading.RLock()
+        self._generation = uuid.uuid4().hex
+        self._alive = np.zeros(0, dtype=bool)
+        self._loaded = persist_dir is None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, IDS_FILE))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "MmapVectorStore":
+        """
+        Open a persisted store lazily. A legacy JSON SimpleVectorStore found
+        in the same directory is converted once to the binary format.
+        """
+        legacy_path = os.path.join(persist_dir, LEGACY_VECTOR_STORE_FILE)
+        if not cls.exists(persist_dir) and os.path.exists(legacy_path):
+            cls._migrate_legacy(persist_dir, legacy_path)
+        return cls(persist_dir=persist_dir)
+
+    @classmethod
+    def _migrate_legacy(cls, persist_dir: str, legacy_path: str):
+        from llama_index.core.vector_stores import SimpleVectorStore
+
+        legacy = SimpleVectorStore.from_persist_path(legacy_path)
+        data = legacy.data
+        store = cls()
+        node_ids = list(data.embedding_dict.keys())
+        if node_ids:
+            store._append(
+                np.asarray([data.embedding_dict[n] for n in node_ids], dtype=np.float32),
+                node_ids,
+                [data.text_id_to_ref_doc_id.get(n) or "" for n in node_ids],
+            )
+        store.persist(os.path.join(persist_dir, LEGACY_VECTOR_STORE_FILE))
+        os.remove(legacy_path)
+
+    # ---- loading -----------------------------------------------------------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            node_ids, ref_doc_ids, dim = [], [], None
+            ids_path = os.path.join(self.persist_dir, IDS_FILE)
+            if os.path.exists(ids_path):
+                with open(ids_path, "r", encoding="utf-8") as f:
+                    header = f.readline().split()
+                    dim = int(header[1]) if len(header) > 1 and header[1] != "0" else None
+                    for line in f:
+                        node_id, _, ref_doc_id = line.rstrip("\n").partition("\t")
+                        node_ids.append(node_id)
+                        ref_doc_ids.append(ref_doc_id)
+
+            self._dim = dim
+            self._base_rows = len(node_ids)
+            if self._base_rows and dim:
+                self._base = np.memmap(
+                    os.path.join(self.persist_dir, VECTORS_FILE),
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(self._base_rows, dim),
+                )
+            self._node_ids = node_ids
+            self._ref_doc_ids = ref_doc_ids
+            self._alive = np.ones(len(node_ids), dtype=bool)
+            self._id_to_row = {n: i for i, n in enumerate(node_ids)}
+            self._ref_rows = None
+            self._loaded = True
+
+    # ---- mutation ----------------------------------------------------------
+
+    def _append(self, vectors: np.ndarray, node_ids: List[str], ref_doc_ids: List[str]):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        start = len(self._node_ids)
+        self._pending.append(vectors.astype(np.float32, copy=False))
+        self._extra = None
+        self._node_ids.extend(node_ids)
+        self._ref_doc_ids.extend(ref_doc_ids)
+        self._alive = np.concatenate([self._alive, np.ones(len(node_ids), dtype=bool)])
+        for offset, node_id in enumerate(node_ids):
+            previous = self._id_to_row.get(node_id)
+            if previous is not None:
+                self._alive[previous] = False
+                self._deleted = True
+            self._id_to_row[node_id] = start + offset
+            if self._ref_rows is not None:
+                self._ref_rows.setdefault(ref_doc_ids[offset], []).append(start + offset)
+        self._version += 1
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """Append node embeddings to the store."""
+        if not nodes:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            self._append(
+                np.asarray([n.get_embedding() for n in nodes], dtype=np.float32),
+                [n.node_id for n in nodes],
+                [n.ref_doc_id or "" for n in nodes],
+            )
+        return [n.node_id for n in nodes]
+
+    def _kill_rows(self, rows: List[int]):
+        if rows:
+            self._alive[rows] = False
+            for row in rows:
+                self._id_to_row.pop(self._node_ids[row], None)
+            self._deleted = True
+            self._version += 1
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Drop all rows belonging to a source document."""
+        self._ensure_loaded()
+        with self._lock:
+            if self._ref_rows is None:
+                self._ref_rows = {}
+                for row, ref in enumerate(self._ref_doc_ids):
+                    self._ref_rows.setdefault(ref, []).append(row)
+            rows = self._ref_rows.pop(ref_doc_id, [])
+            self._kill_rows([r for r in rows if self._alive[r]])
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Any = None, **delete_kwargs: Any) -> None:
+        """Drop rows by node id."""
+        self._ensure_loaded()
+        with self._lock:
+            self._kill_rows([self._id_to_row[n] for n in node_ids or [] if n in self._id_to_row])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._loaded = True
+            self._base, self._base_rows, self._pending, self._extra = None, 0, [], None
+            self._node_ids, self._ref_doc_ids, self._id_to_row, self._ref_rows = [], [], {}, None
+            self._alive = np.zeros(0, dtype=bool)
+            self._deleted = True
+            self._version += 1
+
+    # ---- reading -----------------------------------------------------------
+
+    @property
+    def version(self) -> int:
+        """Incremented on every mutation; lets derived structures detect staleness."""
+        return self._version
+
+    @property
+    def generation(self) -> str:
+        """Unique per store instance; together with `version` identifies its contents."""
+        return self._generation
+
+    @property
+    def node_ids(self) -> List[str]:
+        self._ensure_loaded()
+        return self._node_ids
+
+    @property
+    def alive(self) -> np.ndarray:
+        self._ensure_loaded()
+        return self._alive
+
+    def row_of(self, node_id: str) -> Optional[int]:
+        self._ensure_loaded()
+        return self._id_to_row.get(node_id)
+
+    def _extra_rows(self) -> Optional[np.ndarray]:
+        if self._pending and (self._extra is None or len(self._extra) != sum(len(p) for p in self._pending)):
+            self._extra = np.vstack(self._pending)
+            self._pending = [self._extra]
+        return self._extra
+
+    def rows(self, rows: np.ndarray) -> np.ndarray:
+        """Gather specific rows (only their pages are read from disk)."""
+        self._ensure_loaded()
+        rows = np.asarray(rows, dtype=np.int64)
+        in_base = rows < self._base_rows
+        out = np.empty((len(rows), self._dim or 0), dtype=np.float32)
+        if in_base.any():
+            out[in_base] = self._base[rows[in_base]]
+        if (~in_base).any():
+            out[~in_base] = self._extra_rows()[rows[~in_base] - self._base_rows]
+        return out
+
+    def similarities(self, query_embedding: List[float], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cosine similarity of the query against all rows (or a subset) as a
+        single matrix-vector product. Deleted rows score -inf.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            n = len(self._node_ids)
+            if not n or self._dim is None:
+                return np.zeros(0 if rows is None else len(rows), dtype=np.float32)
+            q = np.asarray(query_embedding, dtype=np.float32)
+            q = q / (np.linalg.norm(q) or 1.0)
+            if rows is not None:
+                rows = np.asarray(rows, dtype=np.int64)
+                scores = self.rows(rows) @ q
+                scores[~self._alive[rows]] = -np.inf
+                return scores
+            parts = []
+            if self._base is not None:
+                parts.append(np.asarray(self._base @ q))
+            extra = self._extra_rows()
+            if extra is not None:
+                parts.append(extra @ q)
+            scores = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            scores = scores.astype(np.float32, copy=True)
+            scores[~self._alive] = -np.inf
+            return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Exact top-k cosine search, optionally restricted to `query.node_ids`."""
+        if query.filters is not None:
+            raise NotImplementedError("MmapVectorStore does not support metadata filters.")
+        self._ensure_loaded()
+        with self._lock:
+            rows = None
+            if query.node_ids is not None:
+                rows = np.asarray(
+                    [self._id_to_row[n] for n in query.node_ids if n in self._id_to_row],
+                    dtype=np.int64,
+                )
+            scores = self.similarities(query.query_embedding, rows)
+            k = min(query.similarity_top_k, int(np.isfinite(scores).sum()))
+            if k <= 0:
+                return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            hit_rows = top if rows is None else rows[top]
+            return VectorStoreQueryResult(
+                nodes=None,
+                similarities=scores[top].tolist(),
+                ids=[self._node_ids[r] for r in hit_rows],
+            )
+
+    # ---- persistence -------------------------------------------------------
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """
+        Write the matrix and id table into the directory of `persist_path`.
+        Appends in place when only new rows were added to the same directory,
+        otherwise compacts deleted rows into a fresh file. A file hard-linked
+        into other index versions is always written fresh, so those versions
+        never change.
+        """
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+        self._ensure_loaded()
+        with self._lock:
+            vectors_path = os.path.join(persist_dir, VECTORS_FILE)
+            same_dir = self.persist_dir is not None and os.path.abspath(self.persist_dir) == os.path.abspath(persist_dir)
+            extra = self._extra_rows()
+
+            if same_dir and not self._deleted and os.path.exists(vectors_path) and os.stat(vectors_path).st_nlink == 1:
+                if extra is not None:
+                    with open(vectors_path, "r+b") as f:
+                        # Rows written by an append whose id table never landed are not ours;
+                        # cut them off so new rows start right after the ones the ids describe
+                        f.truncate(self._base_rows * (self._dim or 0) * 4)
+                        f.seek(0, os.SEEK_END)
+                        f.write(np.ascontiguousarray(extra, dtype=np.float32).tobytes())
+                keep = np.arange(len(self._node_ids))
+            else:
+                keep = np.flatnonzero(self._alive)
+                tmp_path = vectors_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    for start in range(0, len(keep), 65536):
+                        f.write(self.rows(keep[start:start + 65536]).tobytes())
+                self._base = None
+                os.replace(tmp_path, vectors_path)
+
+            node_ids = [self._node_ids[r] for r in keep]
+            ref_doc_ids = [self._ref_doc_ids[r] for r in keep]
+            ids_path = os.path.join(persist_dir, IDS_FILE)
+            with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(f"mmap-vectors {self._dim or 0}\n")
+                f.writelines(f"{n}\t{r}\n" for n, r in zip(node_ids, ref_doc_ids))
+            os.replace(ids_path + ".tmp", ids_path)
+
+            # Re-open from disk so the persisted rows are served by the memory map
+            self.persist_dir = persist_dir
+            self._loaded = False
+            self._base, self._base_rows, self._pending, self._extra = None, 0, [], None
+            self._deleted = False
+            self._version += 1
+            self._ensure_loaded()
@@ -0,0 +1,62 @@
+import pytest
+from llama_index.core import Document, Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from src import query_engine as query_engine_module
+from src.answer_cache import SemanticAnswerCache
+from src.hybrid_retriever import HybridRetriever
+from src.indexer import DocumentIndexer
+from src.metadata_index import QueryFilter
+from src.query_engine import RAGQueryEngine
+from src.sessions import SessionRegistry
+
+
+class CountingEmbedding(MockEmbedding):
+    query_calls: int = 0
+
+    def _get_query_embedding(self, query: str):
+        self.query_calls += 1
+        return super()._get_query_embedding(query)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    embed_model = CountingEmbedding(embed_dim=8)
+    monkeypatch.setattr(Settings, "_llm", MockLLM(max_tokens=8))
+    monkeypatch.setattr(Settings, "_embed_model", embed_model)
+    monkeypatch.setattr(query_engine_module, "reranker_choice", lambda: "none")
+    index = DocumentIndexer.add_to_index(DocumentIndexer.empty_index(), [
+        Document(text="Shards are rebuilt one at a time.", metadata={"file_name": "shards.md"}),
+        Document(text="The build lock serializes index builds.", metadata={"file_name": "lock.txt"}),
+    ])
+    engine = RAGQueryEngine(index, answer_cache=SemanticAnswerCache(), sessions=SessionRegistry())
+
+    scored = []
+    candidates = HybridRetriever.candidates
+    monkeypatch.setattr(
+        HybridRetriever, "candidates", lambda self, *args, **kwargs: scored.append(1) or candidates(self, *args, **kwargs)
+    )
+    embed_model.query_calls = 0
+    return engine, embed_model, scored
+
+
+@pytest.mark.parametrize("filters", [None, QueryFilter(extensions=[".md"])])
+def test_miss_reuses_the_lookup_retrieval(engine, filters):
+    engine, embed_model, scored = engine
+
+    cached, ticket = engine.lookup_answer("how are shards rebuilt?", filters=filters)
+    response = engine.query_with_precision("how are shards rebuilt?", filters=filters, ticket=ticket)
+
+    assert cached is None
+    assert embed_model.query_calls == 1
+    assert len(scored) == 1
+    assert [n.node.node_id for n in response.source_nodes] == ticket.node_ids
+
+
+def test_ticket_is_not_reused_under_another_filter(engine):
+    engine, embed_model, scored = engine
+
+    _, ticket = engine.lookup_answer("how are shards rebuilt?")
+    engine.query_with_precision("how are shards rebuilt?", filters=QueryFilter(extensions=[".txt"]), ticket=ticket)
+
+    assert len(scored) == 2
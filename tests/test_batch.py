@@ -0,0 +1,60 @@
+import json
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from src import batch
+from src.indexer import DocumentIndexer
+from src.query_engine import RAGQueryEngine
+from src.storage import IndexStorage
+
+
+@pytest.fixture
+def mock_models(monkeypatch):
+    monkeypatch.setattr(Settings, "_llm", MockLLM())
+    monkeypatch.setattr(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path, mock_models):
+    def init_settings(llm=None, embed_model=None):
+        monkeypatch.setattr(Settings, "_llm", llm)
+        monkeypatch.setattr(Settings, "_embed_model", embed_model)
+        return True
+
+    index = DocumentIndexer.empty_index()
+    monkeypatch.setattr(batch, "init_settings", init_settings)
+    monkeypatch.setattr(IndexStorage, "load_index", staticmethod(lambda *args, **kwargs: index))
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text('{"id": 1, "query": "what is a shard"}\n{"id": 2, "query": "what is a lock"}\n')
+    return queries, tmp_path / "answers.jsonl"
+
+
+def _run(queries, output, *extra) -> list:
+    assert batch.main([str(queries), "-o", str(output), "--mock-llm", "--mock-embed", *extra]) == 0
+    return [json.loads(line) for line in output.read_text().splitlines()]
+
+
+def test_rerun_replaces_previous_results(offline):
+    queries, output = offline
+    _run(queries, output)
+
+    records = _run(queries, output)
+
+    assert sorted(r["id"] for r in records) == [1, 2]
+
+
+def test_append_keeps_previous_results(offline):
+    queries, output = offline
+    _run(queries, output)
+
+    records = _run(queries, output, "--append")
+
+    assert sorted(r["id"] for r in records) == [1, 1, 2, 2]
+
+
+def test_engine_without_answer_cache(mock_models):
+    index = DocumentIndexer.empty_index()
+
+    assert RAGQueryEngine(index, use_answer_cache=False).answer_cache is None
+    assert RAGQueryEngine(index).answer_cache is not None
@@ -0,0 +1,111 @@
+import random
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from src import loader as loader_module
+from src.dedup import ChunkDeduplicator
+from src.indexer import DocumentIndexer
+from src.metadata_index import MetadataIndex, QueryFilter
+from src.pipeline import IngestPipeline
+
+SHARED = "The build lock is held from copying the base version until the new version is published."
+
+
+def _node(node_id: str, file_name: str, text: str) -> TextNode:
+    return TextNode(
+        id_=node_id, text=text, metadata={"file_name": file_name},
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=file_name)},
+    )
+
+
+def _ingest(nodes):
+    dedup = ChunkDeduplicator(enabled=True)
+    metadata = MetadataIndex()
+    docstore = SimpleDocumentStore()
+    kept = dedup.filter(nodes)
+    docstore.add_documents(kept)
+    metadata.add(kept)
+    dedup.apply_references(docstore, metadata)
+    return kept, docstore, metadata
+
+
+def _files(metadata: MetadataIndex, *files) -> list:
+    return sorted(metadata.node_ids[r] for r in metadata.match(QueryFilter(files=list(files))))
+
+
+def test_revised_chunks_are_indexed_by_default():
+    original = " ".join(f"clause{i}" for i in range(80))
+    revised = original.replace("clause79", "amended")
+    kept, _, _ = _ingest([_node("a", "a.md", original), _node("b", "b.md", revised)])
+
+    assert [n.node_id for n in kept] == ["a", "b"]
+
+
+def test_file_filter_finds_deduplicated_chunk(tmp_path):
+    kept, docstore, metadata = _ingest([
+        _node("a", "a.md", SHARED),
+        _node("b", "b.txt", " ".join(SHARED.split())),
+        _node("c", "c.md", "Something else entirely."),
+    ])
+
+    assert [n.node_id for n in kept] == ["a", "c"]
+    assert docstore.get_node("a").metadata["also_in"] == ["b.txt"]
+    assert _files(metadata, "b.txt") == ["a"]
+    assert sorted(metadata.node_ids[r] for r in metadata.match(QueryFilter(extensions=[".txt"]))) == ["a"]
+    assert "b.txt" in metadata.values("file_name")
+
+    metadata.persist(str(tmp_path))
+    reloaded = MetadataIndex(persist_dir=str(tmp_path))
+    assert _files(reloaded, "b.txt") == ["a"]
+    assert _files(reloaded, "a.md", "c.md") == ["a", "c"]
+
+    reloaded.set_sources("a", [])
+    assert _files(reloaded, "b.txt") == []
+    assert "b.txt" not in reloaded.values("file_name")
+
+
+@pytest.fixture
+def pipeline_settings(monkeypatch):
+    # Same splitter as init_settings; files are parsed in-process
+    monkeypatch.setattr(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+    monkeypatch.setattr(Settings, "_node_parser", SentenceSplitter(chunk_size=512, chunk_overlap=50))
+    monkeypatch.setattr(Settings, "_transformations", None)
+    monkeypatch.setattr(loader_module, "LOADER_WORKERS", 1)
+
+
+def _document(paragraphs: int = 40) -> str:
+    rng = random.Random(1)
+    words = "index shard vector query token budget cache latency memory disk batch stream merge rank".split()
+    sentence = lambda: " ".join(rng.choice(words) for _ in range(12)).capitalize() + "."
+    return "\n\n".join(" ".join(sentence() for _ in range(6)) for _ in range(paragraphs))
+
+
+def test_pipeline_deduplicates_copies_at_other_paths(tmp_path, pipeline_settings):
+    text = _document()
+    (tmp_path / "sub").mkdir()
+    original, copy = tmp_path / "doc1.txt", tmp_path / "sub" / "copy_of_doc1.txt"
+    original.write_text(text)
+    copy.write_text(text)
+
+    stats = IngestPipeline(DocumentIndexer.empty_index()).run([str(original), str(copy)])
+
+    assert stats["chunks"] > 2
+    assert stats["duplicates"] == stats["chunks"] // 2
+    assert stats["nodes"] == stats["chunks"] - stats["duplicates"]
+
+
+def test_pipeline_indexes_only_revised_chunks(tmp_path, pipeline_settings):
+    text = _document()
+    revised = text.replace(text[-40:], "an amended closing sentence of the document.")
+    (tmp_path / "v1.txt").write_text(text)
+    (tmp_path / "v2-final-revision.txt").write_text(revised)
+
+    index = DocumentIndexer.empty_index()
+    stats = IngestPipeline(index).run([str(tmp_path / "v1.txt"), str(tmp_path / "v2-final-revision.txt")])
+
+    per_file = stats["chunks"] // 2
+    assert stats["duplicates"] == per_file - 1
+    assert any("amended closing sentence" in n.get_content() for n in index.docstore.docs.values())
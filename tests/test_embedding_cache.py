@@ -0,0 +1,79 @@
+import logging
+import multiprocessing
+import numpy as np
+from src.embedding_cache import EmbeddingCacheStore
+
+DIM = 8
+
+
+def _vector(key: bytes) -> list:
+    return np.frombuffer(key[:DIM], dtype=np.uint8).astype(np.float32).tolist()
+
+
+def _keys(prefix: str, n: int) -> list:
+    return [EmbeddingCacheStore.make_key("text", f"{prefix} {i}") for i in range(n)]
+
+
+def _put(cache_dir: str, prefix: str, n: int):
+    """Process entry point: append n vectors one call at a time."""
+    store = EmbeddingCacheStore(cache_dir, max_bytes=1 << 30)
+    for key in _keys(prefix, n):
+        store.put_many([key], [_vector(key)])
+
+
+def test_writers_sharing_a_directory_keep_keys_and_vectors_paired(tmp_path):
+    first = EmbeddingCacheStore(str(tmp_path), max_bytes=1 << 30)
+    second = EmbeddingCacheStore(str(tmp_path), max_bytes=1 << 30)
+    a, b = _keys("a", 5), _keys("b", 7)
+
+    # Each store appends without having seen the other's rows
+    first.put_many(a, [_vector(k) for k in a])
+    second.put_many(b, [_vector(k) for k in b])
+    first.put_many(b[:2], [[0.0] * DIM] * 2)
+
+    for store in (first, second, EmbeddingCacheStore(str(tmp_path), max_bytes=1 << 30)):
+        assert store.get_many(a + b) == [_vector(k) for k in a + b]
+    assert first.stats()["entries"] == 12
+
+
+def test_eviction_by_one_store_is_seen_by_another(tmp_path):
+    row_bytes = DIM * 4 + 16
+    evicting = EmbeddingCacheStore(str(tmp_path), max_bytes=10 * row_bytes)
+    reader = EmbeddingCacheStore(str(tmp_path), max_bytes=1 << 30)
+    old, recent = _keys("old", 6), _keys("recent", 6)
+    evicting.put_many(old, [_vector(k) for k in old])
+    assert reader.get_many(old[:1]) == [_vector(old[0])]
+
+    evicting.put_many(recent, [_vector(k) for k in recent])
+
+    assert evicting.stats()["evictions"] > 0
+    cached = reader.get_many(old + recent)
+    assert cached[-len(recent):] == [_vector(k) for k in recent]
+    assert all(v is None or v == _vector(k) for k, v in zip(old, cached))
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith("vectors")) == ["vectors.1.f32"]
+
+
+def test_dimension_mismatch_is_logged_not_cached(tmp_path, caplog):
+    store = EmbeddingCacheStore(str(tmp_path), max_bytes=1 << 30)
+    a, b = _keys("a", 1), _keys("b", 1)
+    store.put_many(a, [_vector(a[0])])
+
+    with caplog.at_level(logging.WARNING):
+        store.put_many(b, [[1.0] * (DIM + 1)])
+
+    assert "dimension" in caplog.text
+    assert store.get_many(b) == [None]
+
+
+def test_concurrent_processes_append_to_one_cache(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=_put, args=(str(tmp_path), f"p{i}", 150)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    keys = [k for i in range(3) for k in _keys(f"p{i}", 150)]
+    store = EmbeddingCacheStore(str(tmp_path), max_bytes=1 << 30)
+    assert store.get_many(keys) == [_vector(k) for k in keys]
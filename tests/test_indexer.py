@@ -0,0 +1,82 @@
+import os
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+from src import indexer as indexer_module
+from src import loader as loader_module
+from src.indexer import DocumentIndexer
+from src.storage import IndexStorage
+
+
+def _names(paths) -> list:
+    return sorted(os.path.basename(p) for p in paths)
+
+
+@pytest.fixture
+def sync(tmp_path, monkeypatch):
+    monkeypatch.setattr(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+    monkeypatch.setattr(Settings, "_node_parser", SentenceSplitter(chunk_size=512, chunk_overlap=50))
+    monkeypatch.setattr(Settings, "_transformations", None)
+    monkeypatch.setattr(loader_module, "LOADER_WORKERS", 1)
+    data, storage = tmp_path / "data", str(tmp_path / "storage")
+    data.mkdir()
+
+    ingested = []
+    run = indexer_module.IngestPipeline.run
+    monkeypatch.setattr(
+        indexer_module.IngestPipeline, "run",
+        lambda self, file_paths, **kwargs: ingested.extend(file_paths) or run(self, file_paths, **kwargs)
+    )
+
+    def sync_files(*names):
+        """Sync the persisted index with the named data files and persist the result."""
+        ingested.clear()
+        index = IndexStorage.load_index(storage, sharded=False)
+        index, manifest, diff = DocumentIndexer.sync_index(
+            index, persist_dir=storage, file_paths=[str(data / n) for n in names]
+        )
+        IndexStorage.persist_index(index, manifest, persist_dir=storage)
+        texts = sorted(n.get_content() for n in IndexStorage.load_index(storage, sharded=False).docstore.docs.values())
+        return diff, _names(ingested), texts
+
+    return data, sync_files
+
+
+def test_sync_only_ingests_added_and_changed_files(sync):
+    data, sync_files = sync
+    for name in ("a", "b", "c"):
+        (data / f"{name}.txt").write_text(f"Original notes about {name}.")
+    diff, ingested, _ = sync_files("a.txt", "b.txt", "c.txt")
+    assert ingested == ["a.txt", "b.txt", "c.txt"]
+
+    (data / "b.txt").write_text("Revised notes about b.")
+    (data / "c.txt").unlink()
+    (data / "d.txt").write_text("Original notes about d.")
+    diff, ingested, texts = sync_files("a.txt", "b.txt", "d.txt")
+
+    assert _names(diff.added) == ["d.txt"]
+    assert _names(diff.changed) == ["b.txt"]
+    assert _names(diff.removed) == ["c.txt"]
+    assert _names(diff.unchanged) == ["a.txt"]
+    assert ingested == ["b.txt", "d.txt"]
+    assert texts == ["Original notes about a.", "Original notes about d.", "Revised notes about b."]
+
+    diff, ingested, _ = sync_files("a.txt", "b.txt", "d.txt")
+    assert not diff.has_changes
+    assert ingested == []
+
+
+def test_sync_reingests_files_orphaned_by_a_removed_duplicate(sync):
+    data, sync_files = sync
+    (data / "a.txt").write_text("Shared notes about shards.")
+    (data / "b.txt").write_text("Shared notes about shards.")
+    diff, _, texts = sync_files("a.txt", "b.txt")
+    assert diff.duplicates == 1
+    assert texts == ["Shared notes about shards."]
+
+    (data / "a.txt").unlink()
+    diff, ingested, texts = sync_files("b.txt")
+
+    assert ingested == ["b.txt"]
+    assert texts == ["Shared notes about shards."]
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from src import reranker as reranker_module
+from src.reranker import CrossEncoderRerank, ScoreCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self) -> float:
+        return self.now
+
+
+class SlowModel:
+    """Cross-encoder stand-in advancing a fake clock a fixed time per pair; scores by text length."""
+
+    def __init__(self, clock: FakeClock, seconds_per_pair: float):
+        self.clock = clock
+        self.seconds_per_pair = seconds_per_pair
+        self.batches = []
+
+    @property
+    def scored(self) -> int:
+        return sum(self.batches)
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        self.clock.now += self.seconds_per_pair * len(pairs)
+        self.batches.append(len(pairs))
+        return [float(len(text)) for _, text in pairs]
+
+
+def _nodes(n: int):
+    return [NodeWithScore(node=TextNode(id_=f"n{i}", text="x" * (i + 1)), score=1.0 - i / n) for i in range(n)]
+
+
+def _reranker(monkeypatch, model, **kwargs):
+    monkeypatch.setattr(reranker_module, "load_cross_encoder", lambda *args: model)
+    monkeypatch.setattr(reranker_module, "time", SimpleNamespace(perf_counter=model.clock.perf_counter))
+    return CrossEncoderRerank(cache=ScoreCache(), top_n=20, max_candidates=20, batch_size=32, **kwargs)
+
+
+def test_time_budget_cuts_off_a_single_batch_workload(monkeypatch):
+    # 20 candidates fit one batch of 32; unbounded they would take 400 ms
+    clock = FakeClock()
+    model = SlowModel(clock, 0.02)
+    rerank = _reranker(monkeypatch, model, time_budget_ms=100)
+
+    result = rerank.postprocess_nodes(_nodes(20), QueryBundle("query"))
+
+    # A probe batch of batch_size // 8 measures the cost, then only what fits the remaining 20 ms
+    assert model.batches == [4, 1]
+    assert clock.now <= 0.1
+    assert len(result) == 20
+    # Scored candidates come first, the rest keep their retrieval order
+    assert [n.node.node_id for n in result[model.scored:]] == [f"n{i}" for i in range(model.scored, 20)]
+
+
+def test_time_budget_uses_cost_estimate_before_first_batch(monkeypatch):
+    model = SlowModel(FakeClock(), 0.02)
+    rerank = _reranker(monkeypatch, model, time_budget_ms=100)
+    rerank._seconds_per_pair = 0.02
+
+    rerank.postprocess_nodes(_nodes(20), QueryBundle("query"))
+
+    # No probe: the estimate sizes the first batch to the whole budget
+    assert model.batches == [5]
+
+
+def test_without_budget_all_candidates_are_scored(monkeypatch):
+    model = SlowModel(FakeClock(), 0.0)
+    rerank = _reranker(monkeypatch, model)
+
+    result = rerank.postprocess_nodes(_nodes(20), QueryBundle("query"))
+
+    assert model.batches == [20]
+    assert [n.node.node_id for n in result] == [f"n{i}" for i in reversed(range(20))]
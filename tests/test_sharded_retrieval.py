@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import QueryBundle, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from src.bm25_store import BM25Index
+from src.hybrid_retriever import HybridRetriever
+from src.sharding import ShardedRetriever
+from src.vector_store import MmapVectorStore
+
+WORDS = (
+    "index shard vector query token budget cache latency memory disk batch stream "
+    "merge rank score fusion lexical dense embed chunk parse file page filter "
+    "version build swap lock tree node graph cosine matrix sparse corpus"
+).split()
+DIM = 16
+
+
+def _embed(text: str, rng: np.random.Generator) -> list:
+    """Bag-of-words hashed into DIM buckets plus noise, so dense and BM25 rankings differ."""
+    vec = np.zeros(DIM, dtype=np.float32)
+    for word in text.split():
+        vec[WORDS.index(word) % DIM] += 1.0
+    return (vec + rng.normal(0, 0.5, DIM)).tolist()
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(7)
+    nodes = []
+    for i in range(90):
+        # Zipf-like word choice gives terms very different document frequencies
+        words = rng.choice(WORDS, size=int(rng.integers(5, 30)), p=_zipf(len(WORDS)))
+        text = " ".join(words)
+        nodes.append(TextNode(id_=f"node-{i:03d}", text=text, embedding=_embed(text, rng)))
+    queries = []
+    for _ in range(25):
+        text = " ".join(rng.choice(WORDS, size=int(rng.integers(1, 4))))
+        queries.append(QueryBundle(query_str=text, embedding=_embed(text, rng)))
+    return nodes, queries
+
+
+def _zipf(n: int) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1)
+    return weights / weights.sum()
+
+
+def _retriever(nodes, **kwargs) -> HybridRetriever:
+    vector_store = MmapVectorStore()
+    vector_store.add(nodes)
+    bm25 = BM25Index()
+    bm25.add(nodes)
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+    return HybridRetriever(vector_store, bm25, docstore, **kwargs)
+
+
+@pytest.mark.parametrize("mode", ["rrf", "weighted"])
+@pytest.mark.parametrize("n_shards", [2, 3, 8])
+def test_sharded_top_k_matches_single_index(corpus, mode, n_shards):
+    nodes, queries = corpus
+    kwargs = dict(similarity_top_k=5, candidate_k=10, mode=mode)
+    single = _retriever(nodes, **kwargs)
+    sharded = ShardedRetriever(
+        {f"shard-{s}": _retriever(nodes[s::n_shards], **kwargs) for s in range(n_shards)},
+        similarity_top_k=5,
+    )
+
+    for query in queries:
+        expected = single.retrieve(query)
+        actual = sharded.retrieve(query)
+        assert [n.node.node_id for n in actual] == [n.node.node_id for n in expected], query.query_str
+        assert [n.score for n in actual] == pytest.approx([n.score for n in expected], rel=1e-5)
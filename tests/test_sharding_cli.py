@@ -0,0 +1,42 @@
+import pytest
+from src import config, loader, sharding
+from src.sharding import ShardedIndex, main, shard_key
+from src.storage import BuildInProgress, IndexStorage
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    data, storage = tmp_path / "data", tmp_path / "storage"
+    (data / "reports").mkdir(parents=True)
+    (data / "reports" / "q1.txt").write_text("quarterly report")
+    storage.mkdir()
+    monkeypatch.setattr(loader, "DATA_DIR", str(data))
+    monkeypatch.setattr(sharding, "DATA_DIR", str(data))
+    monkeypatch.setattr(IndexStorage, "active_dir", staticmethod(lambda root=None: str(storage)))
+    monkeypatch.setattr(config, "init_settings", lambda **kwargs: True)
+
+    def no_build(*args, **kwargs):
+        raise AssertionError("no build may start for an unknown shard")
+
+    monkeypatch.setattr(IndexStorage, "build_lock", staticmethod(no_build))
+    return data
+
+
+@pytest.mark.parametrize("shard_id", ["shard-typo", "..", "reports/../..", ""])
+def test_rebuild_rejects_unknown_shard_before_building(data_dir, shard_id, capsys):
+    assert main(["rebuild", shard_id]) == 2
+    assert "Unknown shard" in capsys.readouterr().err
+
+
+def test_rebuild_accepts_shard_of_a_data_file(data_dir, monkeypatch):
+    def busy(*args, **kwargs):
+        raise BuildInProgress("Another index build is running.")
+
+    monkeypatch.setattr(IndexStorage, "build_lock", staticmethod(busy))
+    assert main(["rebuild", shard_key(str(data_dir / "reports" / "q1.txt"))]) == 1
+
+
+@pytest.mark.parametrize("shard_id", ["..", "a/../b", "."])
+def test_rebuild_shard_refuses_path_like_ids(tmp_path, shard_id):
+    with pytest.raises(ValueError):
+        ShardedIndex(str(tmp_path)).rebuild_shard(shard_id)
@@ -0,0 +1,102 @@
+import os
+import pytest
+from llama_index.core import Document, Settings
+from llama_index.core.embeddings import MockEmbedding
+from src.indexer import DocumentIndexer
+from src.storage import CURRENT_FILE, VERSIONS_DIR, BuildInProgress, IndexStorage, StaleBaseVersion
+from src.vector_store import IDS_FILE, VECTORS_FILE
+
+
+@pytest.fixture
+def mock_embed(monkeypatch):
+    monkeypatch.setattr(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+
+
+def _build(root: str, *texts) -> str:
+    """Publish a version holding the published index plus `texts`."""
+    with IndexStorage.build_lock(root) as lock:
+        _, path = IndexStorage.new_version(lock)
+        index = IndexStorage.load_index(path, sharded=False) or DocumentIndexer.empty_index()
+        index = DocumentIndexer.add_to_index(index, [Document(text=t) for t in texts])
+        IndexStorage.persist_index(index, persist_dir=path)
+        IndexStorage.publish(lock)
+    return lock.version
+
+
+def _versions(root) -> list:
+    return sorted(os.listdir(os.path.join(root, VERSIONS_DIR)))
+
+
+def test_publish_swaps_current(tmp_path, mock_embed):
+    root = str(tmp_path)
+    first = _build(root, "Shards are rebuilt one at a time.")
+    assert IndexStorage.current_version(root) == first
+    assert IndexStorage.active_dir(root) == IndexStorage.version_dir(first, root)
+
+    second = _build(root, "The build lock serializes index builds.")
+
+    assert (tmp_path / CURRENT_FILE).read_text() == second
+    assert len(IndexStorage.load_index(root, sharded=False).docstore.docs) == 2
+    assert _versions(root) == sorted([first, second])
+
+
+def test_publish_refuses_stale_base(tmp_path, mock_embed):
+    root = str(tmp_path)
+    first = _build(root, "Shards are rebuilt one at a time.")
+
+    with IndexStorage.build_lock(root) as lock:
+        IndexStorage.new_version(lock)
+        (tmp_path / CURRENT_FILE).write_text("published-meanwhile")
+        with pytest.raises(StaleBaseVersion):
+            IndexStorage.publish(lock)
+
+    assert IndexStorage.current_version(root) == "published-meanwhile"
+    assert lock.base == first
+
+
+def test_build_lock_is_exclusive(tmp_path):
+    with IndexStorage.build_lock(str(tmp_path)):
+        with pytest.raises(BuildInProgress):
+            with IndexStorage.build_lock(str(tmp_path)):
+                pass
+
+
+def test_append_in_new_version_leaves_published_vectors_unchanged(tmp_path, mock_embed):
+    root = str(tmp_path)
+    first = _build(root, "Shards are rebuilt one at a time.")
+    published = tmp_path / VERSIONS_DIR / first
+    vectors, ids = (published / VECTORS_FILE).read_bytes(), (published / IDS_FILE).read_text()
+
+    with IndexStorage.build_lock(root) as lock:
+        _, path = IndexStorage.new_version(lock)
+        assert os.path.samefile(published / VECTORS_FILE, os.path.join(path, VECTORS_FILE))
+        index = IndexStorage.load_index(path, sharded=False)
+        index = DocumentIndexer.add_to_index(index, [Document(text="The build lock serializes index builds.")])
+        IndexStorage.persist_index(index, persist_dir=path)
+
+    assert (published / VECTORS_FILE).read_bytes() == vectors
+    assert (published / IDS_FILE).read_text() == ids
+    assert os.path.getsize(os.path.join(path, VECTORS_FILE)) > len(vectors)
+
+
+def test_prune_keeps_active_and_previous_version(tmp_path, mock_embed):
+    root = str(tmp_path)
+    versions = [_build(root, f"Document number {i}.") for i in range(3)]
+
+    assert _versions(root) == sorted(versions[1:])
+
+    IndexStorage.prune_versions(root, keep={IndexStorage.current_version(root)})
+    assert _versions(root) == [versions[2]]
+
+
+def test_prune_keeps_version_of_a_running_build(tmp_path, mock_embed):
+    root = str(tmp_path)
+    active = _build(root, "Shards are rebuilt one at a time.")
+
+    with IndexStorage.build_lock(root) as lock:
+        building, _ = IndexStorage.new_version(lock)
+        IndexStorage.prune_versions(root, keep={active})
+        assert _versions(root) == sorted([active, building])
+
+    IndexStorage.prune_versions(root, keep={active})
+    assert _versions(root) == [active]
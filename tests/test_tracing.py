@@ -0,0 +1,40 @@
+import json
+import pytest
+from llama_index.core.llms import ChatMessage, MockLLM
+from src import tracing
+
+
+@pytest.fixture
+def exported(tmp_path):
+    tracing.configure(True, export_dir=str(tmp_path), flush_interval=3600)
+    yield tmp_path
+    tracing.configure(True, export_dir=None)
+
+
+def test_streamed_completion_tokens_are_counted_once(exported):
+    llm = MockLLM(max_tokens=12)
+    with tracing.trace("chat") as t:
+        t.open_span("retrieve")
+        response = llm.stream_chat([ChatMessage(role="user", content="how are shards rebuilt")])
+        text = "".join(tracing.traced_stream(chunk.delta for chunk in response))
+
+    assert t.counters["tokens.completion"] == tracing.count_tokens(text) > 0
+
+
+def test_completion_tokens_of_a_plain_call_are_counted(exported):
+    with tracing.trace("chat") as t:
+        response = MockLLM(max_tokens=12).complete("how are shards rebuilt")
+
+    assert t.counters["tokens.completion"] == tracing.count_tokens(response.text) > 0
+
+
+def test_traces_are_exported_by_flush_not_on_record(exported):
+    for _ in range(3):
+        with tracing.trace("chat"):
+            pass
+
+    assert not (exported / "metrics.json").exists()
+    tracing.metrics.flush()
+
+    assert len((exported / "traces.jsonl").read_text().splitlines()) == 3
+    assert json.loads((exported / "metrics.json").read_text())["counters"]["chat.count"] >= 3